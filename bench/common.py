@@ -0,0 +1,35 @@
+"""Общее для бенчмарков: окружение по умолчанию и путь к коду бота."""
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Чтобы бенчмарки работали без .env; заданные переменные не трогаем
+DEFAULT_ENV = {
+    "BOT_TOKEN": "123456:BENCH",
+    "admin_id": "1",
+    "SUB_DURATION_DAYS": "30",
+    "SUB_PRICE_STARS": "100",
+}
+
+
+def setup(database_url: str | None = None) -> str:
+    """Подготовить окружение до импорта модулей бота. Возвращает URL базы.
+
+    По умолчанию — свежая SQLite во временном каталоге; для Postgres
+    передайте BENCH_DATABASE_URL (база будет наполнена тестовыми данными).
+    """
+    url = database_url or os.getenv("BENCH_DATABASE_URL")
+    if not url:
+        path = Path(tempfile.mkdtemp(prefix="bot-bench-")) / "bench.db"
+        url = f"sqlite+aiosqlite:///{path}"
+    os.environ["DATABASE_URL"] = url
+    for key, value in DEFAULT_ENV.items():
+        os.environ.setdefault(key, value)
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    return url
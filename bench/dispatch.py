@@ -0,0 +1,142 @@
+"""Стоимость маршрутизации апдейта до обработчика.
+
+Прогоняет типовые апдейты через настоящие роутеры бота, но вместо вызова
+обработчика внутренний middleware сразу возвращает его имя. Замеряется
+только выбор обработчика: фильтры роутеров и проверки каждого хендлера.
+Сравниваются два режима — обычный перебор aiogram и индекс routing.py.
+Скрипт падает (код 1), если режимы выбрали разные обработчики.
+
+    python bench/dispatch.py
+    python bench/dispatch.py --rounds 2000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+from common import setup
+
+setup()
+
+import fakes  # noqa: E402
+
+ADMIN = 1
+CUSTOMER = 5001
+
+
+def updates(states) -> list:
+    """(апдейт, raw_state)."""
+    return [
+        (fakes.message(CUSTOMER, "/start"), None),
+        (fakes.message(CUSTOMER, "📋 Открыть меню"), None),
+        (fakes.callback(CUSTOMER, "cat_3"), None),
+        (fakes.callback(CUSTOMER, "show_product_details:5"), None),
+        (fakes.callback(CUSTOMER, "prod_5"), None),
+        (fakes.callback(CUSTOMER, "inc_5"), None),
+        (fakes.callback(CUSTOMER, "dec_5"), None),
+        (fakes.message(CUSTOMER, "🛒 Корзина"), None),
+        (fakes.callback(CUSTOMER, "checkout"), None),
+        (fakes.message(CUSTOMER, "Москва, ул. Ленина, 10"), states.waiting_for_address.state),
+        (fakes.callback(CUSTOMER, "pay_cash"), states.waiting_for_payment_method.state),
+        (fakes.callback(CUSTOMER, "exit_cart"), None),
+        (fakes.callback(CUSTOMER, "back_to_main_menu"), None),
+        (fakes.message(CUSTOMER, "🤩 Подписка"), None),
+        (fakes.message(CUSTOMER, "💬 Поддержка"), None),
+        (fakes.message(CUSTOMER, "просто текст"), None),
+        (fakes.message(ADMIN, "/orders"), None),
+        (fakes.callback(ADMIN, "order:12"), None),
+        (fakes.callback(ADMIN, "order_done:12"), None),
+        (fakes.message(ADMIN, "📊 Статистика"), None),
+        (fakes.callback(ADMIN, "inc_5"), None),
+    ]
+
+
+async def resolved(handler, event, data):
+    # Вместо обработчика — его имя
+    return data["handler"].callback.__name__
+
+
+def label(update: dict) -> str:
+    if "callback_query" in update:
+        return "cb " + update["callback_query"]["data"]
+    return "msg " + update["message"].get("text", "")
+
+
+async def run(rounds: int) -> int:
+    from aiogram import Bot, Dispatcher
+    from aiogram.dispatcher.event.telegram import TelegramEventObserver
+    from aiogram.types import Update
+
+    import routing
+    from routers.admin import router as admin_router
+    from routers.subscriptions import router as subscriptions_router
+    from routers.user import CartSG, router as user_router
+
+    dp = Dispatcher()
+    dp.message.middleware(resolved)
+    dp.callback_query.middleware(resolved)
+    dp.include_router(admin_router)
+    dp.include_router(user_router)
+    dp.include_router(subscriptions_router)
+
+    bot = Bot("123456:BENCH")
+    cases = []
+    for raw, raw_state in updates(CartSG):
+        update = Update.model_validate(raw, context={"bot": bot})
+        event = update.event
+        user = event.from_user
+        chat = event.chat if update.message else event.message.chat
+        data = dict(bot=bot, raw_state=raw_state, event_from_user=user, event_chat=chat)
+        cases.append((label(raw), update.event_type, event, data))
+
+    async def measure() -> list:
+        results = []
+        for name, event_type, event, data in cases:
+            handler = await dp.propagate_event(event_type, event, **data)
+            samples = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                await dp.propagate_event(event_type, event, **data)
+                samples.append(time.perf_counter() - started)
+            results.append((name, handler, statistics.median(samples)))
+        return results
+
+    indexed_trigger = routing.IndexedEventObserver.trigger
+    routing.IndexedEventObserver.trigger = TelegramEventObserver.trigger
+    try:
+        linear = await measure()
+    finally:
+        routing.IndexedEventObserver.trigger = indexed_trigger
+    indexed = await measure()
+    await bot.session.close()
+
+    mismatches = []
+    print(f"{'апдейт':<36} {'обработчик':<24} {'перебор, мкс':>13} {'индекс, мкс':>12}")
+    for (name, handler, before), (_, chosen, after) in zip(linear, indexed):
+        handler = handler if isinstance(handler, str) else "—"
+        chosen = chosen if isinstance(chosen, str) else "—"
+        if handler != chosen:
+            mismatches.append(f"{name}: перебор → {handler}, индекс → {chosen}")
+        print(f"{name[:36]:<36} {chosen:<24} {before * 1e6:>13.1f} {after * 1e6:>12.1f}")
+    before = statistics.mean(t for _, _, t in linear)
+    after = statistics.mean(t for _, _, t in indexed)
+    print(f"\nв среднем на апдейт: перебор {before * 1e6:.1f} мкс, индекс {after * 1e6:.1f} мкс "
+          f"(×{before / after:.1f})")
+    if mismatches:
+        print("\nРазные обработчики:", *mismatches, sep="\n  ")
+        return 1
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=500, help="повторов на апдейт")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.rounds)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Фейковый Bot API и конструкторы апдейтов для прогонов через Dispatcher.
+
+FakeBotAPI — HTTP-сервер, FakeSession — сессия aiogram без сети. Оба
+отвечают на любой метод как настоящий Telegram: send*/edit* — объектом
+Message, getWebhookInfo — последним setWebhook, остальное — True.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import Response, TelegramMethod
+from aiohttp import web
+
+_MESSAGE_METHODS = {
+    "sendMessage", "sendPhoto", "sendDocument", "sendInvoice",
+    "editMessageText", "editMessageCaption", "editMessageReplyMarkup",
+}
+
+
+def _webhook_info(webhook: Dict[str, Any]) -> Dict[str, Any]:
+    info = {"url": webhook.get("url", ""), "has_custom_certificate": False, "pending_update_count": 0}
+    if webhook.get("max_connections"):
+        info["max_connections"] = int(webhook["max_connections"])
+    if webhook.get("allowed_updates"):
+        allowed = webhook["allowed_updates"]
+        info["allowed_updates"] = json.loads(allowed) if isinstance(allowed, str) else allowed
+    return info
+
+
+def _result(method: str, data: Dict[str, Any], message_ids, webhook: Dict[str, Any]) -> Any:
+    if method == "setWebhook":
+        webhook.clear()
+        webhook.update(data)
+    elif method == "deleteWebhook":
+        webhook.clear()
+    elif method == "getWebhookInfo":
+        return _webhook_info(webhook)
+    if method not in _MESSAGE_METHODS:
+        return True
+    reply_markup = data.get("reply_markup")
+    result = {
+        "message_id": int(data.get("message_id") or next(message_ids)),
+        "date": int(time.time()),
+        "chat": {"id": int(data.get("chat_id") or 0), "type": "private"},
+        "text": data.get("text", ""),
+    }
+    if reply_markup:
+        markup = json.loads(reply_markup) if isinstance(reply_markup, str) else reply_markup
+        if "inline_keyboard" in markup:
+            result["reply_markup"] = markup
+    return result
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *, record: bool = True) -> None:
+        self.host = host
+        self.port = port
+        # record=False — не копить вызовы (долгие нагрузочные прогоны)
+        self.record = record
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        # Вызывается на каждый запрос бота: on_call(метод, параметры)
+        self.on_call: Callable[[str, Dict[str, Any]], None] | None = None
+        # Задержка ответа, секунды: имитация сетевой задержки до Telegram
+        self.latency = 0.0
+        self._message_ids = itertools.count(1000)
+        self._webhook: Dict[str, Any] = {}
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            data = await request.json()
+        else:
+            data = {k: v for k, v in (await request.post()).items() if isinstance(v, str)}
+        if self.record:
+            self.calls.append((method, data))
+        if self.on_call is not None:
+            self.on_call(method, data)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": _result(method, data, self._message_ids, self._webhook)})
+
+    async def start(self) -> "FakeBotAPI":
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class FakeSession(AiohttpSession):
+    """Сессия, которая отвечает сразу, не выходя в сеть.
+
+    Запрос сериализуется как обычно (это работа бота, её и меряем), но
+    вместо HTTP ответ собирается на месте. В ``calls`` — число вызовов
+    по методам.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls: Counter[str] = Counter()
+        self._message_ids = itertools.count(1000)
+        self._webhook: Dict[str, Any] = {}
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int | None = None) -> Any:
+        name = method.__api_method__
+        self.calls[name] += 1
+        form = self.build_form_data(bot=bot, method=method)
+        data = {field.get("name"): value for field, _, value in form._fields if isinstance(value, str)}
+        response = Response[method.__returning__].model_validate(
+            {"ok": True, "result": _result(name, data, self._message_ids, self._webhook)}, context={"bot": bot}
+        )
+        return response.result
+
+
+_update_ids = itertools.count(1)
+
+
+def _user(tg_id: int) -> Dict[str, Any]:
+    return {"id": tg_id, "is_bot": False, "first_name": f"User{tg_id}"}
+
+
+def _chat(tg_id: int) -> Dict[str, Any]:
+    return {"id": tg_id, "type": "private", "first_name": f"User{tg_id}"}
+
+
+def message(tg_id: int, text: str | None = None, **extra: Any) -> Dict[str, Any]:
+    msg = {
+        "message_id": next(_update_ids),
+        "date": int(time.time()),
+        "chat": _chat(tg_id),
+        "from": _user(tg_id),
+        **extra,
+    }
+    if text is not None:
+        msg["text"] = text
+        if text.startswith("/"):
+            command = text.split()[0]
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": next(_update_ids), "message": msg}
+
+
+def contact(tg_id: int, phone: str) -> Dict[str, Any]:
+    return message(tg_id, contact={"phone_number": phone, "first_name": "U", "user_id": tg_id})
+
+
+def callback(tg_id: int, data: str, message_id: int = 1) -> Dict[str, Any]:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(tg_id),
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": _chat(tg_id),
+                "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+                "text": "…",
+            },
+        },
+    }
+
+
+def pre_checkout_query(tg_id: int, total_amount: int, payload: str = "food-delivery-payload") -> Dict[str, Any]:
+    return {
+        "update_id": next(_update_ids),
+        "pre_checkout_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(tg_id),
+            "currency": "RUB",
+            "total_amount": total_amount,
+            "invoice_payload": payload,
+        },
+    }
+
+
+def successful_payment(tg_id: int, total_amount: int, payload: str = "food-delivery-payload") -> Dict[str, Any]:
+    charge = f"bench-{next(_update_ids)}"
+    return message(tg_id, successful_payment={
+        "currency": "RUB",
+        "total_amount": total_amount,
+        "invoice_payload": payload,
+        "telegram_payment_charge_id": charge,
+        "provider_payment_charge_id": charge,
+    })
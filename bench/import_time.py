@@ -0,0 +1,109 @@
+"""Холодный старт бота: время импорта main и сборки диспетчера.
+
+Каждый замер — отдельный процесс python, поэтому кэш модулей не мешает.
+Бюджет задаётся сверх голого ``import aiogram``, замеренного так же: сам
+aiogram на разных машинах грузится от десятых долей до секунд, а бот
+отвечает только за то, что добавляет к нему. Скрипт падает (код 1), если
+медиана добавки больше бюджета или если при старте подгрузилась тяжёлая
+библиотека, которая должна грузиться лениво.
+
+    python bench/import_time.py                 # бюджет из IMPORT_BUDGET или 1.5 с
+    python bench/import_time.py --budget 0.8 --runs 7 --top 15
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from common import DEFAULT_ENV, ROOT
+
+# Нужны только экспорту/отчётам, на старте их быть не должно
+LAZY_MODULES = ["pandas", "numpy", "openpyxl", "PIL", "pytz", "multiprocessing"]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"elapsed": elapsed, "modules": sorted(sys.modules)}}))
+"""
+BOT = "import main\nmain.build_dispatcher()"
+BASELINE = "import aiogram"
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+    for key, value in DEFAULT_ENV.items():
+        env.setdefault(key, value)
+    return env
+
+
+def measure(code: str) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE.format(code=code)],
+        cwd=ROOT, env=_env(), capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list[tuple[int, str]]:
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main; main.build_dispatcher()"],
+        cwd=ROOT, env=_env(), capture_output=True, text=True, check=True,
+    ).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        # main и роутеры и их прямые импорты: время уже включает вложенные
+        if cumulative.strip().isdigit() and depth <= 1 and name.strip() != "main":
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=float(os.getenv("IMPORT_BUDGET", "1.5")),
+                        help="секунд сверх import aiogram")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0, help="показать N самых долгих импортов")
+    args = parser.parse_args()
+
+    # Замеры чередуются, чтобы фоновая нагрузка сказалась на обоих одинаково
+    results, baseline = [], []
+    for _ in range(args.runs):
+        baseline.append(measure(BASELINE)["elapsed"])
+        results.append(measure(BOT))
+    timings = [r["elapsed"] for r in results]
+    median = statistics.median(timings)
+    overhead = median - statistics.median(baseline)
+    print(f"cold start: median {median:.3f} s, min {min(timings):.3f} s, "
+          f"max {max(timings):.3f} s ({args.runs} runs)")
+    print(f"import aiogram: median {statistics.median(baseline):.3f} s; "
+          f"бот сверх него {overhead:.3f} s, бюджет {args.budget:.3f} s")
+
+    if args.top:
+        for cumulative, name in slowest_imports(args.top):
+            print(f"  {cumulative / 1e6:8.3f} s  {name}")
+
+    failed = False
+    loaded = set(results[0]["modules"])
+    eager = [m for m in LAZY_MODULES if m in loaded]
+    if eager:
+        print(f"FAIL: при старте импортированы {', '.join(eager)}")
+        failed = True
+    if overhead > args.budget:
+        print(f"FAIL: бот добавляет к import aiogram {overhead:.3f} s, бюджет {args.budget:.3f} s")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
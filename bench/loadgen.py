@@ -0,0 +1,398 @@
+"""Нагрузочный тест: виртуальные покупатели проходят воронку заказа.
+
+Бот запускается отдельным процессом в режиме webhook, как в проде, и ходит
+в фейковый Bot API по HTTP (fakes.FakeBotAPI). Каждый виртуальный
+покупатель — новый пользователь Telegram, который проходит воронку:
+
+    /start → контакт → меню → категория → товар → корзина → оформление →
+    адрес → комментарий → оплата наличными или онлайн
+
+Шаг выполнен, когда бот отправил ожидаемый ответ (например, клавиатуру
+категорий на «Открыть меню»); задержка шага — от отправки апдейта на
+вебхук до этого ответа. Не дождались за --timeout или вебхук ответил не
+200 — ошибка, и покупатель начинает воронку заново.
+
+Число покупателей растёт ступенями (--start, --step, --max) по --stage
+секунд. По каждой ступени печатаются шагов и заказов в секунду, p50/p95/p99
+задержки шага и доля ошибок, а в конце — где система насытилась.
+
+    python bench/loadgen.py
+    python bench/loadgen.py --start 10 --step 10 --max 100 --stage 20 --workers 2
+    python bench/loadgen.py --think 1 --online 0.3 --api-latency 50 --json load.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import secrets
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, List
+
+from common import ROOT, setup
+
+setup()
+
+import aiohttp  # noqa: E402
+
+import fakes  # noqa: E402
+
+PRICE = Decimal("1200.00")
+ADDRESS = "Москва, ул. Ленина, д. 10, кв. 5"
+
+
+@dataclass
+class Step:
+    name: str
+    update: Dict[str, Any]
+    # Подстрока в ответе бота (текст, подпись, клавиатура) ...
+    expect: str = ""
+    # ... или метод, которым бот отвечает не в чат (answerPreCheckoutQuery)
+    method: str = ""
+
+    def matches(self, method: str, data: Dict[str, Any]) -> bool:
+        if self.method:
+            return method == self.method
+        return any(isinstance(v, str) and self.expect in v for v in data.values())
+
+
+def funnel(user: int, product_id: int, category_id: int, online: bool) -> List[Step]:
+    steps = [
+        Step("start", fakes.message(user, "/start"), "номером телефона"),
+        Step("contact", fakes.contact(user, "+79990000000"), "открыть меню"),
+        Step("menu", fakes.message(user, "📋 Открыть меню"), f'"cat_{category_id}"'),
+        Step("category", fakes.callback(user, f"cat_{category_id}"), f"show_product_details:{product_id}"),
+        Step("product", fakes.callback(user, f"show_product_details:{product_id}"), f'"prod_{product_id}"'),
+        Step("cart", fakes.callback(user, f"prod_{product_id}"), "Итого"),
+        Step("checkout", fakes.callback(user, "checkout"), "интерактивную карту"),
+        Step("address", fakes.message(user, ADDRESS), "комментарий к заказу"),
+        Step("comment", fakes.message(user, "-"), "способ оплаты"),
+    ]
+    if not online:
+        steps.append(Step("pay_cash", fakes.callback(user, "pay_cash"), "Заказ оформлен"))
+        return steps
+    amount = int(PRICE * 100)
+    steps += [
+        Step("pay_online", fakes.callback(user, "pay_online"), "Оплата заказа"),
+        Step("pre_checkout", fakes.pre_checkout_query(user, amount), method="answerPreCheckoutQuery"),
+        Step("payment", fakes.successful_payment(user, amount), "Заказ оформлен"),
+    ]
+    return steps
+
+
+@dataclass
+class Stage:
+    users: int
+    started: float = field(default_factory=time.monotonic)
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    errors: Counter = field(default_factory=Counter)
+    orders: int = 0
+
+    def summary(self) -> Dict[str, Any]:
+        done = len(self.latencies)
+        failed = sum(self.errors.values())
+        ordered = sorted(self.latencies) or [0.0]
+
+        def pct(q: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+        return {
+            "users": self.users,
+            "seconds": round(self.elapsed, 1),
+            "steps_per_second": round(done / self.elapsed, 1) if self.elapsed else 0.0,
+            "orders_per_second": round(self.orders / self.elapsed, 2) if self.elapsed else 0.0,
+            "p50_ms": round(statistics.median(ordered) * 1000, 1),
+            "p95_ms": pct(0.95),
+            "p99_ms": pct(0.99),
+            "error_rate": round(failed / (done + failed), 4) if done + failed else 0.0,
+            "errors": dict(self.errors),
+        }
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace, webhook_url: str, secret: str, catalog: tuple[int, int]) -> None:
+        self.args = args
+        self.webhook_url = webhook_url
+        self.secret = secret
+        self.product_id, self.category_id = catalog
+        # Пользователи каждого прогона новые — чтобы не задеть состояние прошлых
+        self.user_ids = itertools.count(random.randrange(10**9, 2 * 10**9, 10**6))
+        self.waiting: Dict[int, tuple[Step, asyncio.Future]] = {}
+        # id колбэка / pre_checkout_query -> пользователь
+        self.reply_ids: Dict[str, int] = {}
+        self.stage: Stage | None = None
+        self.stopping = False
+        self.http: aiohttp.ClientSession | None = None
+
+    def on_call(self, method: str, data: Dict[str, Any]) -> None:
+        chat_id = data.get("chat_id")
+        if chat_id is not None:
+            user = int(chat_id)
+        else:
+            user = self.reply_ids.get(data.get("callback_query_id") or data.get("pre_checkout_query_id"))
+        waiter = self.waiting.get(user)
+        if waiter is None:
+            return
+        step, future = waiter
+        if not future.done() and step.matches(method, data):
+            future.set_result(time.monotonic())
+
+    async def step(self, user: int, step: Step) -> bool:
+        for kind in ("callback_query", "pre_checkout_query"):
+            if kind in step.update:
+                self.reply_ids[step.update[kind]["id"]] = user
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[user] = (step, future)
+        started = time.monotonic()
+        error = None
+        try:
+            async with self.http.post(
+                self.webhook_url, json=step.update, headers={"X-Telegram-Bot-Api-Secret-Token": self.secret}
+            ) as response:
+                if response.status != 200:
+                    error = f"{step.name}: HTTP {response.status}"
+            if error is None:
+                finished = await asyncio.wait_for(future, self.args.timeout)
+        except asyncio.TimeoutError:
+            error = f"{step.name}: нет ответа"
+        except aiohttp.ClientError as e:
+            error = f"{step.name}: {type(e).__name__}"
+        finally:
+            self.waiting.pop(user, None)
+        if error is not None:
+            self.stage.errors[error] += 1
+            return False
+        self.stage.latencies.append(finished - started)
+        return True
+
+    async def customer(self) -> None:
+        while not self.stopping:
+            user = next(self.user_ids)
+            online = random.random() < self.args.online
+            for step in funnel(user, self.product_id, self.category_id, online):
+                if self.stopping or not await self.step(user, step):
+                    break
+                if self.args.think:
+                    await asyncio.sleep(random.uniform(0, 2 * self.args.think))
+            else:
+                self.stage.orders += 1
+            for key in [k for k, v in self.reply_ids.items() if v == user]:
+                del self.reply_ids[key]
+
+    async def warmup(self) -> bool:
+        """Дождаться ответов от всех воркеров: /healthz отвечает раньше, чем они готовы.
+
+        Апдейты раскладываются по воркерам по chat_id, поэтому пробных
+        пользователей несколько на воркер.
+        """
+        self.stage = Stage(0)
+        timeout, self.args.timeout = self.args.timeout, 60
+        probes = [next(self.user_ids) for _ in range(max(1, self.args.workers) * 4)]
+        try:
+            done = await asyncio.gather(*(
+                self.step(user, Step("warmup", fakes.message(user, "/start"), "номером телефона"))
+                for user in probes
+            ))
+        finally:
+            self.args.timeout = timeout
+        return all(done)
+
+    async def run(self) -> List[Dict[str, Any]]:
+        args = self.args
+        connector = aiohttp.TCPConnector(limit=0)
+        self.http = aiohttp.ClientSession(connector=connector)
+        tasks: List[asyncio.Task] = []
+        results = []
+        if not await self.warmup():
+            await self.http.close()
+            raise RuntimeError(f"бот не отвечает: {dict(self.stage.errors)}")
+        print(f"{'польз.':>7} {'шаг/с':>8} {'заказ/с':>8} {'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8} {'ошибки':>7}")
+        try:
+            for users in range(args.start, args.max + 1, args.step):
+                self.stage = stage = Stage(users)
+                while len(tasks) < users:
+                    tasks.append(asyncio.create_task(self.customer()))
+                await asyncio.sleep(args.stage)
+                stage.elapsed = time.monotonic() - stage.started
+                summary = stage.summary()
+                results.append(summary)
+                print(
+                    f"{users:>7} {summary['steps_per_second']:>8.1f} {summary['orders_per_second']:>8.2f} "
+                    f"{summary['p50_ms']:>8.1f} {summary['p95_ms']:>8.1f} {summary['p99_ms']:>8.1f} "
+                    f"{summary['error_rate']:>7.1%}",
+                    flush=True,
+                )
+        finally:
+            self.stopping = True
+            # Шаги, начатые в последней ступени, дожидаются ответа или таймаута
+            await asyncio.wait(tasks, timeout=args.timeout + 1)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.http.close()
+        return results
+
+
+def saturation(results: List[Dict[str, Any]], slo_ms: float) -> str:
+    best = max(results, key=lambda r: r["steps_per_second"])
+    lines = [f"максимум: {best['steps_per_second']} шагов/с при {best['users']} пользователях"]
+    for previous, current in zip(results, results[1:]):
+        if current["steps_per_second"] < previous["steps_per_second"] * 1.05:
+            lines.append(
+                f"пропускная способность перестала расти после {previous['users']} пользователей "
+                f"({previous['steps_per_second']} → {current['steps_per_second']} шагов/с)"
+            )
+            break
+    for result in results:
+        if result["p99_ms"] > slo_ms or result["error_rate"] > 0.01:
+            lines.append(
+                f"p99 > {slo_ms:.0f} мс или ошибок > 1% начиная с {result['users']} пользователей "
+                f"(p99 {result['p99_ms']} мс, ошибок {result['error_rate']:.1%})"
+            )
+            break
+    errors = Counter()
+    for result in results:
+        errors.update(result["errors"])
+    if errors:
+        lines.append("ошибки: " + ", ".join(f"{name} × {n}" for name, n in errors.most_common()))
+    return "\n".join(lines)
+
+
+async def seed() -> tuple[int, int]:
+    import db
+    import models
+
+    await db.init_db()
+    async with db.async_session_factory() as session:
+        category = models.Category(title=f"Нагрузка {uuid.uuid4().hex[:8]}")
+        session.add(category)
+        await session.flush()
+        product = models.Product(
+            category_id=category.id, title="Товар", description="…", price=PRICE, is_active=True
+        )
+        session.add(product)
+        await session.commit()
+        ids = product.id, category.id
+    await db.engine.dispose()
+    return ids
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def start_bot(args: argparse.Namespace, api_url: str, port: int, secret: str, workdir: Path):
+    env = {
+        **os.environ,
+        "RUN_MODE": "webhook",
+        "TELEGRAM_API_URL": api_url,
+        "WEBHOOK_URL": f"http://127.0.0.1:{port}",
+        "WEBHOOK_SECRET": secret,
+        "WEBAPP_HOST": "127.0.0.1",
+        "WEBAPP_PORT": str(port),
+        "WORKERS": str(args.workers),
+        "METRICS_PORT": "0",
+        "LOG_FILE": str(workdir / "bot.log"),
+    }
+    stderr = (workdir / "stderr.log").open("wb")
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "main.py", cwd=ROOT, env=env, stdout=asyncio.subprocess.DEVNULL, stderr=stderr,
+    )
+    deadline = time.monotonic() + 60
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            if process.returncode is not None:
+                break
+            try:
+                async with http.get(f"http://127.0.0.1:{port}/healthz") as response:
+                    if response.status == 200:
+                        return process
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    if process.returncode is None:
+        process.kill()
+        await process.wait()
+    tail = (workdir / "stderr.log").read_text(encoding="utf-8", errors="replace")[-3000:]
+    raise RuntimeError(f"бот не запустился:\n{tail}")
+
+
+async def run(args: argparse.Namespace) -> int:
+    catalog = await seed()
+    api = await fakes.FakeBotAPI(record=False).start()
+    api.latency = args.api_latency / 1000
+    workdir = Path(tempfile.mkdtemp(prefix="bot-load-"))
+    port = free_port()
+    secret = secrets.token_hex(16)
+    try:
+        process = await start_bot(args, api.url, port, secret, workdir)
+    except RuntimeError as e:
+        await api.stop()
+        print(e)
+        return 1
+
+    test = LoadTest(args, f"http://127.0.0.1:{port}/webhook", secret, catalog)
+    api.on_call = test.on_call
+    try:
+        results = await test.run()
+    except RuntimeError as e:
+        print(e)
+        return 1
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), 30)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+        await api.stop()
+
+    print()
+    print(saturation(results, args.slo))
+    print(f"\nлоги бота: {workdir}")
+    if args.json:
+        args.json.write_text(json.dumps({
+            "workers": args.workers,
+            "think": args.think,
+            "online": args.online,
+            "api_latency_ms": args.api_latency,
+            "stages": results,
+        }, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--start", type=int, default=5, help="покупателей на первой ступени")
+    parser.add_argument("--step", type=int, default=5, help="прибавка покупателей на ступень")
+    parser.add_argument("--max", type=int, default=50, help="покупателей на последней ступени")
+    parser.add_argument("--stage", type=float, default=10, help="длительность ступени, с")
+    parser.add_argument("--think", type=float, default=0.0, help="средняя пауза между шагами, с")
+    parser.add_argument("--online", type=float, default=0.2, help="доля онлайн-оплат")
+    parser.add_argument("--timeout", type=float, default=10, help="ожидание ответа на шаг, с")
+    parser.add_argument("--slo", type=float, default=1000, help="порог p99 для вывода о насыщении, мс")
+    parser.add_argument("--workers", type=int, default=0, help="WORKERS бота")
+    parser.add_argument("--api-latency", type=float, default=0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--json", type=Path, help="сохранить результаты ступеней")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Задержка оформления заказа в зависимости от размера корзины.
+
+Сравнивает прежнюю схему _finalize_order (отдельный запрос подписки, выборка
+товаров, ORM-объект заказа с flush и по объекту на каждую позицию) с
+checkout.place_order (один SELECT пользователя с подпиской, INSERT ... RETURNING
+заказа и один многострочный INSERT позиций).
+
+    python bench/order_placement.py --sizes 1 10 50 200 --repeat 30
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from decimal import Decimal
+
+from common import setup
+
+setup()
+
+from sqlalchemy import insert, select  # noqa: E402
+
+import db  # noqa: E402
+import stats  # noqa: E402
+from cache import catalog  # noqa: E402
+from checkout import place_order  # noqa: E402
+from models import Category, Order, OrderItem, Product, User  # noqa: E402
+
+TG_ID = 100500
+
+
+async def legacy_place_order(cart: dict[int, int]) -> int:
+    """Прежний путь: как _finalize_order до перехода на bulk insert."""
+    async with db.async_session_factory() as session:
+        subscription_end = await session.scalar(
+            select(User.subscription_end).where(User.tg_id == TG_ID)
+        )
+    has_subscription = subscription_end is not None
+
+    async with db.async_session_factory() as session:
+        products_map = {
+            p.id: p
+            async for p in await session.stream_scalars(
+                select(Product).where(Product.id.in_(cart.keys()))
+            )
+        }
+        total = Decimal(sum(products_map[pid].price * qty for pid, qty in cart.items()))
+        db_user = await session.scalar(select(User).where(User.tg_id == TG_ID))
+        order = Order(
+            user_id=db_user.id,
+            status=stats.STATUS_NEW,
+            payment_method="оплата оффлайн",
+            total_price=total if not has_subscription else total,
+            comment="bench",
+            title=", ".join(products_map[pid].title for pid in cart),
+            address="bench",
+        )
+        session.add(order)
+        await session.flush()
+        await stats.order_created(session, order.total_price, order.status)
+        for pid, qty in cart.items():
+            prod = products_map[pid]
+            session.add(
+                OrderItem(
+                    order_id=order.id, product_id=pid, qty=qty,
+                    item_price=prod.price, title=prod.title,
+                )
+            )
+        await session.commit()
+        return order.id
+
+
+async def bulk_place_order(cart: dict[int, int]) -> int:
+    products = await catalog.products(cart.keys())
+    async with db.async_session_factory() as session:
+        order = await place_order(
+            session, TG_ID, cart, products, address="bench", comment="bench", pay_online=False
+        )
+        await session.commit()
+    return order.id
+
+
+async def seed(products: int) -> None:
+    await db.init_db()
+    async with db.async_session_factory() as session:
+        session.add(User(tg_id=TG_ID, full_name="bench"))
+        category = Category(title="bench")
+        session.add(category)
+        await session.flush()
+        await session.execute(
+            insert(Product),
+            [
+                {"category_id": category.id, "title": f"Товар {i}", "price": Decimal(100 + i)}
+                for i in range(products)
+            ],
+        )
+        await session.commit()
+
+
+async def measure(fn, cart: dict[int, int], repeat: int) -> float:
+    await fn(cart)  # прогрев
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn(cart)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    await seed(max(args.sizes))
+    async with db.async_session_factory() as session:
+        product_ids = (await session.scalars(select(Product.id).order_by(Product.id))).all()
+
+    try:
+        await _run(args, product_ids)
+    finally:
+        await db.engine.dispose()
+
+
+async def _run(args, product_ids: list[int]) -> None:
+    print(f"{'позиций':>8} {'прежний, мс':>12} {'bulk, мс':>10} {'ускорение':>10}")
+    for size in args.sizes:
+        cart = {pid: 1 + i % 3 for i, pid in enumerate(product_ids[:size])}
+        legacy = await measure(legacy_place_order, cart, args.repeat)
+        bulk = await measure(bulk_place_order, cart, args.repeat)
+        print(f"{size:>8} {legacy:>12.2f} {bulk:>10.2f} {legacy / bulk:>9.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,193 @@
+"""Бюджеты SQL-запросов по обработчикам.
+
+Прогоняет типовые сценарии покупателя и администратора через настоящий
+Dispatcher (фейковый Bot API, свежая SQLite) и считает запросы, которые
+выполнил каждый обработчик (querylog.QueryScope). Падает с кодом 1, если
+обработчик превысил бюджет, не был вызван или повторил один и тот же запрос
+N_PLUS_ONE_MIN и больше раз (N+1).
+
+Бюджет — потолок для «тёплого» каталога: кэш каталога прогревается до
+сценария, как это происходит в работающем боте.
+
+    python bench/query_budget.py
+    python bench/query_budget.py -v      # показать сами запросы
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+from decimal import Decimal
+
+from common import setup
+
+setup()
+os.environ["FSM_STORAGE"] = "memory"
+os.environ["METRICS_PORT"] = "0"
+
+import fakes  # noqa: E402
+
+ADMIN = 1
+CUSTOMER = 5001
+
+# Обработчик -> максимум запросов за один вызов
+BUDGETS = {
+    "cmd_start": 3,
+    "save_phone": 2,
+    "cmd_menu": 0,
+    "cb_open_category": 0,
+    "show_product_details": 0,
+    "cb_add_product": 1,
+    "cb_edit_cart": 0,
+    "cmd_cart": 0,
+    "cb_checkout": 0,
+    "set_address": 0,
+    "set_comment": 0,
+    "choose_payment": 4,
+    "list_orders": 1,
+    "order_details": 2,
+    "change_order_status": 5,
+    "bot_stats": 1,
+    "list_products": 2,
+    "delete_category": 2,
+    # Отложенная перерисовка корзины после ➕/➖ (debounce.cart_renders)
+    "render_cart": 0,
+}
+
+# Обработчики, которые дополнительно пишут по уведомлению каждому админу
+PER_ADMIN = {"choose_payment"}
+
+# Работа, которую обработчик откладывает в фоновую задачу: её дожидаемся
+# внутри замера и проверяем по своему бюджету
+DEFERRED = {"cb_edit_cart": ["render_cart"]}
+
+
+def scenario(product_id: int, category_id: int, spare_category_id: int) -> list:
+    """(апдейт, обработчик, который должен его обработать)."""
+    return [
+        (fakes.message(CUSTOMER, "/start"), "cmd_start"),
+        (fakes.contact(CUSTOMER, "+79990000000"), "save_phone"),
+        (fakes.message(CUSTOMER, "/menu"), "cmd_menu"),
+        (fakes.callback(CUSTOMER, f"cat_{category_id}"), "cb_open_category"),
+        (fakes.callback(CUSTOMER, f"show_product_details:{product_id}"), "show_product_details"),
+        (fakes.callback(CUSTOMER, f"prod_{product_id}"), "cb_add_product"),
+        (fakes.callback(CUSTOMER, f"inc_{product_id}"), "cb_edit_cart"),
+        (fakes.message(CUSTOMER, "/cart"), "cmd_cart"),
+        (fakes.callback(CUSTOMER, "checkout"), "cb_checkout"),
+        (fakes.message(CUSTOMER, "Москва, ул. Ленина, д. 10, кв. 5"), "set_address"),
+        (fakes.message(CUSTOMER, "-"), "set_comment"),
+        (fakes.callback(CUSTOMER, "pay_cash"), "choose_payment"),
+        (fakes.message(ADMIN, "/orders"), "list_orders"),
+        # id заказа подставляется после оформления
+        (lambda order_id: fakes.callback(ADMIN, f"order:{order_id}"), "order_details"),
+        (lambda order_id: fakes.callback(ADMIN, f"order_process:{order_id}"), "change_order_status"),
+        (fakes.message(ADMIN, "/stats"), "bot_stats"),
+        (fakes.message(ADMIN, "/products"), "list_products"),
+        (fakes.callback(ADMIN, f"remove_cat:{spare_category_id}"), "delete_category"),
+    ]
+
+
+async def seed(db, models) -> tuple[int, int, int]:
+    async with db.async_session_factory() as session:
+        session.add(models.User(tg_id=ADMIN, full_name="Admin", phone="+70000000000"))
+        food = models.Category(title="Еда")
+        spare = models.Category(title="Сезонное")
+        session.add_all([food, spare])
+        await session.flush()
+        products = [
+            models.Product(
+                category_id=food.id if i < 5 else spare.id,
+                title=f"Товар {i}",
+                description="…",
+                price=Decimal("600.00"),
+                is_active=True,
+            )
+            for i in range(10)
+        ]
+        session.add_all(products)
+        await session.commit()
+        return products[0].id, food.id, spare.id
+
+
+async def run(verbose: bool) -> int:
+    api = await fakes.FakeBotAPI().start()
+    os.environ["TELEGRAM_API_URL"] = api.url
+
+    import main
+    import models
+    import querylog
+    import stats
+    from cache import catalog
+    from config import admin_id
+    from debounce import cart_renders
+    from sqlalchemy import func, select
+
+    await main.init_db()
+    product_id, category_id, spare_id = await seed(main, models)
+    await stats.ensure_initialized(main.async_session_factory)
+    bot = main.build_bot()
+    dp = main.build_dispatcher()
+    await catalog.categories()
+
+    failures = []
+    rows = []
+    order_id = None
+    try:
+        for update, expected in scenario(product_id, category_id, spare_id):
+            if callable(update):
+                if order_id is None:
+                    async with main.async_session_factory() as session:
+                        order_id = await session.scalar(select(func.max(models.Order.id)))
+                update = update(order_id)
+            with querylog.capture() as scopes:
+                await dp.feed_raw_update(bot, update)
+                if expected in DEFERRED:
+                    await cart_renders.close()
+            for name in [expected, *DEFERRED.get(expected, ())]:
+                matched = [s for s in scopes if s.name == name]
+                if not matched:
+                    failures.append(f"{name}: не вызван (сработали: {[s.name for s in scopes]})")
+                    continue
+                scope = matched[0]
+                budget = BUDGETS[name] + (len(admin_id) if name in PER_ADMIN else 0)
+                status = "ok" if scope.count <= budget else "OVER"
+                if status != "ok":
+                    failures.append(f"{name}: {scope.count} запросов при бюджете {budget}")
+                repeated = scope.repeated()
+                if repeated:
+                    status = "N+1"
+                    failures.extend(f"{name}: N+1, {n}× {sql[:120]}" for sql, n in repeated)
+                rows.append((name, scope.count, budget, scope.seconds, status))
+                if verbose or status != "ok":
+                    for sql, n in scope.statements.items():
+                        rows.append((f"    {n}× {sql[:100]}", None, None, None, ""))
+    finally:
+        await cart_renders.close()
+        await dp.fsm.storage.close()
+        await bot.session.close()
+        await api.stop()
+        await main.engine.dispose()
+
+    print(f"{'обработчик':<32} {'запросов':>8} {'бюджет':>7} {'мс':>7}  статус")
+    for name, count, budget, seconds, status in rows:
+        if count is None:
+            print(name)
+            continue
+        print(f"{name:<32} {count:>8} {budget:>7} {seconds * 1000:>7.1f}  {status}")
+    if failures:
+        print("\nНарушения:", *failures, sep="\n  ")
+        return 1
+    print("\nВсе обработчики укладываются в бюджет.")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-v", "--verbose", action="store_true", help="показать запросы")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.verbose)))
+
+
+if __name__ == "__main__":
+    main()
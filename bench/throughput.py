@@ -0,0 +1,269 @@
+"""Пропускная способность диспетчера: апдейтов в секунду по сценариям.
+
+Синтетические Update прогоняются через настоящий Dispatcher из main (все
+middleware, роутеры, FSM и база), а Bot API подменён сессией, которая
+отвечает сразу (fakes.FakeSession). Каждый сценарий выполняют ``--users``
+покупателей одновременно, каждый — ``--iterations`` раз подряд; апдейты
+одного чата, как и в боте, обрабатываются по очереди.
+
+Результат дописывается строкой в JSONL (по умолчанию
+bench/results/throughput.jsonl) вместе с коммитом, базой и параметрами
+прогона и сравнивается с последним прогоном с теми же параметрами на
+другом коммите. С ``--max-regression`` скрипт падает (код 1), если
+апдейтов в секунду стало меньше больше чем на столько процентов.
+
+    python bench/throughput.py
+    python bench/throughput.py --users 32 --iterations 50 --scenario checkout
+    BENCH_DATABASE_URL=postgresql+asyncpg://... python bench/throughput.py --fsm db
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+
+from common import ROOT, setup
+
+DATABASE_URL = setup()
+os.environ["METRICS_PORT"] = "0"
+# Предупреждения о медленных запросах под нагрузкой ожидаемы и забивают таблицу
+logging.basicConfig(level=logging.ERROR)
+
+import fakes  # noqa: E402
+
+ADMIN = 1
+FIRST_CUSTOMER = 700000
+RESULTS = Path(__file__).resolve().parent / "results" / "throughput.jsonl"
+
+
+# Сценарий: (подготовка — один раз на пользователя, апдейты одной итерации)
+def scenarios(product_id: int, category_id: int) -> dict:
+    return {
+        "menu": (
+            lambda u: [],
+            lambda u: [fakes.message(u, "📋 Открыть меню")],
+        ),
+        "category": (
+            lambda u: [],
+            lambda u: [fakes.callback(u, f"cat_{category_id}")],
+        ),
+        "add_to_cart": (
+            lambda u: [],
+            lambda u: [fakes.callback(u, f"prod_{product_id}")],
+        ),
+        "cart_inc_dec": (
+            lambda u: [fakes.callback(u, f"prod_{product_id}")],
+            lambda u: [fakes.callback(u, f"inc_{product_id}"), fakes.callback(u, f"dec_{product_id}")],
+        ),
+        "checkout": (
+            lambda u: [],
+            lambda u: [
+                fakes.callback(u, f"prod_{product_id}"),
+                fakes.callback(u, "checkout"),
+                fakes.message(u, "Москва, ул. Ленина, д. 10, кв. 5"),
+                fakes.message(u, "-"),
+                fakes.callback(u, "pay_cash"),
+            ],
+        ),
+        # Админ один — его апдейты всегда идут по очереди
+        "admin_stats": (
+            lambda u: [],
+            lambda u: [fakes.message(ADMIN, "📊 Статистика")],
+        ),
+    }
+
+
+async def seed(db, models, users: int) -> tuple[int, int]:
+    """Категория с товарами и покупатели с телефоном; в Postgres — без дублей."""
+    from sqlalchemy import select
+
+    tg_ids = [ADMIN, *range(FIRST_CUSTOMER, FIRST_CUSTOMER + users)]
+    async with db.async_session_factory() as session:
+        existing = set(await session.scalars(select(models.User.tg_id).where(models.User.tg_id.in_(tg_ids))))
+        session.add_all(
+            models.User(tg_id=tg_id, full_name=f"Bench {tg_id}", phone="+79990000000")
+            for tg_id in tg_ids if tg_id not in existing
+        )
+        category = models.Category(title=f"Бенчмарк {uuid.uuid4().hex[:8]}")
+        session.add(category)
+        await session.flush()
+        products = [
+            models.Product(
+                category_id=category.id,
+                title=f"Товар {i}",
+                description="…",
+                price=Decimal("1200.00"),
+                is_active=True,
+            )
+            for i in range(12)
+        ]
+        session.add_all(products)
+        await session.commit()
+        return products[0].id, category.id
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_scenario(dp, bot, prepare, iteration, users: list[int], iterations: int) -> dict:
+    from aiogram.types import Update
+
+    from debounce import cart_renders
+
+    def build(raw: list) -> list:
+        return [Update.model_validate(u, context={"bot": bot}) for u in raw]
+
+    for user in users:
+        for update in build(prepare(user)):
+            await dp.feed_update(bot, update)
+    # Прогрев: кэши каталога и клавиатур, ленивые импорты обработчиков
+    for update in build(iteration(users[0])):
+        await dp.feed_update(bot, update)
+
+    plans = {user: [build(iteration(user)) for _ in range(iterations)] for user in users}
+    latencies: list[float] = []
+    calls_before = sum(bot.session.calls.values())
+
+    async def customer(user: int) -> None:
+        for updates in plans[user]:
+            for update in updates:
+                started = time.perf_counter()
+                await dp.feed_update(bot, update)
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(customer(user) for user in users))
+    elapsed = time.perf_counter() - started
+    # Отложенные перерисовки корзины — вызовы API этого сценария
+    await cart_renders.close()
+    return {
+        "updates": len(latencies),
+        "seconds": round(elapsed, 4),
+        "updates_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "api_calls_per_update": round((sum(bot.session.calls.values()) - calls_before) / len(latencies), 2),
+    }
+
+
+def git_commit() -> tuple[str, bool]:
+    def git(*args: str) -> str:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return git("rev-parse", "--short", "HEAD") or "unknown", bool(git("status", "--porcelain", "--untracked-files=no"))
+
+
+def previous_run(path: Path, record: dict) -> dict | None:
+    """Последний прогон с теми же параметрами на другом коммите."""
+    if not path.exists():
+        return None
+    same = ("database", "fsm", "users", "iterations")
+    found = None
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if entry.get("commit") != record["commit"] and all(entry.get(k) == record[k] for k in same):
+            found = entry
+    return found
+
+
+def report(record: dict, baseline: dict | None, max_regression: float | None) -> int:
+    print(f"{'сценарий':<14} {'апдейтов':>9} {'апд/с':>9} {'p50, мс':>9} {'p99, мс':>9} {'API/апд':>8}  сравнение")
+    regressions = []
+    for name, result in record["scenarios"].items():
+        delta = ""
+        before = (baseline or {}).get("scenarios", {}).get(name)
+        if before:
+            change = (result["updates_per_second"] / before["updates_per_second"] - 1) * 100
+            delta = f"{change:+.1f}% апд/с, p99 {before['p99_ms']:.2f} → {result['p99_ms']:.2f} мс"
+            if max_regression is not None and change < -max_regression:
+                regressions.append(f"{name}: {change:+.1f}% апд/с")
+        print(
+            f"{name:<14} {result['updates']:>9} {result['updates_per_second']:>9.1f} "
+            f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['api_calls_per_update']:>8.2f}  {delta}"
+        )
+    if baseline:
+        print(f"\nсравнение с {baseline['commit']} от {baseline['timestamp']}")
+    if regressions:
+        print(f"\nПадение больше {max_regression}%:", *regressions, sep="\n  ")
+        return 1
+    return 0
+
+
+async def run(args: argparse.Namespace) -> int:
+    from sqlalchemy.engine import make_url
+
+    os.environ["FSM_STORAGE"] = args.fsm
+    import main
+    import models
+    import stats
+
+    await main.init_db()
+    product_id, category_id = await seed(main, models, args.users)
+    await stats.ensure_initialized(main.async_session_factory)
+
+    session = fakes.FakeSession()
+    bot = main.Bot(token=main.BOT_TOKEN, session=session)
+    dp = main.build_dispatcher()
+    users = list(range(FIRST_CUSTOMER, FIRST_CUSTOMER + args.users))
+
+    results = {}
+    try:
+        for name, (prepare, iteration) in scenarios(product_id, category_id).items():
+            if args.scenario and name not in args.scenario:
+                continue
+            results[name] = await run_scenario(dp, bot, prepare, iteration, users, args.iterations)
+    finally:
+        await dp.fsm.storage.close()
+        await bot.session.close()
+        await main.engine.dispose()
+
+    commit, dirty = git_commit()
+    record = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "database": make_url(DATABASE_URL).get_backend_name(),
+        "fsm": args.fsm,
+        "users": args.users,
+        "iterations": args.iterations,
+        "python": platform.python_version(),
+        "scenarios": results,
+    }
+    baseline = previous_run(args.out, record)
+    if not args.no_save:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        with args.out.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return report(record, baseline, args.max_regression)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=16, help="одновременных покупателей")
+    parser.add_argument("--iterations", type=int, default=20, help="повторов сценария на покупателя")
+    parser.add_argument("--scenario", action="append", help="только этот сценарий (можно несколько раз)")
+    parser.add_argument("--fsm", choices=("memory", "db"), default=os.getenv("FSM_STORAGE", "db"),
+                        help="хранилище FSM, как FSM_STORAGE у бота")
+    parser.add_argument("--out", type=Path, default=RESULTS, help="куда дописывать результаты")
+    parser.add_argument("--no-save", action="store_true", help="не записывать результат")
+    parser.add_argument("--max-regression", type=float, help="допустимое падение апд/с, %%")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
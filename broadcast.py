@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+from sqlalchemy import or_, select, update
+
+from config import BROADCAST_BATCH_SIZE
+from db import async_session_factory
+from models import Broadcast, User
+from ratelimit import limiter
+
+
+# --------------------------------------------------------------------------- #
+#                          Рассылки всем / подписчикам                        #
+# --------------------------------------------------------------------------- #
+#
+# Получатели читаются пачками по users.id (keyset), после каждой пачки
+# курсор и счётчики сохраняются в broadcasts. После падения кампания
+# продолжается с сохранённого курсора; пачка, которую не успели
+# зафиксировать, может быть отправлена повторно (at-least-once).
+#
+# Кампанию ведёт тот процесс, который держит аренду (locked_until). Если
+# процесс упал или задача кампании завершилась ошибкой, аренду никто не
+# продлевает; watch() раз в BROADCAST_RESCAN_SECONDS подбирает кампании с
+# истёкшей арендой.
+
+BROADCAST_LEASE_SECONDS = 120
+BROADCAST_RESCAN_SECONDS = 30
+
+DELIVERED, BLOCKED, FAILED = "delivered", "blocked", "failed"
+
+
+class BroadcastEngine:
+    def __init__(self, session_factory, *, batch_size: int = BROADCAST_BATCH_SIZE) -> None:
+        self._session_factory = session_factory
+        self._batch_size = batch_size
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._watcher: asyncio.Task | None = None
+
+    async def create(self, text: str, audience: str, created_by: int) -> int:
+        async with self._session_factory() as session:
+            campaign = Broadcast(text=text, audience=audience, created_by=created_by)
+            session.add(campaign)
+            await session.commit()
+            return campaign.id
+
+    async def _claim(self, broadcast_id: int) -> bool:
+        now = datetime.now(timezone.utc)
+        async with self._session_factory() as session:
+            result = await session.execute(
+                update(Broadcast)
+                .where(
+                    Broadcast.id == broadcast_id,
+                    Broadcast.status == "running",
+                    or_(Broadcast.locked_until.is_(None), Broadcast.locked_until < now),
+                )
+                .values(locked_until=now + timedelta(seconds=BROADCAST_LEASE_SECONDS))
+            )
+            await session.commit()
+        return result.rowcount == 1
+
+    async def start(self, bot: Bot, broadcast_id: int) -> bool:
+        if broadcast_id in self._tasks or not await self._claim(broadcast_id):
+            return False
+        task = asyncio.create_task(self._run(bot, broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda t: self._finished(broadcast_id, t))
+        return True
+
+    def _finished(self, broadcast_id: int, task: asyncio.Task) -> None:
+        self._tasks.pop(broadcast_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            # Аренда истечёт, и кампанию подберёт watch()
+            logging.error(f"Рассылка #{broadcast_id} прервана", exc_info=task.exception())
+
+    async def resume_all(self, bot: Bot) -> None:
+        async with self._session_factory() as session:
+            ids = (
+                await session.scalars(
+                    select(Broadcast.id).where(Broadcast.status == "running")
+                )
+            ).all()
+        for broadcast_id in ids:
+            if await self.start(bot, broadcast_id):
+                logging.info(f"Рассылка #{broadcast_id} возобновлена")
+
+    def watch(self, bot: Bot) -> None:
+        """Возобновлять брошенные кампании: сразу и затем периодически."""
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self._watch(bot))
+
+    async def _watch(self, bot: Bot) -> None:
+        while True:
+            try:
+                await self.resume_all(bot)
+            except Exception as e:
+                logging.exception(f"Ошибка поиска рассылок для возобновления: {e}")
+            await asyncio.sleep(BROADCAST_RESCAN_SECONDS)
+
+    async def cancel(self, broadcast_id: int) -> None:
+        async with self._session_factory() as session:
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+                .values(status="canceled", finished_at=datetime.now(timezone.utc))
+            )
+            await session.commit()
+        task = self._tasks.get(broadcast_id)
+        if task:
+            task.cancel()
+
+    async def stop(self) -> None:
+        # Курсор сохранён после последней пачки; остальное доделает следующий запуск
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        ids = list(self._tasks)
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if ids:
+            async with self._session_factory() as session:
+                await session.execute(
+                    update(Broadcast).where(Broadcast.id.in_(ids)).values(locked_until=None)
+                )
+                await session.commit()
+
+    async def _next_batch(self, campaign: Broadcast, cursor: int) -> list[tuple[int, int]]:
+        query = select(User.id, User.tg_id).where(User.id > cursor)
+        if campaign.audience == "subscribers":
+            query = query.where(User.subscription_end > datetime.now(timezone.utc))
+        async with self._session_factory() as session:
+            rows = await session.execute(query.order_by(User.id).limit(self._batch_size))
+            return [tuple(row) for row in rows]
+
+    async def _send(self, bot: Bot, chat_id: int, text: str) -> str:
+        for _ in range(3):
+            await limiter.acquire(chat_id)
+            try:
+                await bot.send_message(chat_id, text)
+                return DELIVERED
+            except TelegramRetryAfter as e:
+                limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return BLOCKED
+            except TelegramBadRequest as e:
+                if "chat not found" in str(e).lower():
+                    return BLOCKED
+                return FAILED
+            except Exception as e:
+                logging.info(f"Рассылка: ошибка отправки {chat_id}: {e}")
+                return FAILED
+        return FAILED
+
+    async def _run(self, bot: Bot, broadcast_id: int) -> None:
+        async with self._session_factory() as session:
+            campaign = await session.get(Broadcast, broadcast_id)
+        cursor = campaign.last_user_id
+
+        while True:
+            batch = await self._next_batch(campaign, cursor)
+            if not batch:
+                break
+            results = await asyncio.gather(
+                *(self._send(bot, tg_id, campaign.text) for _, tg_id in batch)
+            )
+            cursor = batch[-1][0]
+            async with self._session_factory() as session:
+                result = await session.execute(
+                    update(Broadcast)
+                    .where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+                    .values(
+                        last_user_id=cursor,
+                        delivered=Broadcast.delivered + results.count(DELIVERED),
+                        blocked=Broadcast.blocked + results.count(BLOCKED),
+                        failed=Broadcast.failed + results.count(FAILED),
+                        locked_until=datetime.now(timezone.utc)
+                        + timedelta(seconds=BROADCAST_LEASE_SECONDS),
+                    )
+                )
+                await session.commit()
+            if result.rowcount == 0:
+                logging.info(f"Рассылка #{broadcast_id} остановлена")
+                return
+
+        async with self._session_factory() as session:
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id)
+                .values(status="done", finished_at=datetime.now(timezone.utc), locked_until=None)
+            )
+            await session.commit()
+            campaign = await session.get(Broadcast, broadcast_id)
+
+        logging.info(f"Рассылка #{broadcast_id} завершена")
+        if campaign.created_by:
+            try:
+                await bot.send_message(
+                    campaign.created_by,
+                    f"📣 Рассылка #{broadcast_id} завершена\n\n"
+                    f"✅ Доставлено: {campaign.delivered}\n"
+                    f"🚫 Заблокировали бота: {campaign.blocked}\n"
+                    f"⚠️ Ошибки: {campaign.failed}",
+                )
+            except Exception as e:
+                logging.info(f"Не удалось отправить итог рассылки: {e}")
+
+
+broadcasts = BroadcastEngine(async_session_factory)
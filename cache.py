@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, Tuple
+
+from sqlalchemy import select
+
+from config import CATALOG_CACHE_TTL, SUB_CACHE_MAX_SIZE, SUB_CACHE_TTL
+from middlewares import db_session
+from models import Category, Product, User
+
+
+# --------------------------------------------------------------------------- #
+#                          Кэш каталога (категории/товары)                    #
+# --------------------------------------------------------------------------- #
+
+
+@dataclass(frozen=True, slots=True)
+class CachedCategory:
+    id: int
+    title: str
+
+
+@dataclass(frozen=True, slots=True)
+class CachedProduct:
+    id: int
+    category_id: int | None
+    title: str
+    description: str | None
+    price: Decimal
+    is_active: bool
+    photo_file_id: str | None
+
+
+@dataclass(slots=True)
+class CatalogSnapshot:
+    version: int
+    loaded_at: float
+    categories: Tuple[CachedCategory, ...]
+    products: Dict[int, CachedProduct]
+    by_category: Dict[int, Tuple[CachedProduct, ...]]
+    # Производные от снимка значения (готовые клавиатуры): живут, пока жив
+    # снимок, и пересобираются после смены версии каталога
+    derived: Dict[Any, Any] = field(default_factory=dict)
+
+    def active_products(self, category_id: int) -> Tuple[CachedProduct, ...]:
+        return self.by_category.get(category_id, ())
+
+
+class CatalogCache:
+    """Read-through кэш каталога с версионированным снимком.
+
+    Снимок неизменяемый: обработчики читают его без блокировок, а админские
+    обработчики после записи в БД вызывают ``invalidate()``, что увеличивает
+    версию и заставляет следующий запрос перечитать каталог.
+    """
+
+    def __init__(self, session_factory, ttl: float = CATALOG_CACHE_TTL) -> None:
+        self._session_factory = session_factory
+        self._ttl = ttl
+        self._version = 0
+        # Общий для воркер-процессов счётчик версий (multiprocessing.Value)
+        self._shared_version = None
+        self._snapshot: CatalogSnapshot | None = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def _current_version(self) -> int:
+        if self._shared_version is not None:
+            return self._shared_version.value
+        return self._version
+
+    @property
+    def version(self) -> int:
+        return self._current_version
+
+    def share_version(self, value) -> None:
+        """Синхронизировать версию каталога между процессами.
+
+        Инвалидация в одном воркере сразу делает протухшими снимки во всех
+        остальных, без похода в БД на каждый запрос.
+        """
+        self._shared_version = value
+        self._snapshot = None
+
+    def invalidate(self) -> None:
+        if self._shared_version is not None:
+            with self._shared_version.get_lock():
+                self._shared_version.value += 1
+        else:
+            self._version += 1
+        self._snapshot = None
+        logging.info(f"Кэш каталога сброшен, версия {self._current_version}")
+
+    def _is_fresh(self, snapshot: CatalogSnapshot | None) -> bool:
+        return (
+            snapshot is not None
+            and snapshot.version == self._current_version
+            and time.monotonic() - snapshot.loaded_at < self._ttl
+        )
+
+    async def snapshot(self) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            return snapshot
+
+        async with self._lock:
+            # Пока ждали блокировку, снимок мог загрузить другой обработчик
+            if self._is_fresh(self._snapshot):
+                return self._snapshot
+            version = self._current_version
+            snapshot = await self._load(version)
+            # Если во время загрузки случилась инвалидация, снимок не сохраняем
+            if version == self._current_version:
+                self._snapshot = snapshot
+            return snapshot
+
+    async def _load(self, version: int) -> CatalogSnapshot:
+        async with self._session_factory() as session:
+            categories = (
+                await session.scalars(select(Category).order_by(Category.id))
+            ).all()
+            products = (
+                await session.scalars(select(Product).order_by(Product.id))
+            ).all()
+
+        cached_products = {
+            p.id: CachedProduct(
+                id=p.id,
+                category_id=p.category_id,
+                title=p.title,
+                description=p.description,
+                price=p.price,
+                is_active=bool(p.is_active),
+                photo_file_id=p.photo_file_id,
+            )
+            for p in products
+        }
+        by_category: Dict[int, list[CachedProduct]] = {}
+        for prod in cached_products.values():
+            if prod.is_active and prod.category_id is not None:
+                by_category.setdefault(prod.category_id, []).append(prod)
+
+        return CatalogSnapshot(
+            version=version,
+            loaded_at=time.monotonic(),
+            categories=tuple(CachedCategory(id=c.id, title=c.title) for c in categories),
+            products=cached_products,
+            by_category={cid: tuple(items) for cid, items in by_category.items()},
+        )
+
+    async def categories(self) -> Tuple[CachedCategory, ...]:
+        return (await self.snapshot()).categories
+
+    async def active_products(self, category_id: int) -> Tuple[CachedProduct, ...]:
+        return (await self.snapshot()).active_products(category_id)
+
+    async def product(self, product_id: int) -> CachedProduct | None:
+        return (await self.snapshot()).products.get(product_id)
+
+    async def products(self, product_ids) -> Dict[int, CachedProduct]:
+        products = (await self.snapshot()).products
+        return {pid: products[pid] for pid in product_ids if pid in products}
+
+
+# Промах кэша внутри апдейта читает БД через сессию этого апдейта
+catalog = CatalogCache(db_session)
+
+
+# --------------------------------------------------------------------------- #
+#                       Кэш статуса подписки (по tg_id)                       #
+# --------------------------------------------------------------------------- #
+
+
+def _as_utc(value: datetime | None) -> datetime | None:
+    # SQLite отдаёт "наивные" даты даже для DateTime(timezone=True)
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class SubscriptionCache:
+    """Кэш ``User.subscription_end`` по ``tg_id``.
+
+    Запись живёт не дольше TTL и не дольше самой подписки: как только
+    ``subscription_end`` прошёл, запись считается протухшей и перечитывается.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        ttl: float = SUB_CACHE_TTL,
+        max_size: int = SUB_CACHE_MAX_SIZE,
+    ) -> None:
+        self._session_factory = session_factory
+        self._ttl = timedelta(seconds=ttl)
+        self._max_size = max_size
+        # tg_id -> (subscription_end, запись действительна до)
+        self._entries: OrderedDict[int, Tuple[datetime | None, datetime]] = OrderedDict()
+
+    def set(self, tg_id: int, subscription_end: datetime | None) -> None:
+        subscription_end = _as_utc(subscription_end)
+        valid_until = datetime.now(timezone.utc) + self._ttl
+        if subscription_end is not None:
+            valid_until = min(valid_until, subscription_end)
+        self._entries[tg_id] = (subscription_end, valid_until)
+        self._entries.move_to_end(tg_id)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    async def subscription_end(self, tg_id: int) -> datetime | None:
+        entry = self._entries.get(tg_id)
+        if entry is not None and entry[1] > datetime.now(timezone.utc):
+            self._entries.move_to_end(tg_id)
+            return entry[0]
+
+        async with self._session_factory() as session:
+            subscription_end = await session.scalar(
+                select(User.subscription_end).where(User.tg_id == tg_id)
+            )
+        self.set(tg_id, subscription_end)
+        return _as_utc(subscription_end)
+
+    async def is_active(self, tg_id: int) -> bool:
+        subscription_end = await self.subscription_end(tg_id)
+        return subscription_end is not None and subscription_end > datetime.now(timezone.utc)
+
+
+subscriptions = SubscriptionCache(db_session)
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import CachedProduct, subscriptions
+from models import Order, OrderItem, User
+from stats import STATUS_NEW
+import stats
+
+
+# --------------------------------------------------------------------------- #
+#                            Оформление заказа                                #
+# --------------------------------------------------------------------------- #
+#
+# Весь заказ — несколько операторов в одной транзакции, без ORM-объектов:
+# пользователь вместе с подпиской одним SELECT, заказ — INSERT ... RETURNING
+# id, все позиции — один executemany (SQLAlchemy склеивает его в
+# многострочный INSERT), плюс счётчики статистики. Цены и названия берутся
+# из снимка каталога, который покупатель видел в корзине.
+
+SUBSCRIBER_DISCOUNT = Decimal("0.15")
+
+
+@dataclass(frozen=True)
+class PlacedOrder:
+    id: int
+    status: str
+    # (название, количество) в порядке корзины
+    lines: List[Tuple[str, int]]
+    total_without_discount: Decimal
+    total_with_discount: Decimal
+    has_subscription: bool
+    user_phone: str | None
+
+    @property
+    def total(self) -> Decimal:
+        return self.total_with_discount if self.has_subscription else self.total_without_discount
+
+
+async def place_order(
+    session: AsyncSession,
+    tg_id: int,
+    cart: Dict[int, int],
+    products: Dict[int, CachedProduct],
+    *,
+    address: str,
+    comment: str,
+    pay_online: bool,
+) -> PlacedOrder:
+    """Записать заказ в транзакции сессии (commit — за вызывающим)."""
+    user_id, phone, subscription_end = (
+        await session.execute(
+            select(User.id, User.phone, User.subscription_end).where(User.tg_id == tg_id)
+        )
+    ).one()
+    # Подписка прочитана вместе с пользователем — заодно освежаем её кэш
+    subscriptions.set(tg_id, subscription_end)
+    if subscription_end is not None and subscription_end.tzinfo is None:
+        subscription_end = subscription_end.replace(tzinfo=timezone.utc)
+    has_subscription = (
+        subscription_end is not None and subscription_end > datetime.now(timezone.utc)
+    )
+    discount_rate = SUBSCRIBER_DISCOUNT if has_subscription else Decimal("0.0")
+
+    # Товар могли удалить, пока он лежал в корзине
+    cart = {pid: qty for pid, qty in cart.items() if pid in products}
+    total_without_discount = Decimal(
+        sum(products[pid].price * qty for pid, qty in cart.items())
+    )
+    total_with_discount = (
+        total_without_discount * (Decimal("1") - discount_rate)
+    ).quantize(Decimal("0.01"))
+    total = total_with_discount if has_subscription else total_without_discount
+
+    titles = [products[pid].title for pid in cart]
+    order_id = await session.scalar(
+        insert(Order)
+        .values(
+            user_id=user_id,
+            status=STATUS_NEW,
+            payment_method="оплачен онлайн" if pay_online else "оплата оффлайн",
+            total_price=total,
+            comment=comment,
+            title=", ".join(titles) if titles else "Нет названия",
+            address=address,
+        )
+        .returning(Order.id)
+    )
+    if cart:
+        await session.execute(
+            insert(OrderItem),
+            [
+                {
+                    "order_id": order_id,
+                    "product_id": pid,
+                    "qty": qty,
+                    "item_price": products[pid].price,
+                    "title": products[pid].title,
+                }
+                for pid, qty in cart.items()
+            ],
+        )
+    await stats.order_created(session, total, STATUS_NEW)
+
+    return PlacedOrder(
+        id=order_id,
+        status=STATUS_NEW,
+        lines=[(products[pid].title, qty) for pid, qty in cart.items()],
+        total_without_discount=total_without_discount,
+        total_with_discount=total_with_discount,
+        has_subscription=has_subscription,
+        user_phone=phone,
+    )
@@ -24,6 +24,11 @@ async def set_commands(bot: Bot, BOT_ADMINS: set[int]) -> None:
                     BotCommand(command="products", description="Список товаров"),
                     BotCommand(command="orders", description="Заказы"),
                     BotCommand(command="stats", description="Статистика заказов"),
+                    BotCommand(command="rebuild_stats", description="Пересчитать статистику"),
+                    BotCommand(command="broadcast", description="Рассылка"),
+                    BotCommand(command="broadcasts", description="Ход рассылок"),
+                    BotCommand(command="jobs", description="Фоновые задачи"),
+                    BotCommand(command="db_pool", description="Пул соединений БД"),
                 ],
                 scope=BotCommandScopeChatAdministrators(chat_id=BOT_ADMINS),
             )
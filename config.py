@@ -0,0 +1,97 @@
+import os
+
+from dotenv import load_dotenv
+
+# --------------------------------------------------------------------------- #
+#                     Настройки из окружения / .env                           #
+# --------------------------------------------------------------------------- #
+#
+# Единственное место, где читается .env. Остальные модули берут настройки
+# отсюда, а не из main: main — точка входа, и при запуске `python main.py`
+# импорт `main` из другого модуля выполнил бы его ещё раз.
+
+load_dotenv()
+
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+DATABASE_URL = os.getenv('DATABASE_URL')
+admin_id = list(map(int, os.getenv('admin_id').split(',')))
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'db')  # db | memory
+
+RUN_MODE = os.getenv('RUN_MODE', 'polling')  # polling | webhook
+# Базовый URL Bot API, например http://127.0.0.1:8081 для локального фейкового сервера
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # публичный адрес, на который Telegram шлёт апдейты
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_REGISTER = os.getenv('WEBHOOK_REGISTER', '1') == '1'
+# 1 — при запуске выбросить апдейты, накопившиеся у Telegram, пока бот не работал
+DROP_PENDING_UPDATES = os.getenv('DROP_PENDING_UPDATES', '0') == '1'
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', '8080'))
+UPDATES_CONCURRENCY = int(os.getenv('UPDATES_CONCURRENCY', '64'))
+# 0 — всё в одном процессе; N > 0 — приёмник и N воркеров с шардированием по chat.id
+WORKERS = int(os.getenv('WORKERS', '0'))
+
+PAY_PROVIDER_TOKEN = os.getenv('PAY_PROVIDER_TOKEN')
+SUB_DURATION_DAYS = int(os.getenv('SUB_DURATION_DAYS'))
+SUB_PRICE_STARS = int(os.getenv('SUB_PRICE_STARS'))
+
+# Пул соединений с БД (на процесс: у каждого воркера свой пул)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # секунды; -1 — не пересоздавать
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+# Кэш подготовленных выражений asyncpg; 0 — за pgbouncer в режиме transaction
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '100'))
+# Запросы в разрезе обработчиков (querylog.py): порог медленного запроса, мс;
+# сколько повторов одного оператора считать N+1; имя обработчика комментарием в SQL
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+N_PLUS_ONE_MIN = int(os.getenv('N_PLUS_ONE_MIN', '5'))
+DB_TAG_SQL = os.getenv('DB_TAG_SQL', '0') == '1'
+
+# Локальный HTTP-эндпоинт /metrics; 0 — выключен. Воркеры слушают METRICS_PORT + 1 + номер
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# Логи: файл с ротацией по времени и размеру; LOG_FILE= (пусто) — только консоль
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text | json
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', 'midnight')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '14'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Записей в секунду с одного места вызова для INFO и ниже; 0 — без прореживания
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '20'))
+
+# Хранилище FSM в БД: пауза перед пакетной записью изменений, с; записей в кэше процесса
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '0.5'))
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '20000'))
+# Кэш FSM в процессе: auto — только если чат обрабатывает один процесс (long polling
+# или WORKERS > 0); в режиме webhook без шардирования инстансов может быть несколько
+FSM_CACHE = os.getenv('FSM_CACHE', 'auto')  # auto | 1 | 0
+
+# Страховочный TTL каталога: даже если инвалидация не дошла (например, каталог
+# поменяли в другом процессе), снимок будет перечитан не позже этого срока
+CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', '300'))
+SUB_CACHE_TTL = float(os.getenv('SUB_CACHE_TTL', '600'))
+SUB_CACHE_MAX_SIZE = int(os.getenv('SUB_CACHE_MAX_SIZE', '50000'))
+
+# Лимиты Bot API: сообщений в секунду на бота и секунд между сообщениями в один чат
+TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', '28'))
+TG_PER_CHAT_INTERVAL = float(os.getenv('TG_PER_CHAT_INTERVAL', '1.0'))
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '200'))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '20'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+
+# Фоновые задачи администратора: процессов в пуле; сколько задач выполняется
+# одновременно (остальные ждут в очереди) и сколько может ждать
+JOBS_PROCESSES = int(os.getenv('JOBS_PROCESSES', '2'))
+JOBS_CONCURRENCY = int(os.getenv('JOBS_CONCURRENCY', '2'))
+JOBS_MAX_QUEUED = int(os.getenv('JOBS_MAX_QUEUED', '20'))
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '1000'))
+
+# Перерисовка корзины при частых ➕/➖: не чаще раза за столько секунд на сообщение; 0 — сразу
+CART_RENDER_WINDOW = float(os.getenv('CART_RENDER_WINDOW', '0.7'))
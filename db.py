@@ -0,0 +1,58 @@
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from config import (
+    DATABASE_URL,
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_STATEMENT_CACHE_SIZE,
+)
+from db_pool import InstrumentedPool, instrument
+import querylog
+
+# --------------------------------------------------------------------------- #
+#                    Движок базы данных и фабрика сессий                      #
+# --------------------------------------------------------------------------- #
+
+
+def _engine_options(database_url: str) -> dict:
+    url = make_url(database_url)
+    options = dict(
+        echo=False,
+        future=True,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In-memory SQLite живёт в одном соединении (StaticPool) — размер не настраивается
+        return options
+    options.update(
+        poolclass=InstrumentedPool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    if url.get_driver_name() == "asyncpg":
+        # Оба кэша: собственный у asyncpg и кэш prepared statements диалекта SQLAlchemy
+        options["connect_args"] = {
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        }
+    return options
+
+
+engine = create_async_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+if isinstance(engine.pool, InstrumentedPool):
+    instrument(engine.sync_engine)
+querylog.instrument(engine.sync_engine)
+async_session_factory = async_sessionmaker(
+    engine, expire_on_commit=False, class_=AsyncSession
+)
+
+
+async def init_db() -> None:
+    from migrations import migrate
+    await migrate(engine)
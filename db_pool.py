@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+# --------------------------------------------------------------------------- #
+#                 Пул соединений: время ожидания и переполнение               #
+# --------------------------------------------------------------------------- #
+#
+# Отдельного события «начали ждать соединение» у SQLAlchemy нет, поэтому
+# ожидание меряется в самом пуле: InstrumentedPool засекает время вокруг
+# checkout (ожидание свободного соединения, открытие нового и pre-ping).
+# Остальное — через события пула: connect (новое соединение сверх pool_size —
+# это overflow) и checkout (пик занятых соединений).
+
+# Границы корзин гистограммы ожидания, секунды
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+    # Накопительные счётчики по WAIT_BUCKETS (le), последний ключ — +Inf
+    wait_buckets: Dict[float, int] = field(
+        default_factory=lambda: dict.fromkeys((*WAIT_BUCKETS, float("inf")), 0)
+    )
+    peak_in_use: int = 0
+    overflow_opened: int = 0
+    timeouts: int = 0
+
+    def observe_wait(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        for bound in self.wait_buckets:
+            if seconds <= bound:
+                self.wait_buckets[bound] += 1
+
+    def reset_peaks(self) -> None:
+        self.wait_max = 0.0
+        self.peak_in_use = 0
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    # Логгер в иерархии sqlalchemy: иначе его INFO о пересоздании пула
+    # не приглушались бы вместе с остальными логами SQLAlchemy
+    _sqla_logger_namespace = "sqlalchemy.pool.impl.InstrumentedPool"
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            pool_stats.timeouts += 1
+            logging.warning(
+                f"Пул БД исчерпан: {self.checkedout()} соединений занято, "
+                f"ожидание дольше {self._timeout:.0f} с"
+            )
+            raise
+        finally:
+            pool_stats.observe_wait(time.perf_counter() - start)
+
+
+def instrument(engine: Engine) -> None:
+    """Подписать статистику на события пула (sync_engine у async-движка)."""
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record) -> None:
+        # QueuePool увеличивает overflow до открытия соединения
+        if engine.pool.overflow() > 0:
+            pool_stats.overflow_opened += 1
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+        pool_stats.peak_in_use = max(pool_stats.peak_in_use, engine.pool.checkedout())
+
+
+def snapshot(engine: Engine) -> Dict[str, float]:
+    pool = engine.pool
+    result = {
+        "checkouts": pool_stats.checkouts,
+        "wait_avg": pool_stats.wait_total / pool_stats.checkouts if pool_stats.checkouts else 0.0,
+        "wait_max": pool_stats.wait_max,
+        "peak_in_use": pool_stats.peak_in_use,
+        "overflow_opened": pool_stats.overflow_opened,
+        "timeouts": pool_stats.timeouts,
+    }
+    if isinstance(pool, InstrumentedPool):
+        result.update(
+            size=pool.size(),
+            max_overflow=pool._max_overflow,
+            in_use=pool.checkedout(),
+            idle=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+        )
+    return result
@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def dialect_insert(session: AsyncSession):
+    """``insert`` того диалекта, на котором работает сессия.
+
+    Нужен для ``on_conflict_do_update``/``on_conflict_do_nothing``: у PostgreSQL
+    и SQLite синтаксис upsert'а одинаковый, но конструкторы разные.
+    """
+    name = session.get_bind().dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"upsert не поддерживается для диалекта {name}")
+    return insert
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Hashable
+
+from config import CART_RENDER_WINDOW
+
+# --------------------------------------------------------------------------- #
+#                    Склейка частых перерисовок одного сообщения              #
+# --------------------------------------------------------------------------- #
+#
+# Пять быстрых нажатий ➕ — пять апдейтов. Состояние (корзина) меняется на
+# каждом, а перерисовывать сообщение достаточно раз в окно: первая
+# отрисовка идёт сразу, все нажатия за следующие ``window`` секунд склеиваются
+# в одну отрисовку в конце окна — уже с итоговым состоянием. Так меньше
+# editMessageText (и ошибок «message is not modified», и 429 по чату), а
+# отрисовка, которая сама читает состояние, — реже.
+#
+# Отрисовка идёт в отдельной задаче, уже после обработчика. Контекст у неё
+# пустой: сессия БД и метки апдейта обработчика ей не достаются.
+
+RenderFn = Callable[[], Awaitable[None]]
+
+
+class RenderThrottle:
+    def __init__(self, window: float) -> None:
+        self.window = window
+        # Последняя запрошенная отрисовка по ключу — её и выполним
+        self._pending: Dict[Hashable, RenderFn] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def schedule(self, key: Hashable, render: RenderFn) -> None:
+        """Запросить отрисовку ``key``; отрисовки за одно окно склеиваются."""
+        self._pending[key] = render
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key), context=contextvars.Context())
+
+    def cancel(self, key: Hashable) -> None:
+        """Отменить отложенную отрисовку ``key`` — например, сообщение сейчас удалят."""
+        self._pending.pop(key, None)
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    async def _run(self, key: Hashable) -> None:
+        try:
+            while key in self._pending:
+                render = self._pending.pop(key)
+                started = time.monotonic()
+                try:
+                    await render()
+                except Exception as e:
+                    logging.exception(f"Ошибка отрисовки {key}: {e}")
+                # Нажатия во время отрисовки и до конца окна попадут в следующую
+                await asyncio.sleep(max(0.0, self.window - (time.monotonic() - started)))
+        finally:
+            # После cancel() по тому же ключу могла начаться новая серия
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+    async def close(self) -> None:
+        """Дождаться отложенных отрисовок (при остановке бота)."""
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=self.window + 10)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+cart_renders = RenderThrottle(CART_RENDER_WINDOW)
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from decimal import Decimal
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import Bot
+from aiogram.types import FSInputFile
+from sqlalchemy import select
+
+from config import EXPORT_CHUNK_SIZE
+from models import Order, OrderItem, User
+
+
+# --------------------------------------------------------------------------- #
+#              Потоковая выгрузка истории заказов (CSV / XLSX / JSONL)        #
+# --------------------------------------------------------------------------- #
+#
+# Заказы читаются пачками по orders.id (keyset), к каждой пачке одним
+# запросом подтягиваются позиции. Процесс бота только складывает пачки в
+# файл-спул (pickle подряд); сам CSV/XLSX/JSONL собирает из спула процесс
+# пула задач (render_export через run_cpu), чтобы форматирование не
+# держало GIL и event loop. Память ограничена размером пачки с обеих
+# сторон. Все файлы лежат во временном каталоге, который удаляется после
+# отправки или ошибки.
+
+# Лимит Bot API на загрузку документа
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+ORDER_COLUMNS = [
+    "order_id", "created_at", "status", "payment_method", "total_price",
+    "title", "address", "comment", "user_tg_id", "user_full_name", "user_phone",
+]
+ITEM_COLUMNS = ["item_id", "order_id", "product_id", "title", "qty", "item_price"]
+
+Row = Dict[str, Any]
+
+
+async def iter_order_chunks(
+    session_factory, chunk_size: int = EXPORT_CHUNK_SIZE
+) -> AsyncGenerator[Tuple[List[Row], List[Row]], None]:
+    last_id = 0
+    while True:
+        async with session_factory() as session:
+            orders = (
+                await session.execute(
+                    select(
+                        Order.id.label("order_id"),
+                        Order.created_at,
+                        Order.status,
+                        Order.payment_method,
+                        Order.total_price,
+                        Order.title,
+                        Order.address,
+                        Order.comment,
+                        User.tg_id.label("user_tg_id"),
+                        User.full_name.label("user_full_name"),
+                        User.phone.label("user_phone"),
+                    )
+                    .join(User, User.id == Order.user_id)
+                    .where(Order.id > last_id)
+                    .order_by(Order.id)
+                    .limit(chunk_size)
+                )
+            ).mappings().all()
+            if not orders:
+                return
+            first_id, last_id = orders[0]["order_id"], orders[-1]["order_id"]
+            items = (
+                await session.execute(
+                    select(
+                        OrderItem.id.label("item_id"),
+                        OrderItem.order_id,
+                        OrderItem.product_id,
+                        OrderItem.title,
+                        OrderItem.qty,
+                        OrderItem.item_price,
+                    )
+                    .where(OrderItem.order_id.between(first_id, last_id))
+                    .order_by(OrderItem.order_id, OrderItem.id)
+                )
+            ).mappings().all()
+        yield [dict(row) for row in orders], [dict(row) for row in items]
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+# --------------------------------------------------------------------------- #
+#                                  Форматы                                    #
+# --------------------------------------------------------------------------- #
+
+# Писатели работают в процессе пула: создают файлы в ``directory`` и
+# возвращают из finish() пары (путь, имя файла для Telegram)
+
+class _CsvWriter:
+    def __init__(self, directory: str) -> None:
+        self._files = []
+        self._orders = self._open(directory, "orders.csv", ORDER_COLUMNS)
+        self._items = self._open(directory, "order_items.csv", ITEM_COLUMNS)
+
+    def _open(self, directory: str, filename: str, columns: List[str]):
+        # utf-8-sig, чтобы Excel сразу понял кириллицу
+        file = open(os.path.join(directory, filename), "w", encoding="utf-8-sig", newline="")
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        self._files.append((file, filename))
+        return writer
+
+    def write(self, orders: List[Row], items: List[Row]) -> None:
+        self._orders.writerows({k: _plain(v) for k, v in row.items()} for row in orders)
+        self._items.writerows({k: _plain(v) for k, v in row.items()} for row in items)
+
+    def finish(self) -> List[Tuple[str, str]]:
+        self.close()
+        return [(file.name, filename) for file, filename in self._files]
+
+    def close(self) -> None:
+        for file, _ in self._files:
+            file.close()
+
+
+class _JsonlWriter:
+    def __init__(self, directory: str) -> None:
+        self._file = open(os.path.join(directory, "orders.jsonl"), "wb")
+
+    def write(self, orders: List[Row], items: List[Row]) -> None:
+        by_order: Dict[int, List[Row]] = {}
+        for item in items:
+            by_order.setdefault(item["order_id"], []).append(
+                {k: _plain(v) for k, v in item.items() if k != "order_id"}
+            )
+        for order in orders:
+            record = {k: _plain(v) for k, v in order.items()}
+            record["items"] = by_order.get(order["order_id"], [])
+            self._file.write(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+            self._file.write(b"\n")
+
+    def finish(self) -> List[Tuple[str, str]]:
+        self._file.close()
+        return [(self._file.name, "orders.jsonl")]
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _XlsxWriter:
+    def __init__(self, directory: str) -> None:
+        from openpyxl import Workbook
+
+        # write_only: строки сразу уходят на диск, в памяти не копятся
+        self._workbook = Workbook(write_only=True)
+        self._orders = self._workbook.create_sheet("Заказы")
+        self._items = self._workbook.create_sheet("Позиции")
+        self._orders.append(ORDER_COLUMNS)
+        self._items.append(ITEM_COLUMNS)
+        self._path = os.path.join(directory, "orders.xlsx")
+
+    @staticmethod
+    def _cell(value: Any) -> Any:
+        if isinstance(value, Decimal):
+            return float(value)
+        if getattr(value, "tzinfo", None) is not None:
+            # Excel не умеет даты с часовым поясом
+            return value.replace(tzinfo=None)
+        return value
+
+    def write(self, orders: List[Row], items: List[Row]) -> None:
+        for row in orders:
+            self._orders.append([self._cell(row[c]) for c in ORDER_COLUMNS])
+        for row in items:
+            self._items.append([self._cell(row[c]) for c in ITEM_COLUMNS])
+
+    def finish(self) -> List[Tuple[str, str]]:
+        self._workbook.save(self._path)
+        return [(self._path, "orders.xlsx")]
+
+    def close(self) -> None:
+        # Если до save() не дошли, openpyxl оставит свои временные файлы листов
+        for sheet in self._workbook.worksheets:
+            writer = getattr(sheet, "_writer", None)
+            if writer is not None:
+                try:
+                    writer.close()
+                    writer.cleanup()
+                except Exception:
+                    pass
+
+
+WRITERS = {"csv": _CsvWriter, "xlsx": _XlsxWriter, "jsonl": _JsonlWriter}
+
+
+def render_export(fmt: str, spool_path: str, directory: str) -> List[Tuple[str, str]]:
+    """Собрать файлы выгрузки из спула пачек (выполняется в пуле процессов)."""
+    writer = WRITERS[fmt](directory)
+    try:
+        with open(spool_path, "rb") as spool:
+            while True:
+                try:
+                    orders, items = pickle.load(spool)
+                except EOFError:
+                    break
+                writer.write(orders, items)
+        return writer.finish()
+    finally:
+        writer.close()
+
+
+async def send_orders_export(
+    bot: Bot,
+    chat_id: int,
+    session_factory,
+    fmt: str,
+    run_cpu: Callable[..., Awaitable[Any]],
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+    progress: Callable[[int], Awaitable[Any]] | None = None,
+) -> int:
+    """Выгрузить всю историю заказов в чат. Возвращает число заказов.
+
+    ``run_cpu`` — JobContext.run_cpu: в нём собираются сами файлы.
+    ``progress`` вызывается после каждой пачки с числом уже прочитанных заказов.
+    """
+    directory = await asyncio.to_thread(tempfile.mkdtemp, prefix="orders-export-")
+    spool_path = os.path.join(directory, "chunks.pickle")
+    exported = 0
+    try:
+        spool = await asyncio.to_thread(open, spool_path, "wb")
+        try:
+            async for orders, items in iter_order_chunks(session_factory, chunk_size):
+                await asyncio.to_thread(pickle.dump, (orders, items), spool, pickle.HIGHEST_PROTOCOL)
+                exported += len(orders)
+                if progress is not None:
+                    await progress(exported)
+        finally:
+            await asyncio.to_thread(spool.close)
+        files = await run_cpu(render_export, fmt, spool_path, directory)
+        for path, filename in files:
+            if await asyncio.to_thread(os.path.getsize, path) > TELEGRAM_UPLOAD_LIMIT:
+                await bot.send_message(
+                    chat_id, f"⚠️ Файл {filename} больше 50 МБ, Telegram его не примет."
+                )
+                continue
+            await bot.send_document(
+                chat_id,
+                FSInputFile(path, filename=filename),
+                caption=f"📦 История заказов: {exported} шт.",
+            )
+    finally:
+        await asyncio.to_thread(shutil.rmtree, directory, True)
+    return exported
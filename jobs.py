@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from config import JOBS_CONCURRENCY, JOBS_MAX_QUEUED, JOBS_PROCESSES
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+
+# --------------------------------------------------------------------------- #
+#                  Фоновые задачи администратора (jobs)                       #
+# --------------------------------------------------------------------------- #
+#
+# Обработчик ставит задачу и сразу отвечает. Задача — корутина, которая
+# читает БД в процессе бота, а CPU-тяжёлую часть (Excel, отчёты, картинки)
+# отдаёт в пул процессов через ctx.run_cpu(), чтобы не блокировать цикл
+# событий. Ход выполнения и результат пишутся в чат администратора.
+#
+# Отмена прерывает корутину в ближайшей точке await. Функцию, уже
+# запущенную в пуле, прервать нельзя: процесс доработает, а результат
+# будет выброшен.
+
+# Не чаще одного редактирования сообщения о ходе задачи за интервал
+JOBS_PROGRESS_INTERVAL = 2.0
+
+QUEUED, RUNNING = "queued", "running"
+
+STATUS_TEXT = {QUEUED: "⏳ в очереди", RUNNING: "⚙️ выполняется"}
+
+
+@dataclass
+class Job:
+    id: int
+    title: str
+    chat_id: int
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.monotonic)
+    message_id: int | None = None
+    progress: str = ""
+    task: asyncio.Task | None = field(default=None, repr=False)
+    last_edit: float = 0.0
+
+
+def cancel_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="🚫 Отменить", callback_data=f"job_cancel:{job_id}"))
+    return builder.as_markup()
+
+
+class JobContext:
+    """То, что получает функция задачи: бот, чат и доступ к пулу процессов."""
+
+    def __init__(self, runner: JobRunner, job: Job, bot: Bot) -> None:
+        self._runner = runner
+        self.job = job
+        self.bot = bot
+        self.chat_id = job.chat_id
+
+    async def progress(self, text: str) -> None:
+        self.job.progress = text
+        if time.monotonic() - self.job.last_edit >= JOBS_PROGRESS_INTERVAL:
+            await self._runner._show(self.bot, self.job)
+
+    async def run_cpu(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        return await self._runner.run_cpu(fn, *args, **kwargs)
+
+
+JobFunc = Callable[[JobContext], Awaitable[str | None]]
+
+
+class JobRunner:
+    def __init__(
+        self,
+        *,
+        processes: int = JOBS_PROCESSES,
+        concurrency: int = JOBS_CONCURRENCY,
+        max_queued: int = JOBS_MAX_QUEUED,
+    ) -> None:
+        self._processes = processes
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._max_queued = max_queued
+        self._ids = itertools.count(1)
+        self._jobs: Dict[int, Job] = {}
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # Пул (и multiprocessing) поднимается при первой задаче: старт бота его не ждёт
+        if self._pool is None:
+            import multiprocessing as mp
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._processes, mp_context=mp.get_context("spawn")
+            )
+        return self._pool
+
+    async def run_cpu(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Выполнить функцию в пуле процессов. fn и аргументы должны сериализоваться pickle."""
+        from concurrent.futures.process import BrokenProcessPool
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._executor(), functools.partial(fn, *args, **kwargs)
+            )
+        except BrokenProcessPool:
+            # Процесс пула упал (например, OOM) — следующая задача получит новый пул
+            self._pool = None
+            raise
+
+    def submit(self, bot: Bot, chat_id: int, title: str, func: JobFunc) -> Job | None:
+        """Поставить задачу в очередь. None — очередь переполнена."""
+        if len(self._jobs) >= self._max_queued:
+            return None
+        job = Job(id=next(self._ids), title=title, chat_id=chat_id)
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(bot, job, func))
+        return job
+
+    def active(self, chat_id: int | None = None) -> List[Job]:
+        return [j for j in self._jobs.values() if chat_id is None or j.chat_id == chat_id]
+
+    def cancel(self, job_id: int) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job.task is None or job.task.done():
+            return False
+        job.task.cancel()
+        return True
+
+    async def shutdown(self) -> None:
+        tasks = [job.task for job in self._jobs.values() if job.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # ----- Сообщение о ходе задачи ----- #
+
+    def _text(self, job: Job, status: str) -> str:
+        text = f"<b>Задача #{job.id}</b>: {job.title}\n{status}"
+        if job.progress:
+            text += f"\n{job.progress}"
+        return text
+
+    async def _show(self, bot: Bot, job: Job, final: str | None = None) -> None:
+        text = self._text(job, final or STATUS_TEXT[job.status])
+        markup = None if final else cancel_keyboard(job.id)
+        job.last_edit = time.monotonic()
+        try:
+            if job.message_id is None:
+                message = await bot.send_message(job.chat_id, text, reply_markup=markup)
+                job.message_id = message.message_id
+            else:
+                await bot.edit_message_text(
+                    text, chat_id=job.chat_id, message_id=job.message_id, reply_markup=markup
+                )
+        except TelegramBadRequest:
+            # message is not modified и т.п. — не повод останавливать задачу
+            pass
+        except Exception as e:
+            logging.info(f"Задача #{job.id}: не удалось обновить сообщение: {e}")
+
+    async def _run(self, bot: Bot, job: Job, func: JobFunc) -> None:
+        ctx = JobContext(self, job, bot)
+        try:
+            await self._show(bot, job)
+            async with self._semaphore:
+                job.status = RUNNING
+                await self._show(bot, job)
+                started = time.monotonic()
+                result = await func(ctx)
+            job.progress = result or ""
+            await self._show(bot, job, f"✅ Готово за {time.monotonic() - started:.1f} с")
+        except asyncio.CancelledError:
+            await asyncio.shield(self._show(bot, job, "🚫 Отменена"))
+            raise
+        except Exception as e:
+            logging.exception(f"Задача #{job.id} ({job.title}) завершилась ошибкой: {e}")
+            job.progress = ""
+            await self._show(bot, job, "❌ Ошибка, подробности в логе")
+        finally:
+            self._jobs.pop(job.id, None)
+
+
+runner = JobRunner()
@@ -1,17 +1,37 @@
-import logging
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-from main import admin_id
+from typing import Callable, Hashable
 
-def get_main_reply_keyboard(user_telegram_id: int):
-    logging.info(f"User  Telegram ID: {user_telegram_id}")
-    logging.info(f"Admin IDs: {admin_id}")
+from aiogram.types import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+)
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from cache import CatalogSnapshot, catalog
+from config import admin_id
+
+# --------------------------------------------------------------------------- #
+#                         Готовые клавиатуры                                  #
+# --------------------------------------------------------------------------- #
+#
+# Разметка aiogram неизменяемая (frozen pydantic), поэтому один экземпляр
+# можно отдавать во все апдейты. Главных клавиатур две — для покупателя и
+# для администратора, они собираются при импорте. Клавиатуры из каталога
+# собираются при первом обращении и хранятся в снимке каталога: после
+# catalog.invalidate() снимок перечитывается, и вместе с ним — клавиатуры.
+
+_ADMIN_IDS = frozenset(admin_id)
+
+
+def _main_keyboard(is_admin: bool) -> ReplyKeyboardMarkup:
     main_keyboard = [
         [KeyboardButton(text="📋 Открыть меню")],
         [KeyboardButton(text="🛒 Корзина")],
         [KeyboardButton(text="🤩 Подписка")],
         [KeyboardButton(text="💬 Поддержка")]
     ]
-    if user_telegram_id in admin_id:
+    if is_admin:
         main_keyboard.append([
             KeyboardButton(text="📊 Статистика"),
             KeyboardButton(text="🛒 Заказы"),
@@ -22,8 +42,95 @@ def get_main_reply_keyboard(user_telegram_id: int):
             KeyboardButton(text="➕ Добавить товар"),
             KeyboardButton(text="➕ Активировать товар"),
         ])
+        main_keyboard.append([KeyboardButton(text="📣 Рассылка")])
     return ReplyKeyboardMarkup(
         keyboard=main_keyboard,
         resize_keyboard=True,
         one_time_keyboard=True
-    )
\ No newline at end of file
+    )
+
+
+CUSTOMER_KEYBOARD = _main_keyboard(is_admin=False)
+ADMIN_KEYBOARD = _main_keyboard(is_admin=True)
+
+
+def get_main_reply_keyboard(user_telegram_id: int) -> ReplyKeyboardMarkup:
+    return ADMIN_KEYBOARD if user_telegram_id in _ADMIN_IDS else CUSTOMER_KEYBOARD
+
+
+# ----------------------------- из каталога ---------------------------------- #
+
+def _derived(snapshot: CatalogSnapshot, key: Hashable, build: Callable[[], object]):
+    value = snapshot.derived.get(key)
+    if value is None:
+        value = snapshot.derived[key] = build()
+    return value
+
+
+def _two_columns(builder: InlineKeyboardBuilder, buttons: list) -> None:
+    for i in range(0, len(buttons), 2):
+        builder.row(*buttons[i:i+2])
+
+
+async def menu_keyboard() -> InlineKeyboardMarkup | None:
+    """Категории для /menu; None — меню пусто."""
+    snapshot = await catalog.snapshot()
+
+    def build() -> InlineKeyboardMarkup | bool:
+        if not snapshot.categories:
+            return False
+        kb = InlineKeyboardBuilder()
+        kb.add(*(
+            InlineKeyboardButton(text=cat.title, callback_data=f"cat_{cat.id}")
+            for cat in snapshot.categories
+        ))
+        kb.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="exit_menu"))
+        kb.adjust(2)
+        return kb.as_markup()
+
+    return _derived(snapshot, "menu", build) or None
+
+
+async def category_keyboard(cat_id: int, is_admin: bool) -> InlineKeyboardMarkup | None:
+    """Товары категории; None — активных товаров нет."""
+    snapshot = await catalog.snapshot()
+
+    def build() -> InlineKeyboardMarkup | bool:
+        products = snapshot.active_products(cat_id)
+        if not products:
+            return False
+        kb = InlineKeyboardBuilder()
+        _two_columns(kb, [
+            InlineKeyboardButton(text=prod.title, callback_data=f"show_product_details:{prod.id}")
+            for prod in products
+        ])
+        if is_admin:
+            kb.row(InlineKeyboardButton(text="Редактировать категорию", callback_data=f"edit_cat:{cat_id}"))
+            kb.row(InlineKeyboardButton(text="Удалить категорию", callback_data=f"remove_cat:{cat_id}"))
+        kb.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="exit_cart"))
+        return kb.as_markup(resize_keyboard=True)
+
+    # cat_id приходит из callback data: кэшируем только категории с товарами
+    # из снимка, чтобы поддельные id не раздували кэш
+    if cat_id not in snapshot.by_category:
+        return build() or None
+    return _derived(snapshot, ("category", cat_id, is_admin), build) or None
+
+
+async def disabled_products_keyboard() -> InlineKeyboardMarkup | None:
+    """Отключённые товары для админа; None — все товары активны."""
+    snapshot = await catalog.snapshot()
+
+    def build() -> InlineKeyboardMarkup | bool:
+        disabled = [p for p in snapshot.products.values() if not p.is_active]
+        if not disabled:
+            return False
+        kb = InlineKeyboardBuilder()
+        _two_columns(kb, [
+            InlineKeyboardButton(text=product.title, callback_data=f"showdetails:{product.id}")
+            for product in disabled
+        ])
+        kb.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_main_menu"))
+        return kb.as_markup(resize_keyboard=True)
+
+    return _derived(snapshot, "disabled", build) or None
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import atexit
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+import querylog
+from config import (
+    LOG_BACKUP_COUNT,
+    LOG_FILE,
+    LOG_FORMAT,
+    LOG_LEVEL,
+    LOG_MAX_BYTES,
+    LOG_QUEUE_SIZE,
+    LOG_ROTATE_WHEN,
+    LOG_SAMPLE_RATE,
+)
+
+
+# --------------------------------------------------------------------------- #
+#                        Неблокирующее логирование                            #
+# --------------------------------------------------------------------------- #
+#
+# Корневой логгер пишет только в QueueHandler: запись кладётся в очередь без
+# ввода-вывода, а файл и консоль обслуживает QueueListener в отдельном
+# потоке. Очередь ограничена — при переполнении записи отбрасываются и
+# считаются, а не блокируют event loop. Частые INFO/DEBUG с одного места в
+# коде прореживаются (LOG_SAMPLE_RATE записей в секунду на место вызова).
+#
+# Воркер-процессы не открывают bot.log сами: их записи через очередь
+# multiprocessing попадают в тот же listener приёмника, поэтому ротация
+# файла происходит в одном процессе.
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# (update_id, chat_id) апдейта, который сейчас обрабатывается
+log_context: ContextVar[Tuple[int | None, int | None]] = ContextVar(
+    "log_context", default=(None, None)
+)
+
+
+class ContextFilter(logging.Filter):
+    """Добавить к записи update_id, chat_id и обработчик.
+
+    Работает в потоке, который логирует: в потоке listener'а contextvars уже
+    не те.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id, record.chat_id = log_context.get()
+        handler = querylog.current_handler()
+        record.handler = None if handler == "-" else handler
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Не больше ``rate`` записей в секунду с одного места вызова.
+
+    WARNING и выше не прореживаются. Первая запись после паузы сообщает,
+    сколько похожих было пропущено.
+    """
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+        # (файл, строка) -> [токены, время последнего пополнения, пропущено]
+        self._buckets: Dict[Tuple[str, int], List[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.rate, now, 0]
+        tokens = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            return False
+        bucket[0] = tokens - 1
+        if bucket[2]:
+            record.sampled_out = int(bucket[2])
+            bucket[2] = 0
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при полной очереди выбрасывает запись."""
+
+    def __init__(self, q) -> None:
+        super().__init__(q)
+        self.dropped = 0
+        self._lock_dropped = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Как в базовом классе, но сообщение и traceback хранятся раздельно:
+        # JSON-форматтеру traceback нужен отдельным полем
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        skipped = getattr(record, "sampled_out", 0)
+        if skipped:
+            record.msg += f" (пропущено похожих: {skipped})"
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if record.stack_info:
+            record.exc_text = f"{record.exc_text or ''}\n{record.stack_info}".strip()
+            record.stack_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock_dropped:
+                self.dropped += 1
+            return
+        if self.dropped:
+            with self._lock_dropped:
+                dropped, self.dropped = self.dropped, 0
+            notice = logging.makeLogRecord({
+                "name": "logsetup", "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f"Очередь логов переполнена, пропущено записей: {dropped}",
+            })
+            try:
+                self.queue.put_nowait(notice)
+            except queue.Full:
+                with self._lock_dropped:
+                    self.dropped += dropped
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("update_id", "chat_id", "handler"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.processName != "MainProcess":
+            entry["process"] = record.processName
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """Ротация и по времени (``when``), и по размеру (``max_bytes``)."""
+
+    def __init__(self, filename: str, *, when: str, max_bytes: int, backup_count: int) -> None:
+        super().__init__(filename, when=when, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes <= 0:
+            return False
+        if self.stream is None:
+            self.stream = self._open()
+        return self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes
+
+    def rotation_filename(self, default_name: str) -> str:
+        # Несколько ротаций по размеру за один период: bot.log.2025-09-01.1, .2, ...
+        taken = glob.glob(glob.escape(default_name) + "*")
+        if not taken:
+            return default_name
+        numbers = [
+            int(suffix) for suffix in (p[len(default_name) + 1:] for p in taken) if suffix.isdigit()
+        ]
+        return f"{default_name}.{max(numbers, default=0) + 1}"
+
+    def getFilesToDelete(self) -> List[str]:
+        # Имена с суффиксом .10 сортируются раньше .2 — старые файлы
+        # определяем по времени изменения, а не по имени
+        backups = sorted(glob.glob(glob.escape(self.baseFilename) + ".*"), key=os.path.getmtime)
+        return backups[: max(len(backups) - self.backupCount, 0)]
+
+
+def _formatter() -> logging.Formatter:
+    if LOG_FORMAT == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+_listeners: List[logging.handlers.QueueListener] = []
+_handlers: List[logging.Handler] = []
+
+
+def _install(q) -> None:
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    queue_handler = DroppingQueueHandler(q)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    queue_handler.addFilter(ContextFilter())
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+
+def setup_logging() -> None:
+    """Файл с ротацией и консоль за очередью (вызывается один раз в main)."""
+    if _listeners:
+        return
+    formatter = _formatter()
+    console = logging.StreamHandler()
+    console.setFormatter(formatter)
+    _handlers.append(console)
+    if LOG_FILE:
+        file_handler = SizeAndTimeRotatingFileHandler(
+            LOG_FILE,
+            when=LOG_ROTATE_WHEN,
+            max_bytes=LOG_MAX_BYTES,
+            backup_count=LOG_BACKUP_COUNT,
+        )
+        file_handler.setFormatter(formatter)
+        _handlers.append(file_handler)
+
+    q: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    _install(q)
+    listen(q)
+    atexit.register(shutdown_logging)
+
+
+def listen(q) -> None:
+    """Обслуживать ещё одну очередь (например, очередь воркер-процессов)."""
+    listener = logging.handlers.QueueListener(q, *_handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+
+def forward_to(q) -> None:
+    """В воркер-процессе: отправлять записи в очередь приёмника."""
+    _install(q)
+
+
+def shutdown_logging() -> None:
+    while _listeners:
+        _listeners.pop().stop()
+    for handler in _handlers:
+        handler.close()
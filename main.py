@@ -1,13 +1,15 @@
 import asyncio
 import logging
+import signal
+from contextlib import suppress
 from pathlib import Path
-from dotenv import load_dotenv
-import os
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import SimpleEventIsolation
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.session.aiohttp import AiohttpSession
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.client.bot import DefaultBotProperties
 
 from commands import set_commands
@@ -16,72 +18,184 @@ from commands import set_commands
 # 1. Настройка логирования                                                   #
 #--------------------------------------------------------------------------- #
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO) 
-
-
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-
-file_handler = logging.FileHandler('bot.log', encoding='utf-8')
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(formatter)
-
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-console_handler.setFormatter(formatter)
+# Файл и консоль пишет отдельный поток (logsetup); настраивается в main(),
+# воркер-процессы пересылают записи в очередь приёмника
 
-logger.handlers = []
-
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+logger = logging.getLogger()
 
 #--------------------------------------------------------------------------- #
-# 2. Загрузка переменных окружения                                           #
+# 2. Настройки и база данных                                                 #
 #--------------------------------------------------------------------------- #
-load_dotenv()
-
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-DATABASE_URL = os.getenv('DATABASE_URL')
-admin_id = list(map(int, os.getenv('admin_id').split(',')))
+# Окружение читается один раз в config, движок создаётся в db
 
-# --------------------------------------------------------------------------- #
-# 3. Движок базы данных и фабрика сессий                                      #
-# --------------------------------------------------------------------------- #
-engine = create_async_engine(DATABASE_URL, echo=False, future=True)
-async_session_factory = async_sessionmaker(
-    engine, expire_on_commit=False, class_=AsyncSession
+from config import (
+    BOT_TOKEN, admin_id, FSM_STORAGE, FSM_CACHE, RUN_MODE, TELEGRAM_API_URL,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_REGISTER, DROP_PENDING_UPDATES,
+    WEBAPP_HOST, WEBAPP_PORT, UPDATES_CONCURRENCY, WORKERS,
+    METRICS_HOST, METRICS_PORT,
 )
-
-async def init_db() -> None:
-    from models import Base
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+from db import engine, async_session_factory, init_db
 
 # --------------------------------------------------------------------------- #
-# 4. Запуск приложения                                                        #
+# 3. Запуск приложения                                                        #
 # --------------------------------------------------------------------------- #
 
+def fsm_cached() -> bool:
+    # Кэш DBStorage с БД не сверяется: он верен, только если апдейты чата
+    # приходят в один процесс. getUpdates Telegram отдаёт одному получателю,
+    # воркеры делят чаты по chat.id, а за вебхуком может стоять несколько инстансов
+    if FSM_CACHE != 'auto':
+        return FSM_CACHE == '1'
+    return WORKERS > 0 or RUN_MODE != 'webhook'
+
+def build_storage() -> BaseStorage:
+    if FSM_STORAGE == 'memory':
+        return MemoryStorage()
+    from storage import DBStorage
+    return DBStorage(async_session_factory, cached=fsm_cached())
+
+async def start_background(bot: Bot, dispatcher: Dispatcher, metrics_port: int) -> None:
+    from outbox import outbox
+    from broadcast import broadcasts
+    import metrics
+    outbox.start(bot)
+    broadcasts.watch(bot)
+    metrics.instrument_engine(engine.sync_engine)
+    metrics.watch_pool(engine.sync_engine)
+    metrics.watch_fsm(dispatcher.storage)
+    await metrics.server.start(METRICS_HOST, metrics_port)
+
+async def stop_background() -> None:
+    from outbox import outbox
+    from broadcast import broadcasts
+    from debounce import cart_renders
+    from jobs import runner
+    import metrics
+    await cart_renders.close()
+    await metrics.server.stop()
+    await outbox.stop()
+    await broadcasts.stop()
+    await runner.shutdown()
+
 async def on_startup(bot: Bot) -> None:
+    import stats
     await init_db()
+    await stats.ensure_initialized(async_session_factory)
     await set_commands(bot, admin_id)
     logger.info("База данных инициализирована")
 
-async def main() -> None:
-    session = AiohttpSession()
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="html"), 
-              session=session)
-    dp = Dispatcher(storage=MemoryStorage())
+def build_bot() -> Bot:
+    from middlewares import TelegramMetricsMiddleware
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    else:
+        session = AiohttpSession()
+    session.middleware(TelegramMetricsMiddleware())
+    return Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="html"),
+               session=session)
+
+def build_dispatcher() -> Dispatcher:
+    # Изоляция по ключу FSM: апдейты одного чата не обрабатываются параллельно
+    dp = Dispatcher(storage=build_storage(), events_isolation=SimpleEventIsolation())
 
     from routers.admin import router as admin_router
     from routers.user import router as user_router
     from routers.subscriptions import router as subscriptions_router
 
+    import metrics
+    from middlewares import (
+        DbSessionMiddleware, HandlerMetricsMiddleware, LogContextMiddleware, QueryScopeMiddleware,
+        UpdateMetricsMiddleware,
+    )
+    dp["metrics_port"] = METRICS_PORT
+    dp.update.outer_middleware(LogContextMiddleware())
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.update.outer_middleware(DbSessionMiddleware())
+    # Внутренние middleware диспетчера действуют и во вложенных роутерах
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(HandlerMetricsMiddleware())
+            observer.middleware(QueryScopeMiddleware())
+
     dp.include_router(admin_router)
     dp.include_router(user_router)
     dp.include_router(subscriptions_router)
-    await bot.delete_webhook(drop_pending_updates=True)
+    dp.startup.register(start_background)
+    dp.shutdown.register(stop_background)
+    return dp
+
+async def run_polling(bot: Bot, dp: Dispatcher) -> None:
+    await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+    await on_startup(bot)
+    await dp.start_polling(bot, tasks_concurrency_limit=UPDATES_CONCURRENCY)
+
+async def register_webhook(bot: Bot, dp: Dispatcher) -> None:
+    if not WEBHOOK_REGISTER:
+        return
+    url = WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
+    allowed_updates = dp.resolve_used_update_types()
+    max_connections = min(UPDATES_CONCURRENCY, 100)
+    # При нескольких инстансах за балансировщиком регистрирует любой из них;
+    # если вебхук уже такой, перезапуск и выкатка его не трогают. Секрет
+    # getWebhookInfo не показывает: после смены WEBHOOK_SECRET удалите вебхук
+    # (deleteWebhook) перед запуском
+    info = await bot.get_webhook_info()
+    if (
+        not DROP_PENDING_UPDATES
+        and info.url == url
+        and sorted(info.allowed_updates or ()) == sorted(allowed_updates)
+        and info.max_connections == max_connections
+    ):
+        logger.info(f"Вебхук уже зарегистрирован: {url}")
+        return
+    await bot.set_webhook(
+        url=url,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=allowed_updates,
+        max_connections=max_connections,
+        drop_pending_updates=DROP_PENDING_UPDATES,
+    )
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    from webhook import WebhookHandler, build_app, dispatcher_sink, serve
+
+    if FSM_STORAGE == 'db' and fsm_cached():
+        logger.warning("FSM_CACHE=1 в режиме webhook без WORKERS: безопасно, только если инстанс один")
     await on_startup(bot)
-    await dp.start_polling(bot)
+    await register_webhook(bot, dp)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    handler = WebhookHandler(
+        dispatcher_sink(dp, bot),
+        secret_token=WEBHOOK_SECRET,
+        max_concurrency=UPDATES_CONCURRENCY,
+    )
+    await dp.emit_startup(bot=bot, dispatcher=dp, **dp.workflow_data)
+    try:
+        await serve(build_app(handler, WEBHOOK_PATH), WEBAPP_HOST, WEBAPP_PORT, stop)
+    finally:
+        await handler.close()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, **dp.workflow_data)
+        await bot.session.close()
+
+async def main() -> None:
+    from logsetup import setup_logging
+    setup_logging()
+    if WORKERS > 0:
+        from workers import run_sharded
+        await run_sharded(WORKERS, UPDATES_CONCURRENCY)
+        return
+    bot = build_bot()
+    dp = build_dispatcher()
+    if RUN_MODE == 'webhook':
+        await run_webhook(bot, dp)
+    else:
+        await run_polling(bot, dp)
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import db_pool
+import querylog
+
+
+# --------------------------------------------------------------------------- #
+#                     Метрики в текстовом формате Prometheus                  #
+# --------------------------------------------------------------------------- #
+#
+# Без внешних зависимостей: счётчики и гистограммы живут в памяти процесса и
+# отдаются по GET /metrics на локальном порту. Значения, которые дешевле
+# посчитать в момент запроса (пул БД, распределение состояний FSM), собирают
+# коллекторы. У каждого воркер-процесса свой реестр и свой порт.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам (не накопительные)..., +Inf, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        row = self._values.get(labels)
+        if row is None:
+            row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+                break
+        else:
+            row[len(self.buckets)] += 1
+        row[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, row in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), row):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(row[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+Collector = Callable[[], Awaitable[List[str]]]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[Counter | Histogram] = []
+        self._collectors: List[Collector] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func: Collector) -> Collector:
+        self._collectors.append(func)
+        return func
+
+    async def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for collect in self._collectors:
+            try:
+                lines.extend(await collect())
+            except Exception as e:
+                logging.warning(f"Коллектор метрик {collect.__name__} упал: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+# ----------------------------- определения ---------------------------------- #
+
+updates_total = registry.register(Counter(
+    "bot_updates_total", "Обработанные апдейты по типу и исходу", ("type", "result"),
+))
+update_duration = registry.register(Histogram(
+    "bot_update_duration_seconds", "Полное время обработки апдейта", ("type",),
+))
+handler_duration = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика", ("handler",),
+))
+handler_errors = registry.register(Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ("handler", "error"),
+))
+telegram_duration = registry.register(Histogram(
+    "bot_telegram_request_duration_seconds", "Время запроса к Bot API", ("method",),
+))
+telegram_errors = registry.register(Counter(
+    "bot_telegram_errors_total", "Ошибки запросов к Bot API", ("method", "error"),
+))
+db_queries = registry.register(Counter(
+    "bot_db_queries_total", "Запросы к БД по обработчику и типу оператора", ("handler", "kind"),
+))
+
+
+# ------------------------------- запросы к БД ------------------------------- #
+
+_QUERY_KINDS = {"select", "insert", "update", "delete", "with"}
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Считать запросы движка (sync_engine у async-движка)."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany) -> None:
+        kind = statement.lstrip()[:6].lower()
+        db_queries.inc(querylog.current_handler(), kind if kind in _QUERY_KINDS else "other")
+
+
+# -------------------------------- коллекторы -------------------------------- #
+
+def _gauge(name: str, help: str, samples: Iterable[Tuple[str, float]]) -> List[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} gauge"] + [
+        f"{name}{labels} {_number(value)}" for labels, value in samples
+    ]
+
+
+def watch_pool(engine: Engine) -> None:
+    @registry.collector
+    async def db_pool_metrics() -> List[str]:
+        s = db_pool.snapshot(engine)
+        stats = db_pool.pool_stats
+        lines = []
+        if "size" in s:
+            lines += _gauge("bot_db_pool_size", "Размер пула соединений", [("", s["size"])])
+            lines += _gauge("bot_db_pool_in_use", "Занятые соединения", [("", s["in_use"])])
+            lines += _gauge("bot_db_pool_overflow", "Соединения сверх пула", [("", s["overflow"])])
+        lines += [
+            "# HELP bot_db_pool_overflow_opened_total Открытые соединения сверх пула",
+            "# TYPE bot_db_pool_overflow_opened_total counter",
+            f"bot_db_pool_overflow_opened_total {stats.overflow_opened}",
+            "# HELP bot_db_pool_timeouts_total Таймауты ожидания соединения",
+            "# TYPE bot_db_pool_timeouts_total counter",
+            f"bot_db_pool_timeouts_total {stats.timeouts}",
+            "# HELP bot_db_pool_wait_seconds Ожидание соединения из пула",
+            "# TYPE bot_db_pool_wait_seconds histogram",
+        ]
+        for bound, count in stats.wait_buckets.items():
+            lines.append(f'bot_db_pool_wait_seconds_bucket{{le="{_number(bound)}"}} {count}')
+        lines.append(f"bot_db_pool_wait_seconds_sum {_number(stats.wait_total)}")
+        lines.append(f"bot_db_pool_wait_seconds_count {stats.checkouts}")
+        return lines
+
+
+def watch_fsm(storage: BaseStorage) -> None:
+    # Для DBStorage распределение общее на все процессы (считается по БД)
+    @registry.collector
+    async def fsm_metrics() -> List[str]:
+        if isinstance(storage, MemoryStorage):
+            counts: Dict[str, int] = {}
+            for record in storage.storage.values():
+                if record.state:
+                    counts[record.state] = counts.get(record.state, 0) + 1
+        elif hasattr(storage, "state_counts"):
+            counts = await storage.state_counts()
+        else:
+            return []
+        return _gauge(
+            "bot_fsm_states",
+            "Пользователи в каждом состоянии FSM",
+            [(_labels(("state",), (state,)), n) for state, n in sorted(counts.items())],
+        )
+
+
+# ---------------------------------- сервер ---------------------------------- #
+
+async def _metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        text=await registry.render(), content_type="text/plain", charset="utf-8"
+    )
+
+
+class MetricsServer:
+    def __init__(self) -> None:
+        self._runner: web.AppRunner | None = None
+
+    async def start(self, host: str, port: int) -> None:
+        if not port or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", _metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host=host, port=port).start()
+        except OSError as e:
+            # Метрики не должны мешать боту запуститься
+            logging.warning(f"Не удалось открыть порт метрик {host}:{port}: {e}")
+            await runner.cleanup()
+            return
+        self._runner = runner
+        logging.info(f"Метрики: http://{host}:{port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+server = MetricsServer()
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.dispatcher.event.bases import UNHANDLED, SkipHandler
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import ORMExecuteState, Session
+
+from db import async_session_factory
+import metrics
+from logsetup import log_context
+import querylog
+
+
+# --------------------------------------------------------------------------- #
+#                Одна сессия БД на апдейт (unit of work)                      #
+# --------------------------------------------------------------------------- #
+#
+# Обработчики и хелперы берут сессию через ``async with db_session()``.
+# Внутри апдейта это одна и та же сессия: она создаётся при первом обращении,
+# а в конце апдейта middleware один раз делает commit (или rollback при
+# исключении) и закрывает её. Апдейт, который не ходил в БД, сессию не
+# открывает вовсе.
+#
+# Вне апдейта (фоновые задачи, CLI) и в задачах, запущенных из обработчика,
+# db_session() ведёт себя как async_session_factory(): отдельная сессия на
+# блок. Общая сессия выдаётся только задаче, обрабатывающей апдейт, — иначе
+# фоновая задача пережила бы её закрытие.
+#
+# Блок, который только читал, при выходе завершает транзакцию (commit), и
+# соединение возвращается в пул, пока обработчик ходит в Bot API. Объекты
+# остаются доступны: expire_on_commit=False. Если в транзакции есть запись
+# (flush, DML, SELECT ... FOR UPDATE) или несброшенные изменения, она
+# остаётся открытой до конца апдейта.
+
+# Ключ в Session.info: в текущей транзакции что-то записано или заблокировано
+_WRITES = "update_session_writes"
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_write_statement(state: ORMExecuteState) -> None:
+    if not state.is_select or state.statement._for_update_arg is not None:
+        state.session.info[_WRITES] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_flush(session: Session, flush_context: Any) -> None:
+    session.info[_WRITES] = True
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _clear_writes(session: Session, transaction: Any) -> None:
+    if transaction.parent is None:
+        session.info.pop(_WRITES, None)
+
+
+class _UpdateSession:
+    def __init__(self) -> None:
+        self.owner = asyncio.current_task()
+        self.session: AsyncSession | None = None
+
+    def get(self) -> AsyncSession:
+        if self.session is None:
+            self.session = async_session_factory()
+        return self.session
+
+
+_current: ContextVar[_UpdateSession | None] = ContextVar("update_db_session", default=None)
+
+
+@asynccontextmanager
+async def db_session() -> AsyncIterator[AsyncSession]:
+    scope = _current.get()
+    if scope is None or scope.owner is not asyncio.current_task():
+        async with async_session_factory() as session:
+            yield session
+        return
+
+    session = scope.get()
+    try:
+        yield session
+    except BaseException:
+        # Как и при закрытии отдельной сессии: незафиксированное откатываем
+        await session.rollback()
+        raise
+    if (
+        session.in_transaction()
+        and not session.info.get(_WRITES)
+        and not (session.new or session.dirty or session.deleted)
+    ):
+        await session.commit()
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        scope = _UpdateSession()
+        token = _current.set(scope)
+        try:
+            result = await handler(event, data)
+            if scope.session is not None:
+                await scope.session.commit()
+            return result
+        except BaseException:
+            if scope.session is not None:
+                await scope.session.rollback()
+            raise
+        finally:
+            _current.reset(token)
+            if scope.session is not None:
+                await scope.session.close()
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """update_id и chat_id апдейта — в контекст логов (см. logsetup)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat")
+        token = log_context.set((event.update_id, chat.id if chat else None))
+        try:
+            return await handler(event, data)
+        finally:
+            log_context.reset(token)
+
+
+# --------------------------------------------------------------------------- #
+#                                 Метрики                                     #
+# --------------------------------------------------------------------------- #
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware апдейта: тип, исход и полное время обработки."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        event_type = event.event_type
+        start = time.perf_counter()
+        result = "error"
+        try:
+            response = await handler(event, data)
+            result = "unhandled" if response is UNHANDLED else "ok"
+            return response
+        finally:
+            metrics.update_duration.observe(time.perf_counter() - start, event_type)
+            metrics.updates_total.inc(event_type, result)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время каждого обработчика по имени функции."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = data["handler"].callback.__name__
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except SkipHandler:
+            raise
+        except Exception as e:
+            metrics.handler_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            metrics.handler_duration.observe(time.perf_counter() - start, name)
+
+
+class QueryScopeMiddleware(BaseMiddleware):
+    """Внутренний middleware: приписать запросы к БД текущему обработчику."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        with querylog.scope(data["handler"].callback.__name__):
+            return await handler(event, data)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время и ошибки запросов к Bot API по методу."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            metrics.telegram_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            metrics.telegram_duration.observe(time.perf_counter() - start, name)
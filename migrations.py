@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import Connection, func, inspect, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.schema import CreateIndex
+
+from models import Base, Order, OrderItem, OutboxMessage, Product, Subscription, User
+
+
+# --------------------------------------------------------------------------- #
+#                             Миграции схемы БД                               #
+# --------------------------------------------------------------------------- #
+#
+# Вместо create_all на каждом старте — пронумерованные миграции. Применённые
+# версии записываются в schema_version, при старте выполняются только новые,
+# каждая в своей транзакции. В Postgres миграции сериализуются advisory
+# lock'ом, поэтому несколько инстансов могут стартовать одновременно.
+#
+# Правила: применённую миграцию не меняем, а добавляем следующую; DDL пишем
+# идемпотентно (IF NOT EXISTS), т.к. свежая база получает таблицы сразу из
+# моделей в миграции 1.
+#
+#     python migrations.py            # применить новые
+#     python migrations.py status     # текущая версия и ожидающие миграции
+#     python migrations.py check      # EXPLAIN горячих запросов: идут ли по индексам
+
+# Произвольная константа для pg_advisory_lock
+MIGRATIONS_LOCK_ID = 730_411_201
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+def _baseline(conn: Connection) -> None:
+    # Существующие таблицы не трогаются, недостающие создаются
+    Base.metadata.create_all(conn, checkfirst=True)
+
+
+def _create_indexes(*names: str) -> Callable[[Connection], None]:
+    def apply(conn: Connection) -> None:
+        indexes = {ix.name: ix for table in Base.metadata.tables.values() for ix in table.indexes}
+        for name in names:
+            conn.execute(CreateIndex(indexes[name], if_not_exists=True))
+
+    return apply
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", _baseline),
+    Migration(
+        2,
+        "indexes for hot queries",
+        _create_indexes(
+            "ix_orders_status_created_at",
+            "ix_orders_created_at",
+            "ix_orders_user_id",
+            "ix_products_category_active",
+            "ix_order_items_order_id",
+            "ix_users_created_at",
+            "ix_subscriptions_user_id",
+            "ix_outbox_pending",
+        ),
+    ),
+    Migration(3, "orders keyset pagination", _create_indexes("ix_orders_status_id")),
+]
+
+
+def _ensure_version_table(conn: Connection) -> None:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        " version INTEGER PRIMARY KEY,"
+        " name VARCHAR(128) NOT NULL,"
+        " applied_at TIMESTAMP WITH TIME ZONE NOT NULL)"
+    ))
+
+
+def _applied(conn: Connection) -> set[int]:
+    if not inspect(conn).has_table("schema_version"):
+        return set()
+    return set(conn.execute(text("SELECT version FROM schema_version")).scalars())
+
+
+async def migrate(engine: AsyncEngine) -> int:
+    """Применить недостающие миграции. Возвращает итоговую версию схемы."""
+    async with engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            await conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+            await conn.commit()
+        try:
+            async with conn.begin():
+                await conn.run_sync(_ensure_version_table)
+            # Читаем уже под блокировкой: другой инстанс мог успеть всё применить
+            applied = await conn.run_sync(_applied)
+            await conn.commit()
+            for migration in MIGRATIONS:
+                if migration.version in applied:
+                    continue
+                async with conn.begin():
+                    await conn.run_sync(migration.apply)
+                    await conn.execute(
+                        text(
+                            "INSERT INTO schema_version (version, name, applied_at) "
+                            "VALUES (:version, :name, :applied_at)"
+                        ),
+                        {
+                            "version": migration.version,
+                            "name": migration.name,
+                            "applied_at": datetime.now(timezone.utc),
+                        },
+                    )
+                logging.info(f"Миграция {migration.version} ({migration.name}) применена")
+        finally:
+            if postgres:
+                await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+                await conn.commit()
+    return MIGRATIONS[-1].version
+
+
+# --------------------------------------------------------------------------- #
+#                  Проверка планов горячих запросов (EXPLAIN)                 #
+# --------------------------------------------------------------------------- #
+
+def hot_queries() -> list[tuple[str, object]]:
+    """(ожидаемый индекс, запрос) — в том виде, в каком запросы идут из кода."""
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return [
+        (
+            "ix_orders_status_created_at",
+            select(Order.id)
+            .where(Order.status == "в процессе")
+            .order_by(Order.created_at.desc())
+            .limit(20),
+        ),
+        (
+            "ix_orders_status_id",
+            select(Order.id, Order.status, Order.total_price)
+            .where(Order.status == "выполнен", Order.id >= 1000, Order.id < 500000)
+            .order_by(Order.id.desc())
+            .limit(11),
+        ),
+        (
+            "ix_orders_created_at",
+            select(func.count()).select_from(Order).where(Order.created_at >= today),
+        ),
+        (
+            "ix_products_category_active",
+            select(Product.id, Product.title)
+            .where(Product.category_id == 1, Product.is_active == True)
+            .order_by(Product.id),
+        ),
+        (
+            "ix_order_items_order_id",
+            select(OrderItem.qty, OrderItem.item_price).where(OrderItem.order_id == 1),
+        ),
+        (
+            "ix_users_created_at",
+            select(func.count()).select_from(User).where(User.created_at >= today),
+        ),
+        (
+            "ix_subscriptions_user_id",
+            select(Subscription.expires_at)
+            .where(Subscription.user_id == 1)
+            .order_by(Subscription.expires_at.desc())
+            .limit(1),
+        ),
+        (
+            "ix_outbox_pending",
+            select(OutboxMessage.id)
+            .where(
+                OutboxMessage.status == "pending",
+                OutboxMessage.next_attempt_at <= today + timedelta(days=1),
+            )
+            .limit(20),
+        ),
+    ]
+
+
+async def check_plans(engine: AsyncEngine) -> list[tuple[str, bool, str]]:
+    """EXPLAIN каждого горячего запроса: (индекс, используется ли, план)."""
+    results = []
+    async with engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        async with conn.begin():
+            if postgres:
+                # На маленьких таблицах Postgres честно выбирает seq scan;
+                # проверяем, что индекс вообще применим к запросу
+                await conn.execute(text("SET LOCAL enable_seqscan = off"))
+            for index, query in hot_queries():
+                compiled = query.compile(dialect=conn.dialect)
+                params = tuple(compiled.params[name] for name in compiled.positiontup or ())
+                prefix = "EXPLAIN " if postgres else "EXPLAIN QUERY PLAN "
+                rows = (await conn.exec_driver_sql(prefix + compiled.string, params)).all()
+                plan = "\n".join(str(row[-1]) for row in rows)
+                results.append((index, index in plan, plan))
+            await conn.rollback()
+    return results
+
+
+async def _main(argv: list[str]) -> int:
+    from db import engine
+
+    command = argv[1] if len(argv) > 1 else "upgrade"
+    try:
+        if command == "upgrade":
+            version = await migrate(engine)
+            print(f"Схема в актуальной версии {version}")
+        elif command == "status":
+            async with engine.connect() as conn:
+                applied = await conn.run_sync(_applied)
+            await conn.commit()
+            for migration in MIGRATIONS:
+                mark = "x" if migration.version in applied else " "
+                print(f"[{mark}] {migration.version:3d} {migration.name}")
+        elif command == "check":
+            failed = 0
+            for index, used, plan in await check_plans(engine):
+                print(f"{'OK  ' if used else 'FAIL'} {index}")
+                if not used:
+                    failed += 1
+                    print("     " + plan.replace("\n", "\n     "))
+            return 1 if failed else 0
+        else:
+            print("usage: python migrations.py [upgrade|status|check]")
+            return 2
+    finally:
+        await engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv)))
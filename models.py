@@ -8,10 +8,13 @@ from sqlalchemy import (
     Boolean,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     Numeric,
     String,
+    Text,
     func,
+    text,
     BigInteger,
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
@@ -27,6 +30,10 @@ class Base(DeclarativeBase):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Новые пользователи за день
+        Index("ix_users_created_at", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     tg_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False, index=True)
@@ -77,6 +84,14 @@ class Category(Base):
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # Активные товары категории; отключённые в индекс не попадают
+        Index(
+            "ix_products_category_active", "category_id", "id",
+            postgresql_where=text("is_active"),
+            sqlite_where=text("is_active = 1"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     category_id: Mapped[int] = mapped_column(
@@ -106,6 +121,14 @@ class Product(Base):
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Списки заказов по статусу, свежие сверху; подсчёт по статусам
+        Index("ix_orders_status_created_at", "status", "created_at"),
+        Index("ix_orders_created_at", "created_at"),
+        Index("ix_orders_user_id", "user_id"),
+        # Постраничный просмотр по статусу: keyset по id
+        Index("ix_orders_status_id", "status", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(
@@ -149,6 +172,9 @@ class Order(Base):
 # --------------------------------------------------------------------------- #
 class OrderItem(Base):
     __tablename__ = "order_items"
+    __table_args__ = (
+        Index("ix_order_items_order_id", "order_id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     order_id: Mapped[int] = mapped_column(
@@ -177,6 +203,9 @@ class OrderItem(Base):
 # --------------------------------------------------------------------------- #
 class Subscription(Base):
     __tablename__ = "subscriptions"
+    __table_args__ = (
+        Index("ix_subscriptions_user_id", "user_id", "expires_at"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(
@@ -192,4 +221,106 @@ class Subscription(Base):
     user: Mapped["User"] = relationship(back_populates="subscriptions")
 
     def __repr__(self) -> str:
-        return f"<Subscription id={self.id} user_id={self.user_id} expires={self.expires_at}>"
\ No newline at end of file
+        return f"<Subscription id={self.id} user_id={self.user_id} expires={self.expires_at}>"
+
+
+# --------------------------------------------------------------------------- #
+#                            Таблица fsm_storage                              #
+# --------------------------------------------------------------------------- #
+class FSMRecord(Base):
+    __tablename__ = "fsm_storage"
+
+    key: Mapped[str] = mapped_column(String(128), primary_key=True)
+    state: Mapped[str | None] = mapped_column(String(128))
+    data: Mapped[str | None] = mapped_column(Text)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
+
+    def __repr__(self) -> str:
+        return f"<FSMRecord key={self.key!r} state={self.state!r}>"
+
+
+# --------------------------------------------------------------------------- #
+#                              Таблица outbox                                 #
+# --------------------------------------------------------------------------- #
+class OutboxMessage(Base):
+    __tablename__ = "outbox"
+    __table_args__ = (
+        # Очередь на отправку: только pending, отправленные индекс не раздувают
+        Index(
+            "ix_outbox_pending", "next_attempt_at", "id",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'"),
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    parse_mode: Mapped[str | None] = mapped_column(String(16))
+    # pending | sent | failed
+    status: Mapped[str] = mapped_column(
+        String(16),
+        default="pending",
+        server_default="pending",
+    )
+    attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    next_attempt_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+    )
+    last_error: Mapped[str | None] = mapped_column(String(255))
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+    )
+    sent_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+
+    def __repr__(self) -> str:
+        return f"<OutboxMessage id={self.id} chat_id={self.chat_id} status={self.status}>"
+
+
+# --------------------------------------------------------------------------- #
+#                             Таблица broadcasts                              #
+# --------------------------------------------------------------------------- #
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    # all | subscribers
+    audience: Mapped[str] = mapped_column(String(16), default="all", server_default="all")
+    # running | done | canceled
+    status: Mapped[str] = mapped_column(String(16), default="running", server_default="running")
+    created_by: Mapped[int | None] = mapped_column(BigInteger)
+    # Курсор keyset-итерации: последний обработанный users.id
+    last_user_id: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    delivered: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    blocked: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    failed: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    # Аренда: пока не истекла, кампанию ведёт процесс, который её захватил
+    locked_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+    )
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+
+    def __repr__(self) -> str:
+        return f"<Broadcast id={self.id} status={self.status} cursor={self.last_user_id}>"
+
+
+# --------------------------------------------------------------------------- #
+#                            Таблица stat_counters                            #
+# --------------------------------------------------------------------------- #
+class StatCounter(Base):
+    __tablename__ = "stat_counters"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[Decimal] = mapped_column(Numeric(14, 2), default=0, server_default="0")
+
+    def __repr__(self) -> str:
+        return f"<StatCounter {self.name}={self.value}>"
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, replace
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from typing import List, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Order
+from stats import STATUS_CANCELED, STATUS_DONE, STATUS_IN_PROGRESS, STATUS_NEW
+
+
+# --------------------------------------------------------------------------- #
+#                   Просмотр заказов: keyset-пагинация по id                  #
+# --------------------------------------------------------------------------- #
+#
+# Всё состояние списка — в callback_data: фильтр статуса, период и курсор.
+# Период при выборе один раз переводится в диапазон orders.id (id растут
+# вместе с created_at), поэтому любая страница — один запрос
+# WHERE status = ? AND id BETWEEN ? AND ? AND id < курсор ORDER BY id LIMIT n
+# по индексу (status, id) или по первичному ключу, на любой глубине.
+
+PAGE_SIZE = 10
+LOCAL_TZ = ZoneInfo("Europe/Moscow")
+
+# Коды статусов для callback_data (лимит Telegram — 64 байта)
+STATUS_CODES = {
+    "a": None,
+    "n": STATUS_NEW,
+    "p": STATUS_IN_PROGRESS,
+    "d": STATUS_DONE,
+    "c": STATUS_CANCELED,
+}
+STATUS_LABELS = {
+    "a": "Все",
+    "n": "Новые",
+    "p": "В процессе",
+    "d": "Выполнены",
+    "c": "Отменены",
+}
+
+OLDER, NEWER = "o", "n"
+
+
+@dataclass(frozen=True)
+class OrderListState:
+    status: str = "a"
+    # Период для заголовка, YYYYMMDD; 0 — без ограничения
+    date_from: int = 0
+    date_to: int = 0
+    # Тот же период в orders.id, включительно; hi = 0 — без верхней границы
+    lo_id: int = 0
+    hi_id: int = 0
+    direction: str = OLDER
+    cursor: int = 0
+
+    def pack(self) -> str:
+        return (
+            f"ol:{self.status}:{self.date_from}:{self.date_to}:"
+            f"{self.lo_id}:{self.hi_id}:{self.direction}:{self.cursor}"
+        )
+
+    @classmethod
+    def unpack(cls, data: str) -> OrderListState:
+        _, status, date_from, date_to, lo_id, hi_id, direction, cursor = data.split(":")
+        if status not in STATUS_CODES or direction not in (OLDER, NEWER):
+            raise ValueError(data)
+        return cls(
+            status, int(date_from), int(date_to), int(lo_id), int(hi_id), direction, int(cursor)
+        )
+
+    def first_page(self) -> OrderListState:
+        return replace(self, direction=OLDER, cursor=0)
+
+    def period_label(self) -> str:
+        if not self.date_from and not self.date_to:
+            return "за всё время"
+        fmt = lambda d: datetime.strptime(str(d), "%Y%m%d").strftime("%d.%m.%Y")  # noqa: E731
+        if self.date_from == self.date_to:
+            return fmt(self.date_from)
+        return f"{fmt(self.date_from) if self.date_from else '…'} — {fmt(self.date_to) if self.date_to else '…'}"
+
+
+@dataclass(frozen=True)
+class OrderRow:
+    id: int
+    status: str
+    total_price: Decimal
+    payment_method: str
+    created_at: datetime
+
+
+@dataclass(frozen=True)
+class OrderPage:
+    rows: List[OrderRow]
+    has_newer: bool
+    has_older: bool
+
+
+def _day_start(day: date) -> datetime:
+    # Границу дня по Москве сравниваем в UTC — так же хранит created_at
+    return datetime.combine(day, time.min, tzinfo=LOCAL_TZ).astimezone(timezone.utc)
+
+
+async def with_period(
+    session: AsyncSession, state: OrderListState, start: date | None, end: date | None
+) -> OrderListState:
+    """Перевести период [start, end] (по Москве) в диапазон orders.id."""
+    lo_id, hi_id = 0, 0
+    if start is not None:
+        lo_id = await session.scalar(
+            select(Order.id)
+            .where(Order.created_at >= _day_start(start))
+            .order_by(Order.created_at)
+            .limit(1)
+        )
+    if end is not None and lo_id is not None:
+        hi_id = await session.scalar(
+            select(Order.id)
+            .where(Order.created_at < _day_start(end + timedelta(days=1)))
+            .order_by(Order.created_at.desc())
+            .limit(1)
+        )
+    if lo_id is None or hi_id is None or (hi_id and hi_id < lo_id):
+        # В периоде нет заказов
+        lo_id, hi_id = -1, -1
+    return replace(
+        state,
+        date_from=int(start.strftime("%Y%m%d")) if start else 0,
+        date_to=int(end.strftime("%Y%m%d")) if end else 0,
+        lo_id=lo_id,
+        hi_id=hi_id,
+        direction=OLDER,
+        cursor=0,
+    )
+
+
+async def fetch_page(
+    session: AsyncSession, state: OrderListState, limit: int = PAGE_SIZE
+) -> OrderPage:
+    query = select(
+        Order.id, Order.status, Order.total_price, Order.payment_method, Order.created_at
+    )
+    status = STATUS_CODES[state.status]
+    if status is not None:
+        query = query.where(Order.status == status)
+    if state.lo_id:
+        query = query.where(Order.id >= state.lo_id)
+    if state.hi_id:
+        query = query.where(Order.id <= state.hi_id)
+
+    # Берём на одну строку больше, чтобы узнать, есть ли следующая страница
+    if state.direction == OLDER:
+        if state.cursor:
+            query = query.where(Order.id < state.cursor)
+        query = query.order_by(Order.id.desc())
+    else:
+        query = query.where(Order.id > state.cursor).order_by(Order.id)
+
+    rows = [OrderRow(*row) for row in await session.execute(query.limit(limit + 1))]
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    if state.direction == OLDER:
+        return OrderPage(rows, has_newer=bool(state.cursor), has_older=more)
+    rows.reverse()
+    return OrderPage(rows, has_newer=more, has_older=True)
+
+
+def parse_period(text: str) -> Tuple[date, date]:
+    """«01.09.2025» или «01.09.2025-30.09.2025» → (start, end)."""
+    parts = [p.strip() for p in text.replace("—", "-").split("-")]
+    if len(parts) not in (1, 2):
+        raise ValueError(text)
+    start = datetime.strptime(parts[0], "%d.%m.%Y").date()
+    end = datetime.strptime(parts[-1], "%d.%m.%Y").date()
+    if end < start:
+        start, end = end, start
+    return start, end
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import List, NamedTuple, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Order, OrderItem, User
+from stats import STATUS_CANCELED, STATUS_DONE, STATUS_IN_PROGRESS, STATUS_NEW
+import stats
+
+
+# --------------------------------------------------------------------------- #
+#                    Переходы статусов заказа (state machine)                  #
+# --------------------------------------------------------------------------- #
+#
+# Переход — один условный UPDATE: статус меняется, только если заказ сейчас
+# в одном из допустимых исходных статусов. Если два администратора нажали
+# кнопки одновременно, второй UPDATE не найдёт строку и вернёт None, а не
+# перезапишет чужой переход.
+
+# Значение по умолчанию в модели; в UI такой заказ выглядит как новый
+STATUS_PENDING = "pending"
+
+
+class Transition(NamedTuple):
+    target: str
+    sources: Tuple[str, ...]
+
+
+TRANSITIONS = {
+    "process": Transition(STATUS_IN_PROGRESS, (STATUS_NEW, STATUS_PENDING)),
+    "done": Transition(STATUS_DONE, (STATUS_IN_PROGRESS,)),
+    "cancel": Transition(STATUS_CANCELED, (STATUS_NEW, STATUS_PENDING, STATUS_IN_PROGRESS)),
+}
+
+
+def available_actions(status: str) -> List[str]:
+    return [name for name, t in TRANSITIONS.items() if status in t.sources]
+
+
+@dataclass(frozen=True)
+class OrderCard:
+    """Всё, что нужно для карточки заказа и уведомления покупателя."""
+
+    id: int
+    status: str
+    payment_method: str
+    address: str | None
+    comment: str | None
+    created_at: datetime
+    total_price: Decimal
+    user_tg_id: int
+    user_full_name: str | None
+    user_phone: str | None
+    items: Tuple[Tuple[str, int, Decimal], ...] = ()
+
+
+_CARD_COLUMNS = (
+    Order.id,
+    Order.status,
+    Order.payment_method,
+    Order.address,
+    Order.comment,
+    Order.created_at,
+    Order.total_price,
+    User.tg_id,
+    User.full_name,
+    User.phone,
+)
+
+
+async def _items(session: AsyncSession, order_id: int) -> Tuple[Tuple[str, int, Decimal], ...]:
+    # Название берётся из позиции заказа: товар могли удалить или переименовать
+    rows = await session.execute(
+        select(OrderItem.title, OrderItem.qty, OrderItem.item_price)
+        .where(OrderItem.order_id == order_id)
+        .order_by(OrderItem.id)
+    )
+    return tuple(tuple(row) for row in rows)
+
+
+async def load_card(session: AsyncSession, order_id: int) -> OrderCard | None:
+    row = (
+        await session.execute(
+            select(*_CARD_COLUMNS)
+            .join(User, User.id == Order.user_id)
+            .where(Order.id == order_id)
+        )
+    ).first()
+    if row is None:
+        return None
+    return OrderCard(*row, items=await _items(session, order_id))
+
+
+async def _update_postgres(
+    session: AsyncSession, order_id: int, t: Transition
+) -> Tuple[str, tuple] | None:
+    # FOR UPDATE в CTE: старый статус читается из заблокированной актуальной
+    # версии строки, а не из снимка, который мог устареть под конкурентным UPDATE
+    old = (
+        select(Order.id, Order.status)
+        .where(Order.id == order_id, Order.status.in_(t.sources))
+        .with_for_update()
+        .cte("old_order")
+    )
+    row = (
+        await session.execute(
+            update(Order)
+            .where(Order.id == old.c.id, User.id == Order.user_id)
+            .values(status=t.target)
+            .returning(old.c.status, *_CARD_COLUMNS)
+        )
+    ).first()
+    if row is None:
+        return None
+    return row[0], tuple(row[1:])
+
+
+async def _update_generic(
+    session: AsyncSession, order_id: int, t: Transition
+) -> Tuple[str, tuple] | None:
+    # SQLite не даёт ссылаться на FROM-таблицы в RETURNING: читаем строку и
+    # меняем её compare-and-set'ом по прочитанному статусу
+    row = (
+        await session.execute(
+            select(*_CARD_COLUMNS)
+            .join(User, User.id == Order.user_id)
+            .where(Order.id == order_id, Order.status.in_(t.sources))
+        )
+    ).first()
+    if row is None:
+        return None
+    old_status = row.status
+    updated = await session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == old_status)
+        .values(status=t.target)
+        .returning(Order.status)
+    )
+    if updated.first() is None:
+        return None
+    return old_status, (row[0], t.target, *row[2:])
+
+
+async def transition(session: AsyncSession, order_id: int, action: str) -> OrderCard | None:
+    """Выполнить переход в транзакции сессии (commit — за вызывающим).
+
+    None — заказа нет или он уже не в допустимом статусе.
+    """
+    t = TRANSITIONS[action]
+    if session.get_bind().dialect.name == "postgresql":
+        result = await _update_postgres(session, order_id, t)
+    else:
+        result = await _update_generic(session, order_id, t)
+    if result is None:
+        return None
+    old_status, columns = result
+    await stats.order_status_changed(session, old_status, t.target)
+    return OrderCard(*columns, items=await _items(session, order_id))
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, OUTBOX_POLL_INTERVAL
+from db import async_session_factory
+from models import OutboxMessage
+from ratelimit import limiter
+
+
+# --------------------------------------------------------------------------- #
+#                     Outbox: уведомления через таблицу БД                    #
+# --------------------------------------------------------------------------- #
+#
+# Обработчик пишет уведомление в таблицу outbox в той же транзакции, что и
+# заказ, и сразу отвечает пользователю. Доставкой занимается фоновый
+# диспетчер: забирает пачку, отправляет, повторяет с экспоненциальной
+# задержкой. Несколько процессов могут работать одновременно: строки
+# «арендуются» сдвигом next_attempt_at под SKIP LOCKED.
+
+# Сколько строка считается занятой отправителем, пока он не отчитался
+OUTBOX_LEASE_SECONDS = 60
+
+
+def enqueue(
+    session: AsyncSession,
+    chat_id: int,
+    text: str,
+    parse_mode: str | None = None,
+) -> None:
+    session.add(OutboxMessage(chat_id=chat_id, text=text, parse_mode=parse_mode))
+
+
+class OutboxDispatcher:
+    def __init__(
+        self,
+        session_factory,
+        *,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+    ) -> None:
+        self._session_factory = session_factory
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def wake(self) -> None:
+        """Сообщить, что в outbox появились новые сообщения."""
+        self._wakeup.set()
+
+    def start(self, bot: Bot) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self, bot: Bot) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                delivered = await self.deliver_batch(bot)
+            except Exception as e:
+                logging.exception(f"Ошибка доставки outbox: {e}")
+                delivered = 0
+            if delivered < self._batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _claim(self) -> list[OutboxMessage]:
+        now = datetime.now(timezone.utc)
+        async with self._session_factory() as session:
+            messages = (
+                await session.scalars(
+                    select(OutboxMessage)
+                    .where(
+                        OutboxMessage.status == "pending",
+                        OutboxMessage.next_attempt_at <= now,
+                    )
+                    .order_by(OutboxMessage.id)
+                    .limit(self._batch_size)
+                    .with_for_update(skip_locked=True)
+                )
+            ).all()
+            lease_until = now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+            for msg in messages:
+                msg.attempts += 1
+                msg.next_attempt_at = lease_until
+            await session.commit()
+        return list(messages)
+
+    async def deliver_batch(self, bot: Bot) -> int:
+        messages = await self._claim()
+        if not messages:
+            return 0
+        results = await asyncio.gather(*(self._send(bot, msg) for msg in messages))
+
+        now = datetime.now(timezone.utc)
+        async with self._session_factory() as session:
+            for msg, (status, retry_in, error) in zip(messages, results):
+                values: dict = {"status": status, "last_error": error}
+                if status == "sent":
+                    values["sent_at"] = now
+                elif status == "pending":
+                    values["next_attempt_at"] = now + timedelta(seconds=retry_in)
+                    values["attempts"] = msg.attempts
+                await session.execute(
+                    update(OutboxMessage).where(OutboxMessage.id == msg.id).values(**values)
+                )
+            await session.commit()
+        return len(messages)
+
+    async def _send(self, bot: Bot, msg: OutboxMessage) -> tuple[str, float, str | None]:
+        kwargs = {"parse_mode": msg.parse_mode} if msg.parse_mode else {}
+        await limiter.acquire(msg.chat_id)
+        try:
+            await bot.send_message(msg.chat_id, msg.text, **kwargs)
+            return "sent", 0, None
+        except TelegramRetryAfter as e:
+            # Флуд-контроль не считаем неудачной попыткой
+            limiter.pause(e.retry_after)
+            msg.attempts -= 1
+            return "pending", e.retry_after, str(e)[:255]
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            logging.info(f"Outbox: сообщение {msg.id} для {msg.chat_id} не доставлено: {e}")
+            return "failed", 0, str(e)[:255]
+        except Exception as e:
+            if msg.attempts >= self._max_attempts:
+                logging.warning(f"Outbox: сообщение {msg.id} не доставлено за {msg.attempts} попыток: {e}")
+                return "failed", 0, str(e)[:255]
+            return "pending", min(2 ** msg.attempts, 300), str(e)[:255]
+
+
+outbox = OutboxDispatcher(async_session_factory)
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import DB_TAG_SQL, N_PLUS_ONE_MIN, SLOW_QUERY_MS
+
+
+# --------------------------------------------------------------------------- #
+#                   Запросы к БД в разрезе обработчиков                       #
+# --------------------------------------------------------------------------- #
+#
+# Middleware открывает QueryScope на время обработчика; события движка
+# приписывают к нему каждый оператор. Отсюда три вещи:
+#   * лог медленных запросов с именем обработчика (порог SLOW_QUERY_MS);
+#   * предупреждение о N+1 — один и тот же оператор N_PLUS_ONE_MIN и больше
+#     раз за обработчик;
+#   * бюджеты запросов в bench/query_budget.py (capture()).
+# С DB_TAG_SQL=1 имя обработчика дописывается в SQL комментарием — его видно
+# в pg_stat_activity и логах PostgreSQL. По умолчанию выключено: у asyncpg
+# каждый вариант текста — отдельный prepared statement.
+
+logger = logging.getLogger("querylog")
+
+_SPACES = re.compile(r"\s+")
+
+
+class QueryScope:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter[str] = Counter()
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.statements[_SPACES.sub(" ", statement).strip()] += 1
+
+    def repeated(self, threshold: int = N_PLUS_ONE_MIN) -> List[tuple[str, int]]:
+        return [(sql, n) for sql, n in self.statements.most_common() if n >= threshold]
+
+
+_current: ContextVar[QueryScope | None] = ContextVar("query_scope", default=None)
+_captures: List[List[QueryScope]] = []
+
+
+def current_handler() -> str:
+    scope = _current.get()
+    return scope.name if scope is not None else "-"
+
+
+@contextmanager
+def scope(name: str) -> Iterator[QueryScope]:
+    current = QueryScope(name)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+        for sql, n in current.repeated():
+            logger.warning(f"Возможный N+1 в {name}: {n} одинаковых запросов: {sql[:300]}")
+        for sink in _captures:
+            sink.append(current)
+
+
+@contextmanager
+def capture() -> Iterator[List[QueryScope]]:
+    """Собрать все завершившиеся за время блока QueryScope (для бюджетов)."""
+    sink: List[QueryScope] = []
+    _captures.append(sink)
+    try:
+        yield sink
+    finally:
+        _captures.remove(sink)
+
+
+def instrument(engine: Engine) -> None:
+    """Подписаться на события движка (sync_engine у async-движка)."""
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+        if DB_TAG_SQL:
+            scope = _current.get()
+            if scope is not None:
+                statement = f"{statement} /* handler={scope.name} */"
+        return statement, parameters
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany) -> None:
+        seconds = time.perf_counter() - conn.info["query_start"].pop()
+        scope = _current.get()
+        if scope is not None:
+            scope.record(statement, seconds)
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            logger.warning(
+                f"Медленный запрос {seconds * 1000:.0f} мс в {current_handler()}: "
+                f"{_SPACES.sub(' ', statement)[:500]}"
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def _on_error(context) -> None:
+        # after_cursor_execute не вызывается — снимаем отметку начала
+        stack = context.connection.info.get("query_start") if context.connection else None
+        if stack:
+            stack.pop()
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+
+from config import TG_GLOBAL_RATE, TG_PER_CHAT_INTERVAL
+
+
+# --------------------------------------------------------------------------- #
+#                     Ограничение частоты запросов к Telegram                 #
+# --------------------------------------------------------------------------- #
+#
+# Telegram позволяет боту ~30 сообщений в секунду суммарно и ~1 сообщение в
+# секунду в один чат. Рассылки и outbox отправляют через общий лимитер,
+# чтобы вместе не упереться в 429.
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self._rate = rate
+        self._capacity = capacity if capacity is not None else rate
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def pause(self, seconds: float) -> None:
+        """Остановить выдачу токенов (например, после RetryAfter)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self) -> None:
+        # Блокировка держит очередь ожидающих в порядке прихода
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class TelegramRateLimiter:
+    def __init__(
+        self,
+        global_rate: float = TG_GLOBAL_RATE,
+        per_chat_interval: float = TG_PER_CHAT_INTERVAL,
+        max_chats: int = 100000,
+    ) -> None:
+        self.bucket = TokenBucket(global_rate)
+        self._per_chat_interval = per_chat_interval
+        self._max_chats = max_chats
+        # chat_id -> момент, раньше которого в чат писать нельзя
+        self._next_allowed: OrderedDict[int, float] = OrderedDict()
+
+    async def acquire(self, chat_id: int) -> None:
+        now = time.monotonic()
+        allowed_at = self._next_allowed.get(chat_id, 0.0)
+        self._next_allowed[chat_id] = max(now, allowed_at) + self._per_chat_interval
+        self._next_allowed.move_to_end(chat_id)
+        while len(self._next_allowed) > self._max_chats:
+            self._next_allowed.popitem(last=False)
+        if allowed_at > now:
+            await asyncio.sleep(allowed_at - now)
+        await self.bucket.acquire()
+
+    def pause(self, seconds: float) -> None:
+        self.bucket.pause(seconds)
+
+
+limiter = TelegramRateLimiter()
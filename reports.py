@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import json
+from decimal import Decimal
+from io import BytesIO
+from typing import Any, Dict
+
+
+# --------------------------------------------------------------------------- #
+#                  Отчёты: чистые функции для пула процессов                  #
+# --------------------------------------------------------------------------- #
+#
+# Выполняются в отдельном процессе (jobs.runner.run_cpu), поэтому принимают
+# и возвращают только простые данные и не трогают ни БД, ни бота. Тяжёлые
+# библиотеки импортируются внутри функций — в процессе бота они не нужны.
+
+STATS_LABELS = [
+    ("users_count", "Всего пользователей"),
+    ("orders_count", "Всего заказов"),
+    ("revenue", "Сумма заказов"),
+    ("new_users_today", "Новых пользователей сегодня"),
+    ("in_progress_orders", "Заказы в процессе"),
+    ("completed_orders", "Выполненные заказы"),
+    ("canceled_orders", "Отмененные заказы"),
+    ("average_order_value", "Средний чек"),
+]
+
+
+def serialize_decimal(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+
+def render_stats_xlsx(summary: Dict[str, Any]) -> bytes:
+    import pandas as pd
+
+    values = [summary[key] for key, _ in STATS_LABELS]
+    values[-1] = f"{summary['average_order_value']:.2f} ₽"
+    df = pd.DataFrame({
+        "Показатель": [label for _, label in STATS_LABELS],
+        "Значение": values,
+    })
+
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, sheet_name="Статистика")
+    return buffer.getvalue()
+
+
+def render_stats_json(summary: Dict[str, Any]) -> bytes:
+    json_data = {"statistics": {key: summary[key] for key, _ in STATS_LABELS}}
+    return json.dumps(
+        json_data, default=serialize_decimal, ensure_ascii=False, indent=4
+    ).encode("utf-8")
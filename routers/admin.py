@@ -4,22 +4,12 @@ from __future__ import annotations
 from sqlalchemy.orm import selectinload
 from decimal import Decimal
 
-import pandas as pd
-from io import BytesIO
-import os
-import tempfile
-import json
-
-from PIL import Image
-import aiohttp
-
-import pytz
-
+from dataclasses import replace
 from datetime import datetime, timedelta
 
-from aiogram import Router, F
+from aiogram import F
 from aiogram import types
-from aiogram.types import FSInputFile
+from aiogram.types import BufferedInputFile
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, Filter
 from aiogram.fsm.context import FSMContext
@@ -34,22 +24,47 @@ from aiogram.types import (
     Message,
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from sqlalchemy import func, select
-
-from models import Category, Order, Product, User, OrderItem
-from main import admin_id, async_session_factory, BOT_TOKEN
+from sqlalchemy import delete, func, select, update
+
+from models import Broadcast, Category, Product
+from config import admin_id
+from db import async_session_factory, engine
+import db_pool
+from middlewares import db_session
+from routing import IndexedRouter
+from cache import catalog
+from outbox import enqueue, outbox
+from broadcast import broadcasts
+import stats
+from export import WRITERS, send_orders_export
+from jobs import STATUS_TEXT, JobContext, runner
+from reports import render_stats_xlsx, render_stats_json
+from order_status import OrderCard, available_actions, load_card, transition
+from order_browser import (
+    LOCAL_TZ,
+    NEWER,
+    OLDER,
+    STATUS_LABELS,
+    OrderListState,
+    fetch_page,
+    parse_period,
+    with_period,
+)
 
 
-from keyboard import get_main_reply_keyboard
+from keyboard import disabled_products_keyboard, get_main_reply_keyboard
 # --------------------------------------------------------------------------- #
 #                         Фильтр допуска только админов                       #
 # --------------------------------------------------------------------------- #
 
 
+_ADMIN_IDS = frozenset(admin_id)
+
+
 class AdminFilter(Filter):
     async def __call__(self, entity: Message | CallbackQuery) -> bool:  # noqa: D401
         message = entity if isinstance(entity, Message) else entity.message
-        return message.chat and message.chat.id in admin_id
+        return message.chat and message.chat.id in _ADMIN_IDS
 
 
 # --------------------------------------------------------------------------- #
@@ -82,11 +97,21 @@ class EditCategorySG(StatesGroup):
     waiting_for_title = State()
 
 
+class OrderFilterSG(StatesGroup):
+    waiting_for_period = State()
+
+
+class BroadcastSG(StatesGroup):
+    waiting_for_audience = State()
+    waiting_for_text = State()
+    confirmation = State()
+
+
 # --------------------------------------------------------------------------- #
 #                                  Роутер                                     #
 # --------------------------------------------------------------------------- #
 
-router = Router()
+router = IndexedRouter()
 router.message.filter(AdminFilter())
 router.callback_query.filter(AdminFilter())
 
@@ -119,7 +144,7 @@ async def add_category_save(message: Message, state: FSMContext) -> None:
         await message.answer("Название не может быть пустым, попробуйте ещё раз.")
         return
 
-    async with async_session_factory() as session:
+    async with db_session() as session:
         exists = await session.scalar(
             select(func.count()).select_from(Category).where(Category.title == title)
         )
@@ -129,6 +154,7 @@ async def add_category_save(message: Message, state: FSMContext) -> None:
             return
         session.add(Category(title=title))
         await session.commit()
+    catalog.invalidate()
     await message.answer(f"✅ Категория «{title}» добавлена.")
     await state.clear()
 
@@ -140,7 +166,7 @@ async def add_category_save(message: Message, state: FSMContext) -> None:
 @router.message(Command("add_product"))
 @router.message(F.text == "➕ Добавить товар")
 async def add_product_start(message: Message, state: FSMContext) -> None:
-    async with async_session_factory() as session:
+    async with db_session() as session:
         categories = (await session.scalars(select(Category))).all()
         if not categories:
             await message.answer(
@@ -174,7 +200,7 @@ async def add_product_set_category(
 ) -> None:
     await call.answer()
     category_id = int(call.data.split("_")[1])
-    async with async_session_factory() as session:
+    async with db_session() as session:
         category = await session.get(Category, category_id)
         category_name = category.title if category else "Неизвестная категория"
     await state.update_data(category_id=category_id)
@@ -250,7 +276,7 @@ async def add_product_cancel(call: CallbackQuery, state: FSMContext) -> None:
 async def add_product_save(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     data = await state.get_data()
-    async with async_session_factory() as session:
+    async with db_session() as session:
         product = Product(
             category_id=data["category_id"],
             title=data["title"],
@@ -260,6 +286,7 @@ async def add_product_save(call: CallbackQuery, state: FSMContext) -> None:
         )
         session.add(product)
         await session.commit()
+    catalog.invalidate()
     await call.message.edit_text("✅ Товар сохранён.")
     await state.clear()
 
@@ -271,7 +298,7 @@ async def add_product_save(call: CallbackQuery, state: FSMContext) -> None:
 @router.message(Command("products"))
 @router.message(F.text == "🛍️ Продукты")
 async def list_products(message: Message) -> None:
-    async with async_session_factory() as session:
+    async with db_session() as session:
         result = await session.execute(
             select(Product)
             .where(Product.is_active.is_(True))
@@ -306,7 +333,7 @@ async def edit_product_start(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     pid = int(call.data.split(":", 1)[1])
 
-    async with async_session_factory() as session:
+    async with db_session() as session:
         product = await session.get(Product, pid)
         if not product:
             await call.message.answer("Товар не найден.")
@@ -420,7 +447,7 @@ async def edit_product_save(call: CallbackQuery, state: FSMContext) -> None:
     data = await state.get_data()
     pid = data["pid"]
 
-    async with async_session_factory() as session:
+    async with db_session() as session:
         product = await session.get(Product, pid)
         if not product:
             await call.message.answer("Товар не найден.")
@@ -432,6 +459,7 @@ async def edit_product_save(call: CallbackQuery, state: FSMContext) -> None:
         product.price = data["price"]
         product.photo_file_id = data["photo_file_id"]
         await session.commit()
+    catalog.invalidate()
     await call.message.edit_text("✅ Изменения сохранены.")
     await state.clear()
 
@@ -445,7 +473,7 @@ async def edit_category_start(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()
     cid = int(call.data.split(":", 1)[1])
     
-    async with async_session_factory() as session:
+    async with db_session() as session:
         cat = await session.get(Category, cid)
         if not cat:
             await call.message.answer("Категория не найдена.")
@@ -471,7 +499,7 @@ async def edit_category_title(message: Message, state: FSMContext) -> None:
     data = await state.get_data()
     cid = data["cid"]
 
-    async with async_session_factory() as session:
+    async with db_session() as session:
         cat = await session.get(Category, cid)
         if not cat:
             await message.answer("Категория не найдена.")
@@ -479,6 +507,7 @@ async def edit_category_title(message: Message, state: FSMContext) -> None:
             return
         cat.title = text
         await session.commit()
+    catalog.invalidate()
 
     await message.answer("✅ Название категории обновлено.")
     await state.clear()
@@ -497,7 +526,7 @@ async def delete_product(call: CallbackQuery) -> None:
 
     pid = int(parts[1])
 
-    async with async_session_factory() as session:
+    async with db_session() as session:
         product = await session.get(Product, pid)
         if not product:
             await call.message.answer("Товар не найден.")
@@ -513,6 +542,7 @@ async def delete_product(call: CallbackQuery) -> None:
 
         product.is_active = False
         await session.commit()
+    catalog.invalidate()
 
     text_preview = (
         "<b>Товар отключён:</b>\n\n"
@@ -543,34 +573,15 @@ async def delete_product(call: CallbackQuery) -> None:
 
 @router.message(F.text == "➕ Активировать товар")
 async def show_disabled_products(message: Message, state: FSMContext) -> None:
-    async with async_session_factory() as session:
-        result = await session.execute(select(Product).where(Product.is_active == False))
-        disabled_products = result.scalars().all()
+    markup = await disabled_products_keyboard()
 
-    if not disabled_products:
+    if markup is None:
         await message.answer("Все товары активны. Нет отключённых товаров.")
         return
 
-    builder = InlineKeyboardBuilder()
-    buttons = [
-        InlineKeyboardButton(
-            text=product.title,
-            callback_data=f"showdetails:{product.id}"
-        )
-        for product in disabled_products
-    ]
-    for i in range(0, len(buttons), 2):
-        builder.row(*buttons[i:i+2])
-    builder.row(
-        InlineKeyboardButton(
-            text="⬅️ Назад",
-            callback_data="back_to_main_menu"
-        )
-    )
-
     sent_msg = await message.answer(
         "📦 Выберите товар, чтобы посмотреть детали и включить его:",
-        reply_markup=builder.as_markup(resize_keyboard=True),
+        reply_markup=markup,
     )
     await state.update_data(disabled_products_list_message_id=sent_msg.message_id)
 
@@ -593,7 +604,7 @@ async def show_product_details(call: CallbackQuery, state: FSMContext) -> None:
 
     pid = int(parts[1])
 
-    async with async_session_factory() as session:
+    async with db_session() as session:
         product = await session.get(Product, pid)
         if not product:
             await call.message.answer("Товар не найден.")
@@ -656,7 +667,7 @@ async def select_category(call: CallbackQuery) -> None:
     pid = int(parts[1])
     cid = int(parts[2])
 
-    async with async_session_factory() as session:
+    async with db_session() as session:
         product = await session.get(Product, pid)
         if not product:
             await call.message.answer("Товар не найден.")
@@ -665,6 +676,7 @@ async def select_category(call: CallbackQuery) -> None:
         product.is_active = True
         product.category_id = cid 
         await session.commit()
+    catalog.invalidate()
 
     await call.message.answer(f"✅ Товар <b>{product.title}</b> (ID {pid}) успешно активирован и добавлен в категорию ID {cid}.",
         parse_mode="HTML")
@@ -696,291 +708,269 @@ async def delete_category(call: CallbackQuery) -> None:
     
     cid = int(parts[1])
 
-    async with async_session_factory() as session:
-        cat = await session.get(Category, cid)
-        if not cat:
+    async with db_session() as session:
+        # Товары отвязываем одним UPDATE, не загружая их в память; ORM-каскад
+        # category.products здесь не нужен — после UPDATE у категории нет товаров
+        await session.execute(
+            update(Product)
+            .where(Product.category_id == cid)
+            .values(is_active=False, category_id=None)
+        )
+        deleted = await session.scalar(
+            delete(Category).where(Category.id == cid).returning(Category.id)
+        )
+        if deleted is None:
+            await session.rollback()
             await call.message.answer("Категория не найдена.")
             return
-        products_result = await session.execute(
-            select(Product).where(Product.category_id == cid)
-        )
-        products = products_result.scalars().all()
-        for product in products:
-            product.is_active = False
-            product.category_id = None 
-        await session.delete(cat)
         await session.commit()
+    catalog.invalidate()
 
     await call.message.answer(f"✅ Категория ID {cid} удалена, товары деактивированы и отвязаны.")
     await call.message.delete_reply_markup()
 
 
-@router.message(Command("orders"))
-@router.message(F.text == "🛒 Заказы")
-async def list_orders(message: Message) -> None:
-    async with async_session_factory() as session:
-        orders = (
-            await session.execute(
-                select(Order)
-                .order_by(Order.id.desc())
-                .limit(20)
-            )
-        ).scalars().all()
-
-    if not orders:
-        await message.answer("Заказов пока нет.")
-        return
+async def _orders_page(state: OrderListState) -> tuple[str, InlineKeyboardMarkup]:
+    async with db_session() as session:
+        page = await fetch_page(session, state)
 
+    text_lines = [
+        f"<b>Заказы</b> · {STATUS_LABELS[state.status]} · {state.period_label()}\n"
+    ]
     kb = InlineKeyboardBuilder()
-    text_lines = []
-    for order in orders:
+    for order in page.rows:
+        created = order.created_at.astimezone(LOCAL_TZ).strftime("%d.%m %H:%M")
         text_lines.append(
-            f"#{order.id} — {order.total_price} ₽ — {order.payment_method}"
+            f"#{order.id} — {created} — {order.total_price} ₽ — {order.payment_method}"
         )
-        kb.add(
+        kb.row(
             InlineKeyboardButton(
                 text=f"#{order.id} — {order.status}",
                 callback_data=f"order:{order.id}",
             )
         )
+    if not page.rows:
+        text_lines.append("Заказов нет.")
+
+    nav = []
+    if page.has_newer:
+        newer = replace(state, direction=NEWER, cursor=page.rows[0].id if page.rows else state.cursor)
+        nav.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=newer.pack()))
+    if page.has_older and page.rows:
+        older = replace(state, direction=OLDER, cursor=page.rows[-1].id)
+        nav.append(InlineKeyboardButton(text="Старее ➡️", callback_data=older.pack()))
+    if nav:
+        kb.row(*nav)
+
+    filters = InlineKeyboardBuilder()
+    for code, label in STATUS_LABELS.items():
+        filters.button(
+            text=("• " if code == state.status else "") + label,
+            callback_data=replace(state, status=code).first_page().pack(),
+        )
+    for preset, label in ORDER_PERIODS.items():
+        filters.button(text=label, callback_data=f"olp:{state.status}:{preset}")
+    filters.adjust(3, 2, 3, 2)
+    kb.attach(filters)
+    return "\n".join(text_lines), kb.as_markup()
 
-    kb.adjust(1)
-    await message.answer(
-        "<b>Последние заказы:</b>\n" + "\n".join(text_lines),
-        reply_markup=kb.as_markup(),
-        parse_mode="HTML",
-    )
-
-
-async def send_orders_list(chat_id: int, bot) -> None:
-    async with async_session_factory() as session:
-        orders = (
-            await session.execute(
-                select(Order)
-                .order_by(Order.id.desc())
-                .limit(20)
-            )
-        ).scalars().all()
 
-    if not orders:
-        await bot.send_message(chat_id, "Заказов пока нет.")
-        return
+ORDER_PERIODS = {"a": "Всё время", "t": "Сегодня", "w": "7 дней", "m": "30 дней", "r": "📅 Период…"}
 
-    kb = InlineKeyboardBuilder()
-    text_lines = []
-    for order in orders:
-        text_lines.append(
-            f"#{order.id} — {order.total_price} ₽ — {order.payment_method}"
-        )
-        kb.add(
-            InlineKeyboardButton(
-                text=f"#{order.id} — {order.status}",
-                callback_data=f"order:{order.id}",
-            )
-        )
 
-    kb.adjust(1)
-    await bot.send_message(
-        chat_id,
-        "<b>Последние заказы:</b>\n" + "\n".join(text_lines),
-        reply_markup=kb.as_markup(),
-        parse_mode="HTML",
-    )
+@router.message(Command("orders"))
+@router.message(F.text == "🛒 Заказы")
+async def list_orders(message: Message) -> None:
+    text, markup = await _orders_page(OrderListState())
+    await message.answer(text, reply_markup=markup, parse_mode="HTML")
 
 
-@router.callback_query(F.data == "back_to_orders")
-async def back_to_orders(call: CallbackQuery) -> None:
+@router.callback_query(F.data.startswith("ol:"))
+async def orders_page(call: CallbackQuery) -> None:
+    try:
+        state = OrderListState.unpack(call.data)
+    except ValueError:
+        await call.answer("Устаревшая кнопка.", show_alert=True)
+        return
     await call.answer()
-    
-    if call.message:
-        await call.message.delete()
-    await send_orders_list(call.message.chat.id, call.bot)
+    text, markup = await _orders_page(state)
+    try:
+        await call.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+    except TelegramBadRequest:
+        # message is not modified — нажали на уже выбранный фильтр
+        pass
 
 
+@router.callback_query(F.data.startswith("olp:"))
+async def orders_period(call: CallbackQuery, state: FSMContext) -> None:
+    _, status, preset = call.data.split(":")
+    if status not in STATUS_LABELS or preset not in ORDER_PERIODS:
+        await call.answer("Устаревшая кнопка.", show_alert=True)
+        return
+    if preset == "r":
+        await call.answer()
+        await state.set_state(OrderFilterSG.waiting_for_period)
+        await state.update_data(order_status=status)
+        await call.message.answer(
+            "Введите дату или период в формате <code>01.09.2025</code> "
+            "или <code>01.09.2025-30.09.2025</code>:",
+            parse_mode="HTML",
+        )
+        return
 
-@router.callback_query(F.data.startswith("order:"))
-async def order_details(call: CallbackQuery) -> None:
     await call.answer()
-    order_id = int(call.data.split(":", 1)[1])
+    today = datetime.now(LOCAL_TZ).date()
+    start = {"a": None, "t": today, "w": today - timedelta(days=6), "m": today - timedelta(days=29)}[preset]
+    end = None if preset == "a" else today
+    async with db_session() as session:
+        list_state = await with_period(session, OrderListState(status=status), start, end)
+    text, markup = await _orders_page(list_state)
+    try:
+        await call.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+    except TelegramBadRequest:
+        pass
 
-    async with async_session_factory() as session:
-        order: Order | None = await session.get(Order, order_id)
-        if not order:
-            await call.message.answer("Заказ не найден.")
-            return
 
-        user: User = await session.get(User, order.user_id)
+@router.message(OrderFilterSG.waiting_for_period, F.text)
+async def orders_custom_period(message: Message, state: FSMContext) -> None:
+    try:
+        start, end = parse_period(message.text)
+    except ValueError:
+        await message.answer("Не получилось разобрать дату, пример: 01.09.2025-30.09.2025")
+        return
+    status = (await state.get_data()).get("order_status", "a")
+    await state.clear()
+    async with db_session() as session:
+        list_state = await with_period(session, OrderListState(status=status), start, end)
+    text, markup = await _orders_page(list_state)
+    await message.answer(text, reply_markup=markup, parse_mode="HTML")
 
-        items = (
-            await session.execute(
-                select(OrderItem.qty, Product.title, OrderItem.item_price)
-                .join(Product, Product.id == OrderItem.product_id)
-                .where(OrderItem.order_id == order.id)
-            )
-        ).all()
 
+@router.callback_query(F.data == "back_to_orders")
+async def back_to_orders(call: CallbackQuery) -> None:
+    await call.answer()
+    text, markup = await _orders_page(OrderListState())
+    await call.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+
+
+def render_order_card(card: OrderCard) -> tuple[str, InlineKeyboardMarkup]:
     item_lines = [
-        f"{title} × {qty} = {price * qty} ₽" for qty, title, price in items
+        f"{title} × {qty} = {price * qty} ₽" for title, qty, price in card.items
     ]
-    local_tz = pytz.timezone('Europe/Moscow') 
-    created_at_local = order.created_at.astimezone(local_tz) 
-        
+    created_at_local = card.created_at.astimezone(LOCAL_TZ)
+
     text = (
-        f"🧾 <b>Заказ #{order.id}</b>\n"
-        f"💳 Способ оплаты: {order.payment_method}\n"
-        f"⚙️ Статус: {order.status}\n"
-        f"👤 Пользователь: {user.full_name or user.tg_id}\n"
-        f"📞 Телефон: {user.phone or 'не указан'}\n"
-        f"🏠 Адрес: {order.address or 'не указан'}\n"
-        f"📝 Комментарий: {order.comment or 'не указан'}\n"
+        f"🧾 <b>Заказ #{card.id}</b>\n"
+        f"💳 Способ оплаты: {card.payment_method}\n"
+        f"⚙️ Статус: {card.status}\n"
+        f"👤 Пользователь: {card.user_full_name or card.user_tg_id}\n"
+        f"📞 Телефон: {card.user_phone or 'не указан'}\n"
+        f"🏠 Адрес: {card.address or 'не указан'}\n"
+        f"📝 Комментарий: {card.comment or 'не указан'}\n"
         f"📅 Дата: {created_at_local.strftime('%d.%m.%Y %H:%M')}\n"
-        f"💰 Сумма: {order.total_price} ₽\n\n"
+        f"💰 Сумма: {card.total_price} ₽\n\n"
         "📦 <b>Состав:</b>\n" + "\n".join(item_lines)
     )
-    kb = InlineKeyboardBuilder()
 
-    if order.status == "выполнен" or order.status == "отменен":
-        kb.add(
-            InlineKeyboardButton(
-                text="⬅️ Назад",
-                callback_data="back_to_orders",
-            )
-        )
-        await call.message.edit_text(
-            text,
-            reply_markup=kb.as_markup(),
-            parse_mode="HTML",
-        )
-    else:
-        if order.status == "в процессе":
-            kb.row(
-                InlineKeyboardButton(
-                    text="✅ Выполнен",
-                    callback_data=f"order_done:{order.id}",
-                ),
-                InlineKeyboardButton(
-                    text="❌ Отмена",
-                    callback_data=f"order_cancel:{order.id}",
-                )
-            )
-        else:
-            kb.add(
-                InlineKeyboardButton(
-                    text="🕒 В процессе",
-                    callback_data=f"order_process:{order.id}",
-                ),
-                InlineKeyboardButton(
-                    text="❌ Отмена",
-                    callback_data=f"order_cancel:{order.id}",
-                )
-            )
-        kb.add(
-            InlineKeyboardButton(
-                text="⬅️ Назад",
-                callback_data="back_to_orders",
-            )
-        )
+    kb = InlineKeyboardBuilder()
+    actions = [
+        InlineKeyboardButton(text=ORDER_ACTION_BUTTONS[action], callback_data=f"order_{action}:{card.id}")
+        for action in available_actions(card.status)
+    ]
+    if actions:
+        kb.row(*actions)
+    kb.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_orders"))
+    return text, kb.as_markup()
+
+
+ORDER_ACTION_BUTTONS = {
+    "process": "🕒 В процессе",
+    "done": "✅ Выполнен",
+    "cancel": "❌ Отмена",
+}
+
+# Уведомление покупателю и подтверждение администратору по каждому переходу
+ORDER_ACTION_MESSAGES = {
+    "process": (
+        "Ваш заказ #<b>{id}</b> уже готовится 🍽️\n",
+        None,
+    ),
+    "done": (
+        "Ваш заказ #{id} был успешно доставлен! 🎉\nСпасибо за покупку!",
+        "Вы отметили заказ #{id} как выполненный. ✅",
+    ),
+    "cancel": (
+        "Ваш заказ #<b>{id}</b> был отменен ❌\n Если у вас есть вопросы, обратитесь в нашу поддержку!",
+        "Вы отметили заказ #{id} как отмененный ❌",
+    ),
+}
+
+
+async def _show_order_card(call: CallbackQuery, card: OrderCard) -> None:
+    text, markup = render_order_card(card)
+    try:
+        await call.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+    except TelegramBadRequest:
+        # message is not modified
+        pass
 
-        await call.message.edit_text(
-            text,
-            reply_markup=kb.as_markup(),
-            parse_mode="HTML",
-        )
 
-@router.callback_query(F.data.startswith("order_process:"))
-async def process_order(call: CallbackQuery) -> None:
+@router.callback_query(F.data.startswith("order:"))
+async def order_details(call: CallbackQuery) -> None:
     await call.answer()
     order_id = int(call.data.split(":", 1)[1])
 
-    async with async_session_factory() as session:
-        order: Order | None = await session.get(Order, order_id)
-        if not order:
-            await call.message.answer("Заказ не найден.")
-            return
-
-        order.status = "в процессе"
-        await session.commit()
-        user: User = await session.get(User, order.user_id)
-        await call.bot.send_message(
-            chat_id=user.tg_id,
-            text=f"Ваш заказ #<b>{order.id}</b> уже готовится 🍽️\n",
-            parse_mode="HTML"
-        )
-    await order_details(call)
+    async with db_session() as session:
+        card = await load_card(session, order_id)
+    if card is None:
+        await call.message.answer("Заказ не найден.")
+        return
+    await _show_order_card(call, card)
 
 
-@router.callback_query(F.data.startswith("order_done:"))
-async def complete_order(call: CallbackQuery) -> None:
-    await call.answer()
-    order_id = int(call.data.split(":", 1)[1])
-
-    async with async_session_factory() as session:
-        order: Order | None = await session.get(Order, order_id)
-        if not order:
-            await call.message.answer("Заказ не найден.")
-            return
-        order.status = "выполнен"
-        await session.commit()
-        user: User = await session.get(User, order.user_id)
-        await call.bot.send_message(
-            chat_id=user.tg_id,
-            text=f"Ваш заказ #{order.id} был успешно доставлен! 🎉\n"
-                 f"Спасибо за покупку!",
-            parse_mode="HTML"
-        )
-    await call.message.answer(
-            f"Вы отметили заказ #{order.id} как выполненный. ✅"
-        )
-    await order_details(call)
+@router.callback_query(F.data.regexp(r"^order_(process|done|cancel):\d+$"))
+async def change_order_status(call: CallbackQuery) -> None:
+    prefix, order_id = call.data.split(":", 1)
+    action, order_id = prefix.removeprefix("order_"), int(order_id)
+    customer_text, admin_text = ORDER_ACTION_MESSAGES[action]
 
+    async with db_session() as session:
+        card = await transition(session, order_id, action)
+        changed = card is not None
+        if changed:
+            enqueue(session, card.user_tg_id, customer_text.format(id=card.id), parse_mode="HTML")
+            await session.commit()
+        else:
+            # Заказа нет или его статус уже сменил другой администратор
+            card = await load_card(session, order_id)
 
-@router.callback_query(F.data.startswith("order_cancel:"))
-async def cancel_order(call: CallbackQuery) -> None:
-    await call.answer()
-    order_id = int(call.data.split(":", 1)[1])
+    if card is None:
+        await call.answer("Заказ не найден.", show_alert=True)
+        return
+    if changed:
+        outbox.wake()
+        await call.answer()
+        if admin_text:
+            await call.message.answer(admin_text.format(id=card.id))
+    else:
+        await call.answer(f"Статус заказа уже изменён: {card.status}", show_alert=True)
+    await _show_order_card(call, card)
 
-    async with async_session_factory() as session:
-        order: Order | None = await session.get(Order, order_id)
-        if not order:
-            await call.message.answer("Заказ не найден.")
-            return
-        order.status = "отменен"
-        await session.commit()
-        user: User = await session.get(User, order.user_id)
-        await call.bot.send_message(
-            chat_id=user.tg_id,
-            text=f"Ваш заказ #<b>{order.id}</b> был отменен ❌\n Если у вас есть вопросы, обратитесь в нашу поддержку!",
-            parse_mode="HTML"
-        )
-    await call.message.answer(
-            f"Вы отметили заказ #{order.id} как отмененный ❌"
-        )
-    await order_details(call)
 
 @router.message(Command("stats"))
 @router.message(F.text == "📊 Статистика")
 async def bot_stats(message: Message) -> None:
-    today = datetime.now().date()
-
-    async with async_session_factory() as session:     
-        users_cnt = await session.scalar(select(func.count()).select_from(User).where(User.id.isnot(None)))
-        orders_cnt = await session.scalar(select(func.count()).select_from(Order))
-        revenue = await session.scalar(
-            select(func.coalesce(func.sum(Order.total_price), 0))
-        )
-        new_users_cnt = await session.scalar(
-            select(func.count()).select_from(User).where(User.created_at >= today)
-        )
-        in_progress_cnt = await session.scalar(
-            select(func.count()).select_from(Order).where(Order.status == "в процессе")
-        )
-        completed_cnt = await session.scalar(
-            select(func.count()).select_from(Order).where(Order.status == "выполнен")
-        )
-        canceled_cnt = await session.scalar(
-            select(func.count()).select_from(Order).where(Order.status == "отменен")
-        )
-        average_order_value = revenue / orders_cnt if orders_cnt > 0 else 0
+    async with db_session() as session:
+        summary = await stats.summary(session)
+
+    users_cnt = summary["users_count"]
+    orders_cnt = summary["orders_count"]
+    revenue = summary["revenue"]
+    new_users_cnt = summary["new_users_today"]
+    in_progress_cnt = summary["in_progress_orders"]
+    completed_cnt = summary["completed_orders"]
+    canceled_cnt = summary["canceled_orders"]
+    average_order_value = summary["average_order_value"]
 
     text = (
         "<b>Статистика бота</b>\n\n"
@@ -997,100 +987,233 @@ async def bot_stats(message: Message) -> None:
     
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="📥 Выгрузить в Excel и JSON", callback_data="export_stats_data"))
+    builder.add(
+        InlineKeyboardButton(text="📦 Заказы CSV", callback_data="export_orders:csv"),
+        InlineKeyboardButton(text="📦 Заказы XLSX", callback_data="export_orders:xlsx"),
+        InlineKeyboardButton(text="📦 Заказы JSONL", callback_data="export_orders:jsonl"),
+    )
+    builder.adjust(1, 3)
 
     await message.answer(text, reply_markup=builder.as_markup(), parse_mode="HTML")
 
 
-def serialize_decimal(obj):
-    if isinstance(obj, Decimal):
-        return float(obj)
-    raise TypeError(f"Type {type(obj)} not serializable")
+@router.callback_query(F.data.startswith("export_orders:"))
+async def export_orders(call: CallbackQuery) -> None:
+    fmt = call.data.split(":", 1)[1]
+    if fmt not in WRITERS:
+        await call.answer("Неизвестный формат.", show_alert=True)
+        return
 
-@router.callback_query(F.data == "export_stats_data")
-async def export_stats_data(call: CallbackQuery) -> None:
-    await call.answer() 
-    
-    today = datetime.now().date()
+    async def job(ctx: JobContext) -> str:
+        async def progress(exported: int) -> None:
+            await ctx.progress(f"Прочитано заказов: {exported}")
 
-    async with async_session_factory() as session:     
-        users_cnt = await session.scalar(select(func.count()).select_from(User).where(User.id.isnot(None)))
-        orders_cnt = await session.scalar(select(func.count()).select_from(Order))
-        revenue = await session.scalar(
-            select(func.coalesce(func.sum(Order.total_price), 0))
-        )
-        new_users_cnt = await session.scalar(
-            select(func.count()).select_from(User).where(User.created_at >= today)
+        exported = await send_orders_export(
+            ctx.bot, ctx.chat_id, async_session_factory, fmt, ctx.run_cpu, progress=progress
         )
-        
-        in_progress_cnt = await session.scalar(
-            select(func.count()).select_from(Order).where(Order.status == "в процессе")
+        return f"Выгружено заказов: {exported}"
+
+    await _submit_job(call, f"Выгрузка заказов ({fmt.upper()})", job)
+
+
+async def _submit_job(call: CallbackQuery, title: str, func) -> None:
+    job = runner.submit(call.bot, call.message.chat.id, title, func)
+    if job is None:
+        await call.answer("Слишком много задач в очереди, попробуйте позже.", show_alert=True)
+        return
+    await call.answer(f"Задача #{job.id} поставлена в очередь")
+
+
+@router.message(Command("rebuild_stats"))
+async def rebuild_stats(message: Message) -> None:
+    async with db_session() as session:
+        await stats.rebuild(session)
+        await session.commit()
+    await message.answer("✅ Счётчики статистики пересчитаны.")
+
+
+@router.callback_query(F.data == "export_stats_data")
+async def export_stats_data(call: CallbackQuery) -> None:
+    async def job(ctx: JobContext) -> None:
+        async with async_session_factory() as session:
+            summary = await stats.summary(session)
+
+        await ctx.progress("Формируем файлы…")
+        excel = await ctx.run_cpu(render_stats_xlsx, summary)
+        json_data = await ctx.run_cpu(render_stats_json, summary)
+
+        await ctx.bot.send_document(
+            ctx.chat_id,
+            BufferedInputFile(excel, filename="bot_statistics.xlsx"),
+            caption="📊 Сводная статистика бота (Excel)",
         )
-        completed_cnt = await session.scalar(
-            select(func.count()).select_from(Order).where(Order.status == "выполнен")
+        await ctx.bot.send_document(
+            ctx.chat_id,
+            BufferedInputFile(json_data, filename="bot_statistics.json"),
+            caption="📊 Сводная статистика бота (JSON)",
         )
-        canceled_cnt = await session.scalar(
-            select(func.count()).select_from(Order).where(Order.status == "отменен")
+
+    await _submit_job(call, "Статистика в Excel и JSON", job)
+
+
+@router.message(Command("jobs"))
+async def list_jobs(message: Message) -> None:
+    jobs = runner.active(message.chat.id)
+    if not jobs:
+        await message.answer("Активных задач нет.")
+        return
+    builder = InlineKeyboardBuilder()
+    lines = ["<b>Активные задачи</b>\n"]
+    for job in jobs:
+        lines.append(f"#{job.id} {job.title} — {STATUS_TEXT[job.status]}")
+        builder.button(text=f"🚫 Отменить #{job.id}", callback_data=f"job_cancel:{job.id}")
+    builder.adjust(1)
+    await message.answer("\n".join(lines), reply_markup=builder.as_markup(), parse_mode="HTML")
+
+
+@router.callback_query(F.data.startswith("job_cancel:"))
+async def cancel_job(call: CallbackQuery) -> None:
+    job_id = int(call.data.split(":", 1)[1])
+    if runner.cancel(job_id):
+        await call.answer(f"Задача #{job_id} отменяется")
+    else:
+        await call.answer("Задача уже завершена.", show_alert=True)
+
+
+@router.message(Command("db_pool"))
+async def show_db_pool(message: Message) -> None:
+    s = db_pool.snapshot(engine.sync_engine)
+    lines = ["<b>Пул соединений БД</b>\n"]
+    if "size" in s:
+        lines.append(
+            f"Занято: {s['in_use']} из {s['size']} (+{s['overflow']} сверх пула, "
+            f"максимум +{s['max_overflow']}), свободно: {s['idle']}"
         )
-        
-        average_order_value = revenue / orders_cnt if orders_cnt > 0 else 0
-
-    data = {
-        "Показатель": [
-            "Всего пользователей",
-            "Всего заказов",
-            "Сумма заказов",
-            "Новых пользователей сегодня",
-            "Заказы в процессе",
-            "Выполненные заказы",
-            "Отмененные заказы",
-            "Средний чек"
-        ],
-        "Значение": [
-            users_cnt,
-            orders_cnt,
-            revenue,
-            new_users_cnt,
-            in_progress_cnt,
-            completed_cnt,
-            canceled_cnt,
-            f"{average_order_value:.2f} ₽"
-        ]
-    }
+    lines += [
+        f"Пик занятых: {s['peak_in_use']}",
+        f"Выдач соединения: {s['checkouts']}",
+        f"Ожидание: в среднем {s['wait_avg'] * 1000:.1f} мс, максимум {s['wait_max'] * 1000:.1f} мс",
+        f"Открыто сверх пула: {s['overflow_opened']}",
+        f"Таймаутов ожидания: {s['timeouts']}",
+    ]
+    # Пики считаются с прошлого просмотра — удобно смотреть по часам
+    db_pool.pool_stats.reset_peaks()
+    await message.answer("\n".join(lines), parse_mode="HTML")
 
-    df = pd.DataFrame(data)
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as temp_file:
-        with pd.ExcelWriter(temp_file.name, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Статистика')
-        
-        input_file_excel = FSInputFile(temp_file.name, filename="bot_statistics.xlsx")
-
-    json_data = {
-        "statistics": {
-            "users_count": users_cnt,
-            "orders_count": orders_cnt,
-            "revenue": revenue,
-            "new_users_today": new_users_cnt,
-            "in_progress_orders": in_progress_cnt,
-            "completed_orders": completed_cnt,
-            "canceled_orders": canceled_cnt,
-            "average_order_value": average_order_value
-        }
-    }
+# ================================
+# /broadcast
+# ================================
+
+BROADCAST_AUDIENCES = {
+    "all": "всем пользователям",
+    "subscribers": "пользователям с активной подпиской",
+}
+
+
+@router.message(Command("broadcast"))
+@router.message(F.text == "📣 Рассылка")
+async def broadcast_start(message: Message, state: FSMContext) -> None:
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        InlineKeyboardButton(text="👥 Всем", callback_data="bc_aud:all"),
+        InlineKeyboardButton(text="🤩 Подписчикам", callback_data="bc_aud:subscribers"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="bc_cancel"),
+    )
+    builder.adjust(2)
+    await message.answer("Кому отправить рассылку?", reply_markup=builder.as_markup())
+    await state.set_state(BroadcastSG.waiting_for_audience)
 
-    with tempfile.NamedTemporaryFile(delete=False, mode='w', suffix=".json", encoding='utf-8') as temp_json_file:
-        json.dump(json_data, temp_json_file, default=serialize_decimal, ensure_ascii=False, indent=4)
-        temp_json_file.flush()  
 
-        input_file_json = FSInputFile(temp_json_file.name, filename="bot_statistics.json")
+@router.callback_query(F.data == "bc_cancel")
+async def broadcast_cancel(call: CallbackQuery, state: FSMContext) -> None:
+    await call.answer("Отменено.")
+    await state.clear()
+    await call.message.delete()
+    await call.message.answer("Рассылка отменена.")
+
+
+@router.callback_query(BroadcastSG.waiting_for_audience, F.data.startswith("bc_aud:"))
+async def broadcast_set_audience(call: CallbackQuery, state: FSMContext) -> None:
+    await call.answer()
+    audience = call.data.split(":", 1)[1]
+    if audience not in BROADCAST_AUDIENCES:
+        return
+    await state.update_data(audience=audience)
+    await call.message.edit_text(
+        f"Рассылка {BROADCAST_AUDIENCES[audience]}.\nПришлите текст сообщения:"
+    )
+    await state.set_state(BroadcastSG.waiting_for_text)
+
+
+@router.message(BroadcastSG.waiting_for_text, F.text)
+async def broadcast_set_text(message: Message, state: FSMContext) -> None:
+    await state.update_data(text=message.html_text)
+    data = await state.get_data()
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        InlineKeyboardButton(text="🚀 Запустить", callback_data="bc_start"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="bc_cancel"),
+    )
+    await message.answer(
+        f"<b>Предпросмотр рассылки ({BROADCAST_AUDIENCES[data['audience']]}):</b>\n\n"
+        f"{message.html_text}",
+        reply_markup=builder.as_markup(),
+        parse_mode="HTML",
+    )
+    await state.set_state(BroadcastSG.confirmation)
+
 
-    await call.message.answer_document(
-        document=input_file_excel,
-        caption="📊 Сводная статистика бота (Excel)"
+@router.callback_query(BroadcastSG.confirmation, F.data == "bc_start")
+async def broadcast_launch(call: CallbackQuery, state: FSMContext) -> None:
+    await call.answer()
+    data = await state.get_data()
+    await state.clear()
+    broadcast_id = await broadcasts.create(data["text"], data["audience"], call.from_user.id)
+    await broadcasts.start(call.bot, broadcast_id)
+    await call.message.edit_reply_markup()
+    await call.message.answer(
+        f"📣 Рассылка #{broadcast_id} запущена. Итог придёт сюда, "
+        "ход можно посмотреть командой /broadcasts."
     )
-    await call.message.answer_document(
-        document=input_file_json,
-        caption="📊 Сводная статистика бота (JSON)"
+
+
+@router.message(Command("broadcasts"))
+async def broadcast_list(message: Message) -> None:
+    async with db_session() as session:
+        campaigns = (
+            await session.scalars(select(Broadcast).order_by(Broadcast.id.desc()).limit(10))
+        ).all()
+
+    if not campaigns:
+        await message.answer("Рассылок пока не было.")
+        return
+
+    statuses = {"running": "идёт", "done": "завершена", "canceled": "остановлена"}
+    kb = InlineKeyboardBuilder()
+    lines = []
+    for campaign in campaigns:
+        lines.append(
+            f"#{campaign.id} — {statuses.get(campaign.status, campaign.status)}: "
+            f"✅ {campaign.delivered} 🚫 {campaign.blocked} ⚠️ {campaign.failed}"
+        )
+        if campaign.status == "running":
+            kb.add(
+                InlineKeyboardButton(
+                    text=f"⛔ Остановить #{campaign.id}",
+                    callback_data=f"bc_stop:{campaign.id}",
+                )
+            )
+    kb.adjust(1)
+    await message.answer(
+        "<b>Рассылки:</b>\n" + "\n".join(lines),
+        reply_markup=kb.as_markup(),
+        parse_mode="HTML",
     )
-    os.remove(temp_file.name)
-    os.remove(temp_json_file.name)
+
+
+@router.callback_query(F.data.startswith("bc_stop:"))
+async def broadcast_stop(call: CallbackQuery) -> None:
+    broadcast_id = int(call.data.split(":", 1)[1])
+    await broadcasts.cancel(broadcast_id)
+    await call.answer(f"Рассылка #{broadcast_id} остановлена.", show_alert=True)
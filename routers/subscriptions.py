@@ -2,9 +2,7 @@
 from __future__ import annotations
 from datetime import datetime, timedelta, timezone
 import logging
-from dotenv import load_dotenv
-import os
-from aiogram import F, Router
+from aiogram import F
 from aiogram.types import CallbackQuery, InlineKeyboardButton, Message, LabeledPrice
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardMarkup
@@ -13,21 +11,20 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from models import Subscription, User
-from main import async_session_factory
+from middlewares import db_session
+from cache import subscriptions
 
 from keyboard import get_main_reply_keyboard
+from routing import IndexedRouter
 
 
 # --------------------------------------------------------------------------- #
 #                               Константы                                     #
 # --------------------------------------------------------------------------- #
 
-load_dotenv()
+from config import SUB_DURATION_DAYS, SUB_PRICE_STARS
 
-SUB_DURATION_DAYS = int(os.getenv('SUB_DURATION_DAYS'))
-SUB_PRICE_STARS = int(os.getenv('SUB_PRICE_STARS'))
-
-router = Router()
+router = IndexedRouter()
 
 # --------------------------------------------------------------------------- #
 #                                 Статус                                      #
@@ -37,7 +34,7 @@ invoice_message_ids = {}
 
 @router.message(F.text == "🤩 Подписка")
 async def show_subscription(message: Message) -> None:
-    async with async_session_factory() as session:
+    async with db_session() as session:
         user = await session.scalar(
             select(User).where(User.tg_id == message.from_user.id)
         )
@@ -119,7 +116,7 @@ async def back_to_main_menu(callback: CallbackQuery) -> None:
 # --------------------------------------------------------------------------- #
 
 async def buy_subscription(message: Message) -> None:
-    async with async_session_factory() as session:
+    async with db_session() as session:
         user = await session.scalar(
             select(User).where(User.tg_id == message.chat.id)
         )
@@ -142,18 +139,11 @@ async def buy_subscription(message: Message) -> None:
             )
         )
         await session.commit()
+    subscriptions.set(message.chat.id, new_end)
     await message.answer(
         f"✅ Подписка активирована до <b>{new_end:%d.%m.%Y}</b>.\n"
         "Скидка 15 % применяется автоматически при заказе."
     )
 
 async def check_sub(user_id: int) -> bool:
-    async with async_session_factory() as session:
-        user = await session.scalar(
-            select(User).where(User.tg_id == user_id)
-        )
-        if not user:
-            return False
-
-        now = datetime.now(timezone.utc)
-        return user.subscription_end and user.subscription_end > now
\ No newline at end of file
+    return await subscriptions.is_active(user_id)
@@ -1,13 +1,13 @@
 from __future__ import annotations
 import logging
 from decimal import Decimal
+from functools import partial
 import types
 from typing import Dict
 import re
-from dotenv import load_dotenv
-import os
-from aiogram import F, Router
+from aiogram import F
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -27,23 +27,26 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from main import admin_id, async_session_factory
-from models import Category, Order, OrderItem, Product, User
+from config import PAY_PROVIDER_TOKEN, admin_id
+from debounce import cart_renders
+from middlewares import db_session
+from models import User
+from cache import catalog
+from outbox import enqueue, outbox
+import querylog
+import stats
+from checkout import place_order
 from routers.subscriptions import buy_subscription, check_sub
-from keyboard import get_main_reply_keyboard
+from keyboard import category_keyboard, get_main_reply_keyboard, menu_keyboard
+from routing import IndexedRouter
 
 
-router = Router()
+router = IndexedRouter()
 
 # --------------------------------------------------------------------------- #
 #                               Константы / FSM                               #
 # --------------------------------------------------------------------------- #
 
-load_dotenv()
-
-PAY_PROVIDER_TOKEN = os.getenv('PAY_PROVIDER_TOKEN')
-
-
 class RegisterSG(StatesGroup):
     waiting_for_phone = State()
 
@@ -64,7 +67,7 @@ def _get_cart(data: dict) -> Dict[int, int]:
 
 
 async def _sync_user(message: Message) -> User:
-    async with async_session_factory() as session:
+    async with db_session() as session:
         user = await session.scalar(
             select(User).where(User.tg_id == message.chat.id)
         )
@@ -74,6 +77,7 @@ async def _sync_user(message: Message) -> User:
                 full_name=message.chat.full_name,
             )
             session.add(user)
+            await stats.user_created(session)
             await session.commit()
 
     return user
@@ -107,7 +111,7 @@ async def save_phone(message: Message, state: FSMContext) -> None:
     if not message.contact or message.contact.user_id != message.from_user.id:
         await message.answer("Пожалуйста, используйте кнопку для отправки контакта.")
         return
-    async with async_session_factory() as session:
+    async with db_session() as session:
         user = await session.scalar(select(User).where(User.tg_id == message.from_user.id))
         if user:
             user.phone = message.contact.phone_number
@@ -121,39 +125,20 @@ async def save_phone(message: Message, state: FSMContext) -> None:
 #                                 /menu                                       #
 # --------------------------------------------------------------------------- #
 @router.message(Command("menu"))
-@router.message(lambda message: message.text == "📋 Открыть меню")
+@router.message(F.text == "📋 Открыть меню")
 async def cmd_menu(message: Message) -> None:
-    async with async_session_factory() as session:
-        categories = await session.scalars(select(Category).order_by(Category.id))
-        categories = categories.all()
+    markup = await menu_keyboard()
 
-    if not categories:
+    if markup is None:
         await message.answer("Меню пока пусто. Попробуйте позже.")
         return
 
-    kb = InlineKeyboardBuilder()
-    buttons = []
-    for cat in categories:
-        buttons.append(
-            InlineKeyboardButton(
-                text=cat.title,
-                callback_data=f"cat_{cat.id}",
-            )
-        )
-    kb.add(*buttons)
-    kb.row(
-        InlineKeyboardButton(
-            text="⬅️ Назад",
-            callback_data="exit_menu",
-        )
-    )
-
-    kb.adjust(2)
-    await message.answer("Выберите категорию:\nНажмите ⬅️ чтобы вернуться на главную страницу.", reply_markup=kb.as_markup())
+    await message.answer("Выберите категорию:\nНажмите ⬅️ чтобы вернуться на главную страницу.", reply_markup=markup)
 
 
 @router.callback_query(F.data == "exit_menu")
 async def cb_exit_menu(call: CallbackQuery) -> None:
+    cart_renders.cancel(_render_key(call.message))
     await call.message.delete()
     await call.message.answer("👋 Добро пожаловать!", reply_markup=get_main_reply_keyboard(call.from_user.id))
 
@@ -166,52 +151,18 @@ async def cb_exit_menu(call: CallbackQuery) -> None:
 @router.callback_query(F.data.startswith("cat_"))
 async def cb_open_category(call: CallbackQuery) -> None:
     cat_id = int(call.data.split("_")[1])
-    async with async_session_factory() as session:
-        products = await session.scalars(
-            select(Product)
-            .where(Product.category_id == cat_id, Product.is_active.is_(True))
-            .order_by(Product.id)
-        )
-        products = products.all()
+    markup = await category_keyboard(cat_id, call.from_user.id in admin_id)
 
-    if not products:
+    if markup is None:
         await call.answer("Пустая категория 🙁", show_alert=True)
         return
     try:
         await call.message.delete()
     except Exception:
         pass
-    product_kb = InlineKeyboardBuilder()
-    buttons = [
-        InlineKeyboardButton(
-            text=prod.title,
-            callback_data=f"show_product_details:{prod.id}",
-        ) for prod in products
-    ]
-    for i in range(0, len(buttons), 2):
-        product_kb.row(*buttons[i:i+2])
-    if call.from_user.id in admin_id:
-        product_kb.row(
-            InlineKeyboardButton(
-                text="Редактировать категорию",
-                callback_data=f"edit_cat:{cat_id}",
-            )
-        )
-        product_kb.row(
-            InlineKeyboardButton(
-                text="Удалить категорию",
-                callback_data=f"remove_cat:{cat_id}",
-            )
-        )
-    product_kb.row(
-        InlineKeyboardButton(
-            text="⬅️ Назад",
-            callback_data="exit_cart",
-        )
-    )
     await call.message.answer(
         "Выберите товар:",
-        reply_markup=product_kb.as_markup(resize_keyboard=True),
+        reply_markup=markup,
     )
     await call.answer()
 
@@ -220,11 +171,10 @@ async def cb_open_category(call: CallbackQuery) -> None:
 @router.callback_query(F.data.startswith("show_product_details:"))
 async def show_product_details(call: CallbackQuery) -> None:
     prod_id = int(call.data.split(":")[1])
-    async with async_session_factory() as session:
-        product = await session.get(Product, prod_id)
-        if not product:
-            await call.answer("Товар не найден.", show_alert=True)
-            return
+    product = await catalog.product(prod_id)
+    if not product:
+        await call.answer("Товар не найден.", show_alert=True)
+        return
     try:
         await call.message.delete()
     except Exception:
@@ -278,8 +228,7 @@ async def cb_add_product(call: CallbackQuery, state: FSMContext) -> None:
     except Exception:
         pass
 
-    async with async_session_factory() as session:
-        product = await session.get(Product, prod_id)
+    product = await catalog.product(prod_id)
 
     if not product or not product.is_active:
         await call.answer("Товар недоступен", show_alert=True)
@@ -329,26 +278,35 @@ async def cb_cart(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer()      
 
 @router.message(Command("cart"))
-@router.message(lambda message: message.text == "🛒 Корзина")
+@router.message(F.text == "🛒 Корзина")
 async def cmd_cart(message: Message, state: FSMContext) -> None:
+    text, markup = await _cart_view(message.chat.id, state)
+    if markup is EMPTY_CART_KEYBOARD:
+        await message.answer(text, reply_markup=markup)
+        return
+
+    try:
+        await message.edit_text(text, reply_markup=markup)
+    except:
+        await message.answer(text, reply_markup=markup)
+
+
+EMPTY_CART_TEXT = "Ваша корзина пуста.\nНажмите 📋 чтобы открыть меню.\nНажмите 🏠 чтобы открыть главную страницу."
+EMPTY_CART_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="📋 Меню", callback_data="exit_cart"),
+    InlineKeyboardButton(text="🏠 Главная страница", callback_data="exit_menu"),
+]])
+
+
+async def _cart_view(chat_id: int, state: FSMContext) -> tuple[str, InlineKeyboardMarkup]:
     data = await state.get_data()
     cart = _get_cart(data)
-
-    kb = InlineKeyboardBuilder()
     if not cart:
-        kb.add(InlineKeyboardButton(text="📋 Меню", callback_data="exit_cart"))
-        kb.add(InlineKeyboardButton(text="🏠 Главная страница", callback_data="exit_menu"))
-        await message.answer("Ваша корзина пуста.\nНажмите 📋 чтобы открыть меню.\nНажмите 🏠 чтобы открыть главную страницу.", reply_markup=kb.as_markup())
-        return
-        
-    async with async_session_factory() as session:
-        products: Dict[int, Product] = {
-            p.id: p
-            async for p in await session.stream_scalars(
-                select(Product).where(Product.id.in_(cart.keys()))
-            )
-        }
+        return EMPTY_CART_TEXT, EMPTY_CART_KEYBOARD
+
+    products = await catalog.products(cart.keys())
 
+    kb = InlineKeyboardBuilder()
     lines = []
     total = Decimal(0)
     for pid, qty in cart.items():
@@ -367,25 +325,37 @@ async def cmd_cart(message: Message, state: FSMContext) -> None:
 
     kb.row(InlineKeyboardButton(text="➕ Добавить в заказ", callback_data="exit_cart"))
     kb.row(InlineKeyboardButton(text="✅ Оформить заказ", callback_data="checkout"))
-    kb.row(InlineKeyboardButton(text="🏠 Главная страница", callback_data="exit_menu")) 
+    kb.row(InlineKeyboardButton(text="🏠 Главная страница", callback_data="exit_menu"))
 
     sale_total = (total * Decimal("0.85")).quantize(Decimal("0.01"))
     total_text = (
         f"\n\n<b>Итого: {total} ₽</b>"
-        if not await check_sub(message.chat.id)
+        if not await check_sub(chat_id)
         else f"\n\n<b>Итого: <s>{total}</s> {sale_total} ₽</b>"
     )
-    text = "\n".join(lines) + total_text
+    return "\n".join(lines) + total_text, kb.as_markup()
+
+
+def _render_key(message: Message) -> tuple[int, int]:
+    return message.chat.id, message.message_id
 
-    try:
-        await message.edit_text(text, reply_markup=kb.as_markup())
-    except:
-        await message.answer(text, reply_markup=kb.as_markup())
 
+async def _rerender_cart(message: Message, state: FSMContext) -> None:
+    """Перерисовать сообщение корзины по текущему состоянию (из cart_renders)."""
+    with querylog.scope("render_cart"):
+        text, markup = await _cart_view(message.chat.id, state)
+    try:
+        await message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest:
+        # «message is not modified» — нажатия за окно вернули корзину к уже
+        # показанной; сообщения нет или его нельзя править — корзину уже
+        # закрыли, присылать её заново не нужно
+        pass
 
 
 @router.callback_query(F.data == "exit_cart")
 async def cb_exit_cart(call: CallbackQuery, state: FSMContext) -> None:
+    cart_renders.cancel(_render_key(call.message))
     await call.message.delete()  
     await cmd_menu(call.message) 
     await call.answer()
@@ -412,19 +382,12 @@ async def cb_edit_cart(call: CallbackQuery, state: FSMContext) -> None:
         del cart[pid]
 
     await state.update_data(cart=cart)
-    if not cart:
-        kb = InlineKeyboardBuilder()
-        kb.add(InlineKeyboardButton(text="📋 Меню", callback_data="exit_cart"))
-        kb.add(InlineKeyboardButton(text="🏠 Главная страница", callback_data="exit_menu"))
-        try:
-            await call.message.edit_text("Ваша корзина пуста.\nНажмите 📋 чтобы открыть меню.\nНажмите 🏠 чтобы открыть главную страницу.", reply_markup=kb.as_markup())
-        except:
-            await call.message.answer("Ваша корзина пуста.\nНажмите 📋 чтобы открыть меню.\nНажмите 🏠 чтобы открыть главную страницу.", reply_markup=kb.as_markup())
-        await call.answer("Корзина пуста")
-        return
-
-    await call.answer("Корзина обновлена")
-    await cmd_cart(call.message, state) 
+    await call.answer("Корзина обновлена" if cart else "Корзина пуста")
+    # Серия нажатий перерисовывает сообщение раз в CART_RENDER_WINDOW
+    cart_renders.schedule(
+        _render_key(call.message),
+        partial(_rerender_cart, call.message, state),
+    )
 
 
 # --------------------------------------------------------------------------- #
@@ -436,13 +399,7 @@ async def cb_checkout(call: CallbackQuery, state: FSMContext) -> None:
     data = await state.get_data()
     cart = _get_cart(data)
 
-    async with async_session_factory() as session:
-        products: dict[int, Product] = {
-            p.id: p
-            async for p in await session.stream_scalars(
-                select(Product).where(Product.id.in_(cart.keys()))
-            )
-        }
+    products = await catalog.products(cart.keys())
 
     total = Decimal(0)
     for pid, qty in cart.items():
@@ -463,6 +420,9 @@ async def cb_checkout(call: CallbackQuery, state: FSMContext) -> None:
         )
         return
 
+    # Сообщение корзины дальше удаляется — отложенная перерисовка ему не нужна
+    cart_renders.cancel(_render_key(call.message))
+
     kb_back = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="⬅️ Назад", callback_data="cart_del_cart")]
     ])
@@ -645,17 +605,13 @@ async def choose_payment(call: CallbackQuery, state: FSMContext) -> None:
     has_subscription = await check_sub(user_id)
     discount_rate = Decimal("0.15") if has_subscription else Decimal("0.0")
 
-    async with async_session_factory() as session:
-        products: Dict[int, Product] = {
-            p.id: p
-            async for p in await session.stream_scalars(
-                select(Product).where(Product.id.in_(cart.keys()))
-            )
-        }
+    products = await catalog.products(cart.keys())
 
     prices: list[LabeledPrice] = []
     for pid, qty in cart.items():
-        prod = products[pid]
+        prod = products.get(pid)
+        if not prod:
+            continue
         item_total = prod.price * qty
         if has_subscription:
             item_total *= (1 - discount_rate)
@@ -696,7 +652,7 @@ async def pre_checkout_qh(query: PreCheckoutQuery) -> None:
     await query.answer(ok=True)
 
 
-@router.message(lambda m: m.successful_payment is not None)
+@router.message(F.successful_payment)
 async def successful_payment(message: Message, state: FSMContext) -> None:
     data = await state.get_data()
     invoice_message_id = data.get("invoice_message_id")
@@ -725,61 +681,41 @@ async def _finalize_order(
     data = await state.get_data()
     cart = _get_cart(data)
     address = data["address"]
-    user_id = message.chat.id  
-    has_subscription = await check_sub(user_id) 
-    discount_rate = Decimal("0.15") if has_subscription else Decimal("0.0") 
-    
-    async with async_session_factory() as session:
-        products_map: Dict[int, Product] = {
-            p.id: p
-            async for p in await session.stream_scalars(
-                select(Product).where(Product.id.in_(cart.keys()))
-            )
-        }
-        total_without_discount = Decimal(
-            sum(products_map[pid].price * qty for pid, qty in cart.items())
-        )
-        total_with_discount = (total_without_discount * (Decimal("1") - discount_rate)).quantize(Decimal("0.01"))
-
-        total = total_with_discount if has_subscription else total_without_discount
-         
-        db_user = await session.scalar(
-            select(User).where(User.tg_id == message.chat.id)
-        )
-
-        comment = data.get("comment", "Комментарий не указан.")
-        product_titles = [products_map[pid].title for pid in cart.keys()]
-        title = ", ".join(product_titles) if product_titles else "Нет названия"
-
-        order = Order(
-            user_id=db_user.id,
-            status="принят в обработку",
-            payment_method="оплачен онлайн" if pay_online else "оплата оффлайн",
-            total_price=total,
-            comment=comment,
-            title=title,
+    user_id = message.chat.id
+    comment = data.get("comment", "Комментарий не указан.")
+    products = await catalog.products(cart.keys())
+
+    async with db_session() as session:
+        order = await place_order(
+            session,
+            user_id,
+            cart,
+            products,
             address=address,
+            comment=comment,
+            pay_online=pay_online,
         )
-        session.add(order)
-        await session.flush()  
-
-        for pid, qty in cart.items():
-            prod = products_map[pid]
-            session.add(
-                OrderItem(
-                    order_id=order.id,
-                    product_id=pid,
-                    qty=qty,
-                    item_price=prod.price,  
-                    title=prod.title,
-                )
-            )
+        total_without_discount = order.total_without_discount
+        total_with_discount = order.total_with_discount
+        product_list = "\n".join(f"{title} x {qty} шт." for title, qty in order.lines)
+        notify_text = (
+            f"🆕 Новый заказ #{order.id}\n\n"
+            f"👤 Пользователь: {message.chat.full_name} ({message.chat.id})\n\n"
+            f"📞 Телефон: {order.user_phone}\n\n"
+            f"🛍️ Продукты:\n{product_list}\n\n"
+            f"💰 Сумма без скидки: {total_without_discount} ₽\n"
+            f"💸 Сумма со скидкой: {total_with_discount} ₽\n\n"
+            f"📝 Комментарий к заказу: {comment}\n\n"
+            f"🏠 Адрес: {address}\n\n"
+            f"💳 Оплата: {'Онлайн' if pay_online else 'При получении'}"
+        )
+        # Уведомления админам уходят через outbox в той же транзакции, что и заказ
+        for admin_ids in admin_id:
+            enqueue(session, admin_ids, notify_text)
 
         await session.commit()
+    outbox.wake()
 
-    product_list = "\n".join(
-        f"{products_map[pid].title} x {qty} шт." for pid, qty in cart.items()
-    )
     main_keyboard = get_main_reply_keyboard(user_id)
     await message.answer(
         "🎉 Заказ оформлен!\n\n"
@@ -792,24 +728,6 @@ async def _finalize_order(
         f"💳 Способ оплаты: {'Онлайн' if pay_online else 'При получении'}",
         reply_markup=main_keyboard
     )
-    notify_text = (
-        f"🆕 Новый заказ #{order.id}\n\n"
-        f"👤 Пользователь: {message.chat.full_name} ({message.chat.id})\n\n"
-        f"📞 Телефон: {db_user.phone}\n\n"
-        f"🛍️ Продукты:\n{product_list}\n\n"
-        f"💰 Сумма без скидки: {total_without_discount} ₽\n"
-        f"💸 Сумма со скидкой: {total_with_discount} ₽\n\n"
-        f"📝 Комментарий к заказу: {comment}\n\n"
-        f"🏠 Адрес: {address}\n\n"
-        f"💳 Оплата: {'Онлайн' if pay_online else 'При получении'}"
-    )
-    logging.info(f"Admin IDs: {admin_id}")  
-    for admin_ids in admin_id:
-        try:
-            await message.bot.send_message(admin_ids, notify_text)
-        except Exception as e:
-            logging.info(f"Ошибка отправки админу {admin_ids}: {e}")
-            pass
     await state.clear()
 
 @router.message(F.text == "💬 Поддержка")
@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import operator
+from typing import Any, Dict, Iterable, List, Tuple
+
+from aiogram import Router
+from aiogram.dispatcher.event.bases import UNHANDLED, SkipHandler
+from aiogram.dispatcher.event.handler import FilterObject, HandlerObject
+from aiogram.dispatcher.event.telegram import TelegramEventObserver
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery, Message, TelegramObject
+from magic_filter.operations import (
+    CallOperation,
+    ComparatorOperation,
+    FunctionOperation,
+    GetAttributeOperation,
+)
+from magic_filter.util import in_op
+
+# --------------------------------------------------------------------------- #
+#                    Индекс обработчиков по ключу апдейта                     #
+# --------------------------------------------------------------------------- #
+#
+# Обычный TelegramEventObserver проверяет фильтры всех обработчиков подряд,
+# пока какой-нибудь не подойдёт: для колбэка «inc_5» это десятки проверок
+# F.data.startswith(...) в трёх роутерах. IndexedRouter раскладывает
+# обработчики по ключам, которые можно вынуть из самого апдейта:
+#
+#   callback_query — точное значение data и префикс data;
+#   message        — точный текст кнопки и имя команды;
+#   оба            — состояние FSM (raw_state).
+#
+# Апдейт проверяется только на обработчиках из своих корзин плюс на тех, чьи
+# фильтры проиндексировать нельзя (regexp, F.photo, произвольные функции), —
+# в исходном порядке регистрации. Поэтому порядок срабатывания такой же, как
+# без индекса; индекс лишь не проверяет заведомо неподходящие обработчики.
+#
+# Синхронные фильтры (MagicFilter, State, lambda) aiogram вызывает через
+# asyncio.to_thread — поток на каждую проверку. Здесь они вызываются прямо в
+# event loop: все такие фильтры в боте — проверки в памяти, и поток стоит
+# дороже самой проверки. Блокирующих синхронных фильтров быть не должно.
+
+# Ключи корзин
+_DATA = "data"
+_PREFIX = "prefix"
+_TEXT = "text"
+_COMMAND = "command"
+_STATE = "state"
+
+_Route = Tuple[HandlerObject, Tuple[FilterObject, ...]]
+
+
+def _magic_keys(filter_: FilterObject, attribute: str) -> List[Tuple[str, str]] | None:
+    """Ключи для F.<attribute> == x, .startswith(x | (x, y)) и .in_([...])."""
+    if filter_.magic is None:
+        return None
+    ops = filter_.magic._operations
+    if not ops or not isinstance(ops[0], GetAttributeOperation) or ops[0].name != attribute:
+        return None
+    exact = _TEXT if attribute == "text" else _DATA
+    if len(ops) == 2 and isinstance(ops[1], ComparatorOperation):
+        if ops[1].comparator is operator.eq and isinstance(ops[1].right, str):
+            return [(exact, ops[1].right)]
+    elif len(ops) == 2 and isinstance(ops[1], FunctionOperation):
+        op = ops[1]
+        if op.function is in_op and len(op.args) == 1 and not op.kwargs:
+            values = op.args[0]
+            if isinstance(values, (list, tuple, set, frozenset)) and all(isinstance(v, str) for v in values):
+                return [(exact, v) for v in values]
+    elif (
+        len(ops) == 3
+        and attribute == "data"
+        and isinstance(ops[1], GetAttributeOperation)
+        and ops[1].name == "startswith"
+        and isinstance(ops[2], CallOperation)
+        and len(ops[2].args) == 1
+        and not ops[2].kwargs
+    ):
+        prefixes = ops[2].args[0]
+        if isinstance(prefixes, str):
+            prefixes = (prefixes,)
+        if isinstance(prefixes, tuple) and prefixes and all(isinstance(p, str) and p for p in prefixes):
+            return [(_PREFIX, p) for p in prefixes]
+    return None
+
+
+def _command_keys(filter_: FilterObject) -> List[Tuple[str, str]] | None:
+    command = filter_.callback
+    if not isinstance(command, Command):
+        return None
+    if command.prefix != "/" or command.ignore_case or command.magic is not None:
+        return None
+    if not all(isinstance(c, str) for c in command.commands):
+        return None
+    return [(_COMMAND, c) for c in command.commands]
+
+
+def _state_keys(filter_: FilterObject) -> List[Tuple[str, str | None]] | None:
+    callback = filter_.callback
+    if isinstance(callback, State):
+        states: Iterable[Any] = (callback,)
+    elif isinstance(callback, StateFilter):
+        states = callback.states
+    else:
+        return None
+    keys = []
+    for state in states:
+        if isinstance(state, State):
+            state = state.state
+        if not (state is None or isinstance(state, str)) or state == "*":
+            return None
+        keys.append((_STATE, state))
+    return keys
+
+
+def _route_keys(
+    event_name: str, handler: HandlerObject
+) -> Tuple[List[Tuple[str, Any]] | None, Tuple[FilterObject, ...]]:
+    """Ключи обработчика и фильтры, которые остаётся проверить.
+
+    Сработавший по ключу MagicFilter дальше не проверяется: совпадение ключа
+    и есть его результат. Command и состояние проверяются всё равно — Command
+    кладёт в данные обработчика ``command``.
+    """
+    filters = tuple(handler.filters or ())
+    attribute = "data" if event_name == "callback_query" else "text"
+    for i, filter_ in enumerate(filters):
+        keys = _magic_keys(filter_, attribute)
+        if keys:
+            return keys, filters[:i] + filters[i + 1:]
+    if event_name == "message":
+        for filter_ in filters:
+            keys = _command_keys(filter_)
+            if keys:
+                return keys, filters
+    for filter_ in filters:
+        keys = _state_keys(filter_)
+        if keys:
+            return keys, filters
+    return None, filters
+
+
+class RouteIndex:
+    def __init__(self, event_name: str, handlers: List[HandlerObject]) -> None:
+        self.size = len(handlers)
+        self.routes: List[_Route] = []
+        self.buckets: Dict[Tuple[str, Any], List[int]] = {}
+        self.fallback: List[int] = []
+        for position, handler in enumerate(handlers):
+            keys, filters = _route_keys(event_name, handler)
+            self.routes.append((handler, filters))
+            if keys is None:
+                self.fallback.append(position)
+                continue
+            for key in keys:
+                self.buckets.setdefault(key, []).append(position)
+        # Длины префиксов: по одному срезу и поиску в словаре на каждую длину
+        self.prefix_lengths = sorted({len(p) for kind, p in self.buckets if kind == _PREFIX}, reverse=True)
+        self._merged: Dict[Tuple[Tuple[str, Any], ...], Tuple[_Route, ...]] = {}
+
+    def keys(self, event: TelegramObject, raw_state: str | None) -> Tuple[Tuple[str, Any], ...]:
+        keys = [(_STATE, raw_state)]
+        if isinstance(event, CallbackQuery):
+            data = event.data
+            if data is not None:
+                keys.append((_DATA, data))
+                for length in self.prefix_lengths:
+                    if len(data) >= length:
+                        keys.append((_PREFIX, data[:length]))
+        elif isinstance(event, Message):
+            if event.text is not None:
+                keys.append((_TEXT, event.text))
+            text = event.text or event.caption
+            if text and text[0] == "/":
+                parts = text[1:].split(maxsplit=1)
+                keys.append((_COMMAND, parts[0].split("@", 1)[0] if parts else ""))
+        return tuple(key for key in keys if key in self.buckets)
+
+    def candidates(self, event: TelegramObject, raw_state: str | None) -> Tuple[_Route, ...]:
+        keys = self.keys(event, raw_state)
+        merged = self._merged.get(keys)
+        if merged is None:
+            positions = set(self.fallback)
+            for key in keys:
+                positions.update(self.buckets[key])
+            merged = tuple(self.routes[p] for p in sorted(positions))
+            # Комбинаций ключей немного: data и префиксы в ключ попадают,
+            # только если по ним есть корзина
+            if len(self._merged) < 4096:
+                self._merged[keys] = merged
+        return merged
+
+
+async def _check(filters: Tuple[FilterObject, ...], event: TelegramObject, kwargs: Dict[str, Any]):
+    data = kwargs
+    for filter_ in filters:
+        if filter_.awaitable:
+            check = await filter_.call(event, **data)
+        else:
+            check = filter_.callback(event, **filter_._prepare_kwargs(data))
+        if not check:
+            return False, data
+        if isinstance(check, dict):
+            if data is kwargs:
+                data = dict(kwargs)
+            data.update(check)
+    return True, data
+
+
+class IndexedEventObserver(TelegramEventObserver):
+    """TelegramEventObserver, который проверяет только подходящие по ключу обработчики."""
+
+    _index: RouteIndex | None = None
+
+    def index(self) -> RouteIndex:
+        # Обработчики регистрируются при импорте роутеров; если их добавили
+        # позже, индекс пересобирается
+        if self._index is None or self._index.size != len(self.handlers):
+            self._index = RouteIndex(self.event_name, self.handlers)
+        return self._index
+
+    async def trigger(self, event: TelegramObject, **kwargs: Any) -> Any:
+        for handler, filters in self.index().candidates(event, kwargs.get("raw_state")):
+            kwargs["handler"] = handler
+            result, data = await _check(filters, event, kwargs)
+            if result:
+                kwargs.update(data)
+                try:
+                    wrapped_inner = self.outer_middleware.wrap_middlewares(
+                        self._resolve_middlewares(),
+                        handler.call,
+                    )
+                    return await wrapped_inner(event, kwargs)
+                except SkipHandler:
+                    continue
+        return UNHANDLED
+
+
+class IndexedRouter(Router):
+    """Router с индексом для message и callback_query."""
+
+    def __init__(self, *, name: str | None = None) -> None:
+        super().__init__(name=name)
+        for event_name in ("message", "callback_query"):
+            observer = IndexedEventObserver(router=self, event_name=event_name)
+            setattr(self, event_name, observer)
+            self.observers[event_name] = observer
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db_utils import dialect_insert
+from models import Order, StatCounter, User
+
+
+# --------------------------------------------------------------------------- #
+#                   Счётчики статистики, обновляемые инкрементально           #
+# --------------------------------------------------------------------------- #
+#
+# Вместо COUNT/SUM по users и orders на каждый запрос статистики счётчики
+# обновляются в той же транзакции, что и сама запись (новый пользователь,
+# заказ, смена статуса). Чтение статистики — один SELECT по первичному ключу.
+
+USERS = "users"
+ORDERS = "orders"
+REVENUE = "revenue"
+
+STATUS_NEW = "принят в обработку"
+STATUS_IN_PROGRESS = "в процессе"
+STATUS_DONE = "выполнен"
+STATUS_CANCELED = "отменен"
+
+
+def status_key(status: str) -> str:
+    return f"status:{status}"
+
+
+def users_day_key(day=None) -> str:
+    day = day or datetime.now().date()
+    return f"users_day:{day.isoformat()}"
+
+
+async def bump(session: AsyncSession, deltas: Dict[str, int | Decimal]) -> None:
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    insert = dialect_insert(session)
+    stmt = insert(StatCounter)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[StatCounter.name],
+            set_={"value": StatCounter.value + stmt.excluded.value},
+        ),
+        [{"name": name, "value": delta} for name, delta in deltas.items()],
+    )
+
+
+async def user_created(session: AsyncSession) -> None:
+    await bump(session, {USERS: 1, users_day_key(): 1})
+
+
+async def order_created(session: AsyncSession, total: Decimal, status: str) -> None:
+    await bump(session, {ORDERS: 1, REVENUE: total, status_key(status): 1})
+
+
+async def order_status_changed(session: AsyncSession, old: str, new: str) -> None:
+    if old != new:
+        await bump(session, {status_key(old): -1, status_key(new): 1})
+
+
+async def read(session: AsyncSession) -> Dict[str, Decimal]:
+    names = [
+        USERS,
+        ORDERS,
+        REVENUE,
+        users_day_key(),
+        status_key(STATUS_IN_PROGRESS),
+        status_key(STATUS_DONE),
+        status_key(STATUS_CANCELED),
+    ]
+    rows = await session.execute(
+        select(StatCounter.name, StatCounter.value).where(StatCounter.name.in_(names))
+    )
+    values = dict.fromkeys(names, Decimal(0))
+    values.update({name: value for name, value in rows})
+    return values
+
+
+async def summary(session: AsyncSession) -> Dict[str, int | Decimal]:
+    values = await read(session)
+    orders_cnt = int(values[ORDERS])
+    revenue = values[REVENUE]
+    return {
+        "users_count": int(values[USERS]),
+        "orders_count": orders_cnt,
+        "revenue": revenue,
+        "new_users_today": int(values[users_day_key()]),
+        "in_progress_orders": int(values[status_key(STATUS_IN_PROGRESS)]),
+        "completed_orders": int(values[status_key(STATUS_DONE)]),
+        "canceled_orders": int(values[status_key(STATUS_CANCELED)]),
+        "average_order_value": revenue / orders_cnt if orders_cnt > 0 else Decimal(0),
+    }
+
+
+async def rebuild(session: AsyncSession) -> None:
+    """Пересчитать все счётчики по users и orders (разовая операция).
+
+    Счётчики блокируются до конца транзакции вызывающего — закоммитьте сразу.
+    """
+    # Сначала блокировка, потом подсчёт: bump() из параллельных транзакций
+    # ждёт её, и его изменение попадает либо в пересчёт (транзакция уже
+    # зафиксирована), либо применяется поверх него — но не теряется и не
+    # считается дважды. В PostgreSQL EXCLUSIVE не мешает чтению статистики;
+    # в SQLite блокировку на запись всей базы берёт уже DELETE.
+    if session.get_bind().dialect.name == "postgresql":
+        await session.execute(text(f"LOCK TABLE {StatCounter.__tablename__} IN EXCLUSIVE MODE"))
+    await session.execute(delete(StatCounter))
+
+    today = datetime.now().date()
+    users_cnt = await session.scalar(select(func.count()).select_from(User))
+    new_users_cnt = await session.scalar(
+        select(func.count()).select_from(User).where(User.created_at >= today)
+    )
+    orders_cnt, revenue = (
+        await session.execute(
+            select(func.count(), func.coalesce(func.sum(Order.total_price), 0))
+        )
+    ).one()
+    by_status = await session.execute(
+        select(Order.status, func.count()).group_by(Order.status)
+    )
+
+    counters = {
+        USERS: users_cnt,
+        users_day_key(today): new_users_cnt,
+        ORDERS: orders_cnt,
+        REVENUE: revenue,
+    }
+    counters.update({status_key(status): cnt for status, cnt in by_status})
+
+    session.add_all(StatCounter(name=name, value=value) for name, value in counters.items())
+
+
+async def ensure_initialized(session_factory) -> None:
+    async with session_factory() as session:
+        exists = await session.scalar(
+            select(StatCounter.name).where(StatCounter.name == ORDERS)
+        )
+        if exists is None:
+            await rebuild(session)
+            await session.commit()
+
+
+async def _main(argv: list[str]) -> None:
+    from db import async_session_factory, engine
+
+    if argv[1:] != ["rebuild"]:
+        print("usage: python stats.py rebuild")
+        return
+    async with async_session_factory() as session:
+        await rebuild(session)
+        await session.commit()
+    await engine.dispose()
+    print("Счётчики статистики пересчитаны")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv))
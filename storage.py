@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import json
+import logging
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import DEFAULT_DESTINY, BaseStorage, StateType, StorageKey
+from sqlalchemy import delete, func, select
+
+from config import FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL
+from db_utils import dialect_insert
+from models import FSMRecord
+
+
+# --------------------------------------------------------------------------- #
+#                        Компактная сериализация данных FSM                   #
+# --------------------------------------------------------------------------- #
+
+# Корзина {product_id: qty} хранится плоским списком [pid, qty, pid, qty, ...]:
+# так она короче, а ключи после json остаются int, а не str.
+_CART_KEY = "cart"
+_CART_TAG = "~c"
+_DECIMAL_TAG = "~d"
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, Decimal):
+        return {_DECIMAL_TAG: str(obj)}
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+
+def _object_hook(obj: dict) -> Any:
+    if len(obj) == 1 and _DECIMAL_TAG in obj:
+        return Decimal(obj[_DECIMAL_TAG])
+    return obj
+
+
+def encode_data(data: Mapping[str, Any]) -> str | None:
+    if not data:
+        return None
+    payload = dict(data)
+    cart = payload.pop(_CART_KEY, None)
+    if cart:
+        payload[_CART_TAG] = [int(x) for pair in cart.items() for x in pair]
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_data(raw: str | None) -> Dict[str, Any]:
+    if not raw:
+        return {}
+    data = json.loads(raw, object_hook=_object_hook)
+    flat = data.pop(_CART_TAG, None)
+    if flat:
+        data[_CART_KEY] = dict(zip(flat[::2], flat[1::2]))
+    return data
+
+
+def _make_key(key: StorageKey) -> str:
+    parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+    if key.thread_id:
+        parts.append(f"t{key.thread_id}")
+    if key.business_connection_id:
+        parts.append(f"b{key.business_connection_id}")
+    if key.destiny != DEFAULT_DESTINY:
+        parts.append(key.destiny)
+    return ":".join(parts)
+
+
+# --------------------------------------------------------------------------- #
+#                             Хранилище FSM в БД                              #
+# --------------------------------------------------------------------------- #
+
+
+class DBStorage(BaseStorage):
+    """FSM-хранилище поверх ``async_session_factory``.
+
+    Чтения обслуживаются из локального кэша, записи попадают в кэш сразу, а
+    в БД уходят пачкой раз в ``flush_interval`` секунд: пять кликов по
+    корзине подряд превращаются в один upsert. Кэш с БД не сверяется, поэтому
+    он верен, только пока апдейты одного чата обрабатывает один процесс
+    (long polling или шардирование по chat.id). Иначе — ``cached=False``:
+    каждое чтение идёт в БД, каждая запись сохраняется сразу. При штатной
+    остановке ``close()`` сбрасывает всё несохранённое.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        *,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        cache_size: int = FSM_CACHE_SIZE,
+        cached: bool = True,
+    ) -> None:
+        self._session_factory = session_factory
+        self._cached = cached
+        self._flush_interval = flush_interval
+        self._cache_size = cache_size
+        # key -> (state, data)
+        self._cache: OrderedDict[str, Tuple[Optional[str], Dict[str, Any]]] = OrderedDict()
+        self._dirty: set[str] = set()
+        self._wakeup = asyncio.Event()
+        self._flusher: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+    # ------------------------------ чтение ---------------------------------- #
+
+    async def _load(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        db_key = _make_key(key)
+        record = self._cache.get(db_key)
+        if record is not None:
+            self._cache.move_to_end(db_key)
+            return record
+
+        async with self._session_factory() as session:
+            row = (
+                await session.execute(
+                    select(FSMRecord.state, FSMRecord.data).where(FSMRecord.key == db_key)
+                )
+            ).first()
+        record = (row.state, decode_data(row.data)) if row else (None, {})
+        if not self._cached:
+            return record
+        # Пока ходили в БД, запись могла появиться из параллельного апдейта
+        record = self._cache.setdefault(db_key, record)
+        self._evict()
+        return record
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(key)
+        return state
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(key)
+        return copy.deepcopy(data)
+
+    async def state_counts(self) -> Dict[str, int]:
+        """Сколько ключей в каждом состоянии (по БД, без ещё не сброшенных)."""
+        async with self._session_factory() as session:
+            rows = await session.execute(
+                select(FSMRecord.state, func.count())
+                .where(FSMRecord.state.is_not(None))
+                .group_by(FSMRecord.state)
+            )
+            return {state: count for state, count in rows}
+
+    # ------------------------------ запись ---------------------------------- #
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self._load(key)
+        state = state.state if isinstance(state, State) else state
+        await self._put(_make_key(key), (state, data))
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        state, _ = await self._load(key)
+        await self._put(_make_key(key), (state, copy.deepcopy(dict(data))))
+
+    async def _put(self, db_key: str, record: Tuple[Optional[str], Dict[str, Any]]) -> None:
+        if not self._cached:
+            await self._write({db_key: record})
+            return
+        self._cache[db_key] = record
+        self._cache.move_to_end(db_key)
+        self._dirty.add(db_key)
+        self._ensure_flusher()
+        self._wakeup.set()
+
+    def _evict(self) -> None:
+        # Вытесняем только уже сохранённые записи
+        while len(self._cache) > self._cache_size:
+            for db_key in self._cache:
+                if db_key not in self._dirty:
+                    del self._cache[db_key]
+                    break
+            else:
+                return
+
+    # --------------------------- фоновый сброс ------------------------------ #
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Даём пачке накопиться
+            await asyncio.sleep(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.exception(f"Ошибка сохранения FSM в БД: {e}")
+                self._wakeup.set()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            keys, self._dirty = self._dirty, set()
+            try:
+                await self._write({db_key: self._cache[db_key] for db_key in keys})
+            except BaseException:
+                # Вернём ключи в очередь, чтобы не потерять изменения
+                self._dirty |= keys
+                raise
+            self._evict()
+
+    async def _write(self, records: Dict[str, Tuple[Optional[str], Dict[str, Any]]]) -> None:
+        upserts = []
+        deletes = []
+        for db_key, (state, data) in records.items():
+            if state is None and not data:
+                deletes.append(db_key)
+            else:
+                upserts.append({"key": db_key, "state": state, "data": encode_data(data)})
+
+        async with self._session_factory() as session:
+            if upserts:
+                insert = dialect_insert(session)
+                stmt = insert(FSMRecord)
+                await session.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=[FSMRecord.key],
+                        set_={
+                            "state": stmt.excluded.state,
+                            "data": stmt.excluded.data,
+                            "updated_at": func.now(),
+                        },
+                    ),
+                    upserts,
+                )
+            if deletes:
+                await session.execute(
+                    delete(FSMRecord).where(FSMRecord.key.in_(deletes))
+                )
+            await session.commit()
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
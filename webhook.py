@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+
+# --------------------------------------------------------------------------- #
+#                     Приём апдейтов через вебхук (aiohttp)                   #
+# --------------------------------------------------------------------------- #
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+UpdateSink = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class WebhookHandler:
+    """Принимает апдейты от Telegram и отдаёт их в обработку.
+
+    Ответ 200 отправляется сразу после постановки апдейта в работу, а не
+    после его обработки. Одновременно обрабатывается не больше
+    ``max_concurrency`` апдейтов; когда лимит исчерпан, ответ задерживается,
+    и Telegram сам притормаживает доставку.
+    """
+
+    def __init__(
+        self,
+        sink: UpdateSink,
+        *,
+        secret_token: str | None,
+        max_concurrency: int,
+    ) -> None:
+        self._sink = sink
+        self._secret_token = secret_token
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: set[asyncio.Task] = set()
+
+    def _verify(self, request: web.Request) -> bool:
+        if not self._secret_token:
+            return True
+        token = request.headers.get(SECRET_HEADER, "")
+        return hmac.compare_digest(token, self._secret_token)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self._verify(request):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Dict[str, Any]) -> None:
+        try:
+            await self._sink(update)
+        except Exception as e:
+            logging.exception(f"Ошибка обработки апдейта {update.get('update_id')}: {e}")
+        finally:
+            self._semaphore.release()
+
+    async def close(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def _healthcheck(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+def build_app(handler: WebhookHandler, path: str) -> web.Application:
+    app = web.Application()
+    app.router.add_post(path, handler.handle)
+    # Для балансировщика
+    app.router.add_get("/healthz", _healthcheck)
+    return app
+
+
+def dispatcher_sink(dp: Dispatcher, bot: Bot) -> UpdateSink:
+    async def sink(update: Dict[str, Any]) -> Any:
+        return await dp.feed_raw_update(bot, update)
+
+    return sink
+
+
+async def serve(app: web.Application, host: str, port: int, stop: asyncio.Event) -> None:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    logging.info(f"Вебхук слушает {host}:{port}")
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
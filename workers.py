@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing as mp
+import queue
+import signal
+from contextlib import suppress
+from typing import Any, Dict, List
+
+
+# --------------------------------------------------------------------------- #
+#          Несколько воркер-процессов с шардированием апдейтов по chat.id     #
+# --------------------------------------------------------------------------- #
+#
+# Процесс-приёмник получает апдейты (long polling или вебхук) и раскладывает
+# их по очередям воркеров: chat.id % N. Все апдейты одного чата попадают в
+# один и тот же воркер, поэтому переходы FSM пользователя остаются
+# упорядоченными, а локальные кэши воркера (FSM, подписки) согласованными.
+# Каждый воркер сам собирает Bot, engine и роутеры; общее состояние живёт в
+# БД (DBStorage), а версия каталога — в разделяемой памяти.
+
+# Разделы апдейта, в которых лежит чат или пользователь, в порядке приоритета
+_CHAT_PATHS = (
+    ("message", "chat"),
+    ("edited_message", "chat"),
+    ("callback_query", "message", "chat"),
+    ("callback_query", "from"),
+    ("pre_checkout_query", "from"),
+    ("shipping_query", "from"),
+    ("inline_query", "from"),
+    ("chosen_inline_result", "from"),
+    ("my_chat_member", "chat"),
+    ("chat_member", "chat"),
+    ("chat_join_request", "chat"),
+    ("channel_post", "chat"),
+    ("edited_channel_post", "chat"),
+)
+
+QUEUE_SIZE = 10000
+
+
+def update_chat_id(update: Dict[str, Any]) -> int | None:
+    for path in _CHAT_PATHS:
+        node: Any = update
+        for part in path:
+            node = node.get(part) if isinstance(node, dict) else None
+            if node is None:
+                break
+        else:
+            chat_id = node.get("id") if isinstance(node, dict) else None
+            if chat_id is not None:
+                return int(chat_id)
+    return None
+
+
+def shard_for(update: Dict[str, Any], shards: int) -> int:
+    chat_id = update_chat_id(update)
+    if chat_id is None:
+        return update.get("update_id", 0) % shards
+    return chat_id % shards
+
+
+# --------------------------------------------------------------------------- #
+#                                   Воркер                                    #
+# --------------------------------------------------------------------------- #
+
+def worker_main(
+    index: int, updates: mp.Queue, catalog_version, concurrency: int, logs: mp.Queue
+) -> None:
+    # Ctrl+C получает вся группа процессов; останавливаемся по сигналу приёмника
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from logsetup import forward_to
+    forward_to(logs)
+    asyncio.run(_worker(index, updates, catalog_version, concurrency))
+
+
+async def _worker(index: int, updates: mp.Queue, catalog_version, concurrency: int) -> None:
+    # Импорт внутри процесса: у каждого воркера свой engine и свой пул соединений
+    from main import build_bot, build_dispatcher
+    from db import engine
+    from cache import catalog
+
+    catalog.share_version(catalog_version)
+    bot = build_bot()
+    dp = build_dispatcher()
+    if dp["metrics_port"]:
+        dp["metrics_port"] += 1 + index
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks: set[asyncio.Task] = set()
+    loop = asyncio.get_running_loop()
+
+    async def process(update: Dict[str, Any]) -> None:
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logging.exception(f"Воркер {index}: ошибка обработки апдейта: {e}")
+        finally:
+            semaphore.release()
+
+    await dp.emit_startup(bot=bot, dispatcher=dp, **dp.workflow_data)
+    logging.info(f"Воркер {index} запущен")
+    try:
+        while True:
+            update = await loop.run_in_executor(None, updates.get)
+            if update is None:
+                break
+            await semaphore.acquire()
+            # Задачи создаются в порядке поступления, а SimpleEventIsolation
+            # выдаёт блокировку чата в том же порядке
+            task = asyncio.create_task(process(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, **dp.workflow_data)
+        await bot.session.close()
+        await engine.dispose()
+        logging.info(f"Воркер {index} остановлен")
+
+
+# --------------------------------------------------------------------------- #
+#                                  Приёмник                                   #
+# --------------------------------------------------------------------------- #
+
+class ShardedSink:
+    def __init__(self, queues: List[mp.Queue]) -> None:
+        self._queues = queues
+
+    async def __call__(self, update: Dict[str, Any]) -> None:
+        q = self._queues[shard_for(update, len(self._queues))]
+        # Очередь ограничена: если воркер не успевает, приёмник ждёт
+        while True:
+            try:
+                q.put_nowait(update)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.05)
+
+
+async def _poll(bot, dp, sink: ShardedSink, stop: asyncio.Event) -> None:
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=10, allowed_updates=allowed_updates
+            )
+        except Exception as e:
+            logging.warning(f"Ошибка getUpdates: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            await sink(update.model_dump(mode="json", exclude_none=True))
+
+
+async def run_sharded(workers: int, concurrency: int) -> None:
+    import main
+    from logsetup import listen
+
+    ctx = mp.get_context("spawn")
+    catalog_version = ctx.Value("q", 0)
+    queues = [ctx.Queue(maxsize=QUEUE_SIZE) for _ in range(workers)]
+    # Записи логов воркеров пишет listener приёмника
+    logs = ctx.Queue(maxsize=QUEUE_SIZE)
+    listen(logs)
+
+    bot = main.build_bot()
+    # Миграции — до запуска воркеров: их startup сразу читает outbox и broadcasts
+    await main.on_startup(bot)
+
+    processes = [
+        ctx.Process(
+            target=worker_main,
+            args=(i, queues[i], catalog_version, concurrency, logs),
+            name=f"bot-worker-{i}",
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    # Роутеры нужны приёмнику только чтобы вычислить allowed_updates
+    dp = main.build_dispatcher()
+    sink = ShardedSink(queues)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    try:
+        if main.RUN_MODE == "webhook":
+            from webhook import WebhookHandler, build_app, serve
+
+            await main.register_webhook(bot, dp)
+            handler = WebhookHandler(sink, secret_token=main.WEBHOOK_SECRET, max_concurrency=concurrency)
+            await serve(build_app(handler, main.WEBHOOK_PATH), main.WEBAPP_HOST, main.WEBAPP_PORT, stop)
+            await handler.close()
+        else:
+            await bot.delete_webhook(drop_pending_updates=main.DROP_PENDING_UPDATES)
+            poller = asyncio.create_task(_poll(bot, dp, sink, stop))
+            await stop.wait()
+            poller.cancel()
+            with suppress(asyncio.CancelledError):
+                await poller
+    finally:
+        for q in queues:
+            q.put(None)
+        for process in processes:
+            await loop.run_in_executor(None, process.join, 30)
+        await bot.session.close()
+        await main.engine.dispose()